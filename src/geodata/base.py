@@ -9,7 +9,6 @@ Variable and Dataset classes for handling geographical datasets.
 # numpy imports
 import numpy as np
 import numpy.ma as ma # masked arrays
-from numpy.lib.stride_tricks import as_strided
 import scipy.stats as ss
 import numbers
 import functools
@@ -22,12 +21,34 @@ from geodata.misc import checkIndex, isEqual, isInt, isNumber, AttrDict, joinDic
 from geodata.misc import genStrArray, translateSeasons
 from geodata.misc import VariableError, AxisError, DataError, DatasetError, ArgumentError
 from processing.multiprocess import apply_along_axis
-from utils.misc import histogram, binedges, detrend, percentile, tabulate
+from utils.misc import histogram, binedges, detrend, monthlyAnomalies, nanpercentile, QuantileSketch, tabulate
      
 # used for climatology and seasons
 monthlyUnitsList = ('month','months','month of the year')
 # global casting rule (for operations between arrays of different type)
 casting_rule = 'same_kind' # default since NumPy 1.7
+# target size (in bytes) of temporary arrays in block reductions
+reduce_blocksize = 2**24
+# store missing values in floating-point data as NaN in plain arrays, instead of masked arrays
+nan_storage = False
+
+def fillNaN(data, fillValue):
+  ''' Return a copy of a floating-point array, where NaN's are replaced by fillValue. '''
+  data = data.copy()
+  np.copyto(data, fillValue, where=np.isnan(data))
+  return data
+
+def broadcastView(data, shape):
+  ''' Return a read-only view of an array that is broadcast to shape, without copying (masks are broadcast
+      as well); Variables replace read-only arrays by a copy before in-place operations (copy-on-write). '''
+  if isinstance(data,ma.MaskedArray):
+    mask = data.mask
+    if mask is not ma.nomask: mask = np.broadcast_to(mask, shape)
+    view = ma.MaskedArray(np.broadcast_to(data.data, shape), mask=mask, copy=False, shrink=False)
+    view._fill_value = data._fill_value
+  else: view = np.broadcast_to(data, shape)
+  return view
+
 
 class UnaryCheckAndCreateVar(object):
   ''' Decorator class for unary arithmetic operations that implements some sanity checks and 
@@ -38,6 +59,7 @@ class UnaryCheckAndCreateVar(object):
   def __call__(self, orig, asVar=True, linplace=False, **kwargs):
     ''' Perform sanity checks, then execute operation, and return result. '''
     if not orig.data: orig.load()
+    if linplace: orig._ensureWritable() # copy-on-write
     # apply operation
     tmp = self.op(orig, linplace=linplace, **kwargs)
     # check for invalid returns (e.g. from applying arithmetic to strings)
@@ -84,13 +106,21 @@ def BinaryCheckAndCreateVar(sameUnits=True, linplace=False):
           raise VariableError, 'Variable units have to be identical for addition!'
         for lax,rax in zip(orig.axes,other.axes):
           if (lax.coord != rax.coord).any(): raise AxisError,  'Variables need to have identical coordinate arrays!'
-        if not other.data: other.load()
       elif not isinstance(other, (np.ndarray,numbers.Number,np.integer,np.inexact)): 
         raise TypeError, 'Can only operate with Variables or numerical types!'
         # N.B.: don't check ndarray shapes, because we want to allow broadcasting        
+      # deferred evaluation: build an expression instead of computing data (see geodata.lazy)
+      from geodata.lazy import LazyVar, deferBinaryOp # N.B.: circular import
+      if not linplace and ( isinstance(orig,LazyVar) or isinstance(other,LazyVar) ):
+        if isinstance(other, Variable): othername = other.name; otherunits = other.units
+        else: othername = str(other); otherunits = None
+        return deferBinaryOp(self.binOp, orig, other, othername=othername, otherunits=otherunits, 
+                             asVar=asVar, **kwargs)
       if not orig.data: orig.load()
+      if linplace: orig._ensureWritable() # copy-on-write
       # prepare arguments
       if isinstance(other, Variable):
+        if not other.data: other.load()
         otherdata = other.data_array
         othername = other.name      
         otherunits = other.units
@@ -102,6 +132,9 @@ def BinaryCheckAndCreateVar(sameUnits=True, linplace=False):
         othername = str(other)
         otherunits = None
         otherdata = np.asanyarray(other)
+      # N.B.: in-place operations on NaN-masked data would ignore masks of the other operand
+      if linplace and orig.nanmasked and isinstance(otherdata,ma.MaskedArray):
+        otherdata = otherdata.astype(orig.dtype).filled(np.NaN)
       # call original method
       try:
         data, name, units = self.binOp(orig, otherdata, othername=othername, otherunits=otherunits, 
@@ -165,6 +198,7 @@ class ReduceVar(object): # not a Variable child!!!
       if not var.data: var.load()
       # remove mask, if fill value is given (some operations don't work with masked arrays)
       if fillValue is not None and var.masked: data = var.data_array.filled(fillValue)
+      elif fillValue is not None and var.nanmasked: data = fillNaN(var.data_array, fillValue)
       else: data = var.data_array
       # apply operation without arguments, i.e. over all axes
       data, name, units = self.reduceop(var, data, **kwargs)
@@ -284,9 +318,9 @@ class Variable(object):
   '''
   
   def __init__(self, name=None, units=None, axes=None, data=None, dtype=None, mask=None, fillValue=None, 
-               atts=None, plot=None):
+               atts=None, plot=None, lnan=None):
     ''' 
-      Initialize variable and attributes.
+      Initialize variable and attributes; lnan is passed on to load() (default: nan_storage).
       
       Basic Attributes:
         name = @property # short name, e.g. used in datasets (links to atts dictionary)
@@ -318,7 +352,8 @@ class Variable(object):
         if dtype is not data.dtype: data = data.astype(dtype) # recast as new type        
 #         raise TypeError, "Declared data type '{:s}' does not match the data type of the array ({:s}).".format(str(dtype),str(data.dtype))
       else: dtype = data.dtype
-      if np.issubdtype(dtype, np.inexact) and not isinstance(data, ma.masked_array):
+      if lnan is None: lnan = nan_storage
+      if np.issubdtype(dtype, np.inexact) and not isinstance(data, ma.masked_array) and not lnan:
         data = ma.masked_invalid(data, copy=False) 
       if axes is not None and len(axes) != data.ndim: 
         raise AxisError, 'Dimensions of data array and axes are not compatible!'
@@ -343,6 +378,7 @@ class Variable(object):
     self.__dict__['plot'] = getPlotAtts(name=name, units=units, atts=atts, plot=plot)
     # set defaults - make all of them instance variables! (atts and plot are set below)
     self.__dict__['data_array'] = None
+    self.__dict__['lnanmask'] = False # set by load(), if missing values are stored as NaN
     self.__dict__['_dtype'] = dtype
     self.__dict__['_dataset'] = None # set by addVariable() method of Dataset  
     ## figure out axes
@@ -363,7 +399,7 @@ class Variable(object):
     for ax in axes: self.__dict__[ax.name] = ax
     # assign data, if present (can initialize without data)
     if data is not None: 
-      self.load(data, mask=mask, fillValue=fillValue) # member method defined below
+      self.load(data, mask=mask, fillValue=fillValue, lnan=lnan) # member method defined below
       assert self.data == ldata # should be loaded now
       
   @property
@@ -459,6 +495,12 @@ class Variable(object):
     else: masked = self.atts.get('fillValue',None) is not None
     return masked
   
+  @property
+  def nanmasked(self):
+    ''' A flag indicating if missing values are stored as NaN in a plain array (see 'nan_storage'). '''
+    return ( self.data and self.__dict__.get('lnanmask',False) and self.dtype.kind in ('f','c') 
+             and not isinstance(self.data_array,ma.MaskedArray) )
+  
   @property
   def fillValue(self):
     ''' The fillValue for masks (stored in the atts dictionary). '''
@@ -467,7 +509,10 @@ class Variable(object):
       if  fillValue is None:
         raise DataError, 'Invalid FillValue: None!'      
       elif fillValue != self.data_array._fill_value:
-        if  not np.isnan(fillValue) or not np.isnan(self.data_array._fill_value):
+        # N.B.: compare at the precision of the array, since the attribute can have higher precision
+        if np.issubdtype(self.data_array.dtype, np.inexact): lmatch = self.dtype.type(fillValue) == self.data_array._fill_value
+        else: lmatch = False
+        if not lmatch and ( not np.isnan(fillValue) or not np.isnan(self.data_array._fill_value) ):
           raise DataError, 'FillValue mismatch!' # N.B.: NaN's are never equal           
     return fillValue
   @fillValue.setter
@@ -556,6 +601,8 @@ class Variable(object):
       # N.B.: don't pass name and units as they just link to atts anyway, and if passed directly, they overwrite user atts
       args = dict(axes=self.axes, data=self.data_array, dtype=self.dtype,
                   mask=None, atts=self.atts.copy(), plot=self.plot.copy())
+      # N.B.: NaN storage is retained by copies and derived Variables (otherwise use the default)
+      if self.nanmasked: args['lnan'] = True
       if 'data' in newargs and newargs['data'] is not None: 
         newargs['dtype'] = newargs['data'].dtype
       args.update(newargs) # apply custom arguments (also arguments related to subclasses)      
@@ -668,6 +715,7 @@ class Variable(object):
     ''' Method implementing write access to data array'''
     if self.data:
       # pass on to array 
+      self._ensureWritable() # copy-on-write
       self.data_array.__setitem__(slc, data)
       # N.B.: slice doesn't have to match data, since we can just assign a subset 
     else: 
@@ -793,7 +841,8 @@ class Variable(object):
           # values and ranges are in coordinate values
           # translate coordinate values into indices
           if isinstance(axval,(tuple,list,np.ndarray)): 
-            idxslc = [ax.getIndex(idx, outOfBounds=True) for idx in axval]
+            if rngmod: idxslc = [ax.getIndex(idx, outOfBounds=True) for idx in axval]
+            else: idxslc = ax.getIndex(np.asarray(axval), outOfBounds=True).tolist() # out-of-bounds: None
             # expand ranges
             if rngmod:
               # coordinate values are inclusive, unlike indices
@@ -885,7 +934,7 @@ class Variable(object):
       # create new variable object from old, using variables copy method
       if linplace:
         self.axes = newaxes # need to sneak in new axes, or shape mismatch will cause Error
-        if data is not None: self.load(data=data)
+        if data is not None: self.load(data=data, lnan=self.nanmasked or None)
         newvar = self
       else: 
         newvar = self.copy(data=data, axes=newaxes)
@@ -903,8 +952,9 @@ class Variable(object):
       return newvar, slcs
     else: return self.slicing(lslices=False, **kwargs)
   
-  def load(self, data=None, mask=None, fillValue=None, lrecast=False, **axes):
-    ''' Method to attach numpy data array to variable instance (also used in constructor). '''
+  def load(self, data=None, mask=None, fillValue=None, lrecast=False, lnan=None, **axes):
+    ''' Method to attach numpy data array to variable instance (also used in constructor); if lnan is True 
+        (default: nan_storage), missing values in floating-point data are stored as NaN in plain arrays. '''
     # optional slicing
     if any([self.hasAxis(ax) for ax in axes.iterkeys()]):
       self, slcs = self.slicing(asVar=True, lslices=True, linplace=True, **axes) # this is poorly tested...
@@ -919,12 +969,23 @@ class Variable(object):
       if not isinstance(data,np.ndarray): raise TypeError, 'The data argument must be a numpy array!'
       if self.dtype is None: self.dtype = data.dtype
       elif data.dtype == self.dtype: pass
+      elif data.dtype.newbyteorder('=') == self.dtype: pass 
+      # N.B.: non-native byte order (e.g. memory-mapped NetCDF3 data) is accepted without copy
       elif np.issubdtype(data.dtype, self.dtype): data = data.astype(self.dtype) 
       else: 
         if lrecast: data = data.astype(self.dtype)
         else: raise DataError, "Dtypes of Variable and array are inconsistent."
-      if np.issubdtype(data.dtype, np.inexact) and not isinstance(data, ma.masked_array):
-        data = ma.masked_invalid(data, copy=False)     
+      if lnan is None: lnan = nan_storage
+      self.__dict__['lnanmask'] = bool(lnan and np.issubdtype(data.dtype, np.inexact)) # opt-in only
+      if lnan and np.issubdtype(data.dtype, np.inexact):
+        # N.B.: NaN storage mode: masked values are replaced by NaN (only copies, if values are masked)
+        if isinstance(data, ma.MaskedArray): data = data.filled(np.NaN)
+        if mask is not None: data = np.where(mask, np.NaN, data); mask = None
+        if fillValue is not None: self.atts['fillValue'] = fillValue
+      elif np.issubdtype(data.dtype, np.inexact) and not isinstance(data, ma.masked_array):
+        # N.B.: equivalent to ma.masked_invalid, but without temporary arrays (the mask is computed in-place)
+        invalid = np.isfinite(data); np.logical_not(invalid, out=invalid)
+        data = ma.array(data, mask=invalid, copy=False, shrink=False)
         data._fill_value = fillValue if fillValue is not None else self.fillValue
 #         ma.set_fill_value(data, fillValue if fillValue is not None else self.fillValue) # this seems to work more reliably!
       # handle/apply mask
@@ -969,11 +1030,21 @@ class Variable(object):
     ''' Method to unlink data array. (also calls garbage collection)'''
     del self.__dict__['data_array'] # delete array
     self.__dict__['data_array'] = None # unlink data array
+    self.__dict__['lnanmask'] = False # determined again by the next load()
     # self.__dict__['shape'] = None # retain shape for later use
     gc.collect() # enforce garbage collection
       
-  def getArray(self, idx=None, axes=None, broadcast=False, unmask=False, fillValue=None, copy=True):
-    ''' Copy the entire data array or a slice; option to unmask and to reorder/reshape to specified axes. '''
+  def _ensureWritable(self):
+    ''' Copy-on-write: replace read-only data arrays (e.g. broadcast views) by a writable copy. '''
+    if self.data and not self.data_array.flags.writeable:
+      self.__dict__['data_array'] = self.data_array.copy()
+    return self
+
+  def getArray(self, idx=None, axes=None, broadcast=False, unmask=False, fillValue=None, copy=True, lmasked=False,
+               ltile=False):
+    ''' Copy the entire data array or a slice; option to unmask and to reorder/reshape to specified axes; 
+        with lmasked=True, NaN-masked data are returned as a masked array. Broadcast arrays are read-only
+        views, unless ltile=True (then the array is replicated). '''
     # without data, this will fail
     if self.data:
       if copy: datacopy = self.data_array.copy() # copy, if desired
@@ -983,6 +1054,12 @@ class Variable(object):
         # N.B.: if no data is loaded, self.mask is usually false...
         if fillValue is None: fillValue = self.fillValue
         datacopy = datacopy.filled(fill_value=fillValue) # I don't know if this generates a copy or not...
+      elif unmask and self.nanmasked:
+        if fillValue is None: fillValue = self.fillValue
+        if fillValue is not None and not np.isnan(fillValue): datacopy = fillNaN(datacopy, fillValue)
+      elif lmasked and self.nanmasked:
+        datacopy = ma.masked_invalid(datacopy, copy=False)
+        if self.fillValue is not None: datacopy._fill_value = self.fillValue
       # reorder and reshape to match axes (add missing dimensions as singleton dimensions)
       if axes is not None:
         if idx is not None: raise NotImplementedError
@@ -1003,9 +1080,11 @@ class Variable(object):
       if broadcast:
         assert all([isinstance(ax,Axis) and len(ax)>0 for ax in axes]),\
            'All axes need to have a defined length in order broadcast the array.'
-        # get tiling list
-        tiling = [len(ax) if l == 1 else 1 for ax,l in zip(axes,datacopy.shape)]
-        datacopy = np.tile(datacopy, reps=tiling)
+        if ltile:
+          # get tiling list
+          tiling = [len(ax) if l == 1 else 1 for ax,l in zip(axes,datacopy.shape)]
+          datacopy = np.tile(datacopy, reps=tiling)
+        else: datacopy = broadcastView(datacopy, tuple(len(ax) for ax in axes)) # no copy
     else:
       raise DataError, "No data loaded (Variable '{:s}')".format(self.name)
     # return array
@@ -1027,21 +1106,29 @@ class Variable(object):
       # broadcast mask to data array
       mask = np.broadcast_arrays(mask,self.data_array)[0] # only need first element (the broadcasted mask)
       # create new data array
-      if merge and self.masked: # the first mask is usually the land-sea mask, which we want to keep
-        data = self.getArray(unmask=False) # get data with mask
-        mask = ma.mask_or(data.mask, mask, copy=True, shrink=False) # merge masks
-      else:         
-        data = self.getArray(unmask=False) # don't fill missing values!
-        if self.masked: data.mask = ma.nomask # unmask, sort of...
-      self.__dict__['data_array'] = ma.array(data, mask=mask)
+      if self.nanmasked: # NaN storage: set masked values to NaN (existing NaN's can't be unmasked)
+        data = self.getArray(unmask=False)
+        data[mask] = np.NaN
+        self.__dict__['data_array'] = data
+      else:
+        if merge and self.masked: # the first mask is usually the land-sea mask, which we want to keep
+          data = self.getArray(unmask=False) # get data with mask
+          mask = ma.mask_or(data.mask, mask, copy=True, shrink=False) # merge masks
+        else:
+          data = self.getArray(unmask=False) # don't fill missing values!
+          if self.masked: data.mask = ma.nomask # unmask, sort of...
+        self.__dict__['data_array'] = ma.array(data, mask=mask)
     elif maskValue is not None:
       if isinstance(self.dtype,(int,bool,np.integer,np.bool)): 
         self.__dict__['data_array'] = ma.masked_equal(self.data_array, maskValue, copy=False)
       elif isinstance(self.dtype,(float,np.inexact)):
         self.__dict__['data_array'] = ma.masked_values(self.data_array, maskValue, copy=False)
     # update fill value (stored in atts dict)
-    self.fillValue = fillValue or ( self.data_array.fill_value if self.data_array._fill_value is None
-                                    else self.data_array._fill_value )
+    if self.nanmasked: 
+      if fillValue is not None: self.fillValue = fillValue
+    else:
+      self.fillValue = fillValue or ( self.data_array.fill_value if self.data_array._fill_value is None
+                                      else self.data_array._fill_value )
     # as usual, return self
     return self
     
@@ -1050,6 +1137,11 @@ class Variable(object):
     if self.masked:
       if fillValue is None: fillValue = self.fillValue # default
       self.__dict__['data_array'] = self.data_array.filled(fill_value=fillValue)
+    elif self.nanmasked:
+      if fillValue is None: fillValue = self.fillValue # default
+      if fillValue is not None and not np.isnan(fillValue): 
+        self.__dict__['data_array'] = fillNaN(self.data_array, fillValue)
+        self.__dict__['lnanmask'] = False # no missing values left; masking creates a masked array again
     # as usual, return self
     return self
       
@@ -1058,7 +1150,10 @@ class Variable(object):
         tuple, list or set of Axis instances or names; 'strict' refers to matching of axes. '''
     if axes is not None and not isinstance(axes,(list,tuple,set)): raise TypeError
     # get mask    
-    if nomask: mask = ma.getmask(self.data_array)
+    if self.nanmasked: 
+      mask = np.isnan(self.data_array)
+      if nomask and not mask.any(): mask = ma.nomask
+    elif nomask: mask = ma.getmask(self.data_array)
     else: mask = ma.getmaskarray(self.data_array)
     # select axes (reduce)    
     if axes is not None:
@@ -1231,7 +1326,7 @@ class Variable(object):
     return data, name, units
   
   def reduce(self, operation, blklen=None, blkidx=None, axis=None, mode=None, offset=0, 
-                  asVar=None, axatts=None, varatts=None, fillValue=None, data_view=None,
+                  asVar=None, axatts=None, varatts=None, fillValue=None, data_view=None, nout=None,
                   lcheckVar=True, lcheckAxis=True, **kwargs):
     ''' Reduce a time-series; there are two modes:
           'block'     reduce to one value representing each block, e.g. from monthly to yearly averages;
@@ -1239,6 +1334,8 @@ class Variable(object):
           'periodic'  reduce to one values representing each element of a block,
                       e.g. a monthly seasonal cycle from monthly data ;
                       specify a subset of block with blkidx, but use all elements in each block
+        If 'nout' is given, the operation returns a list of 'nout' results and a list of Variables
+        (or arrays) with a common axis is returned; 'varatts' can be a list of dicts in this case.
                       '''
     ## check input
     lblk = False; lperi = False; lall = False
@@ -1275,35 +1372,62 @@ class Variable(object):
       raise NotImplementedError, 'Currently seasonal means only work for full years.'
     if not self.data: self.load()
     ## massage data
-    # get actual data and reshape
-    if data_view is None: odata = self.getArray()
+    # get actual data (a view, if possible)
+    if data_view is None: 
+      odata = self.getArray(copy=False)
+      # N.B.: a copy is only necessary to reproduce the C-order memory layout the operation expects
+      if not odata.flags.c_contiguous: odata = odata.copy()
     else: odata = data_view
     # move reduction axis to the end, so that it is fastes varying
     if iax < self.ndim-1: odata = np.rollaxis(odata, axis=iax, start=self.ndim)
-    # reshape
     oshape = odata.shape
-    # make length of blocks the last axis, the number of blocks second to last
-    if lblk or lperi: 
-      odata = odata.reshape(oshape[:-1]+(nblks,blklen,))
-      if lperi: odata = np.swapaxes(odata, -1, -2) # swap last and second to last
     # predict resultign shape
     if lblk: # use as is 
       rshape = oshape[:-1] + (nblks,) # shape of results array
     elif lperi or lall: 
       rshape = oshape[:-1] + (blklen,) if blklen > 0 else oshape[:-1] # shape of results array
-    # extract block slice
-    if blkidx is not None: tdata = odata.take(blkidx, axis=-1)
-    else: tdata = odata
-    # N.B.: this does different things depending on the mode:
-    #       block: use a subset of elements from each block, but use all blocks
-    #       periodic: use a subset of blocks, but all elements in each block 
+    lfill = fillValue is not None and ( self.masked or self.nanmasked )
+    def blockView(data):
+      ''' reshape, extract block slice and fill (only the latter two require copies) '''
+      # make length of blocks the last axis, the number of blocks second to last
+      # N.B.: only the last axis is split, so this is always a view
+      if lblk or lperi: 
+        data = data.reshape(data.shape[:-1]+(nblks,blklen,))
+        if lperi: data = np.swapaxes(data, -1, -2) # swap last and second to last
+      # N.B.: this does different things depending on the mode:
+      #       block: use a subset of elements from each block, but use all blocks
+      #       periodic: use a subset of blocks, but all elements in each block 
+      if blkidx is not None: data = data.take(blkidx, axis=-1)
+      if lfill: data = data.filled(fillValue) if isinstance(data,ma.MaskedArray) else fillNaN(data, fillValue)
+      return data
+    def applyOperation(data):
+      ''' apply operation and return a list of results '''
+      rdata = operation(blockView(data), axis=-1, **kwargs)
+      if nout is None: rdata = [rdata]
+      elif len(rdata) != nout: 
+        raise ArgumentError, "Operation returned {:d} results instead of {:d}.".format(len(rdata),nout)
+      return rdata
     ## apply operation
-    if fillValue is not None and self.masked: tdata = tdata.filled(fillValue)
-    rdata = operation(tdata, axis=-1, **kwargs)
-    assert rdata.shape == rshape
+    if ( blkidx is not None or lfill ) and len(oshape) > 1 and oshape[0] > 1:
+      # N.B.: temporary copies are made and reduced in chunks along the leading axis and written into a 
+      #       preallocated output array; each chunk has the same layout as the corresponding part of a 
+      #       full copy, so that results are identical, but temporary memory is limited to one chunk
+      nchunk = max(1,int(reduce_blocksize*oshape[0]/(odata.nbytes or 1)))
+      rlist = None
+      for i in xrange(0,oshape[0],nchunk):
+        rchunks = applyOperation(odata[i:i+nchunk])
+        if rlist is None: 
+          rlist = [np.empty(rshape, dtype=rchunk.dtype) for rchunk in rchunks]
+        for n,rchunk in enumerate(rchunks):
+          if isinstance(rchunk,ma.MaskedArray) and not isinstance(rlist[n],ma.MaskedArray):
+            rlist[n] = rlist[n].view(ma.MaskedArray); rlist[n].fill_value = rchunk.fill_value
+          rlist[n][i:i+nchunk] = rchunk
+    else:
+      rlist = applyOperation(odata)
+    for rdata in rlist: assert rdata.shape == rshape
     # return new variable
     if iax < self.ndim-1 and blklen > 0: 
-      rdata = np.rollaxis(rdata, axis=self.ndim-1, start=iax) # move reduction axis back
+      rlist = [np.rollaxis(rdata, axis=self.ndim-1, start=iax) for rdata in rlist] # move reduction axis back
     # cast as variable
     if asVar:      
       # create new time axis (yearly)
@@ -1320,14 +1444,17 @@ class Variable(object):
       axes = list(self.axes)
       if blklen > 0: axes[iax] = Axis(coord=coord, atts=raxatts)
       else: del axes[iax] # just remove this axis, if blklen is zero
-      # create new variable
-      vatts = self.atts.copy()
-      if varatts is not None: vatts.update(varatts)
-      rvar = self.copy(data=rdata, axes=axes, atts=vatts)      
+      # create new variable(s) with a common axis
+      if not isinstance(varatts,(list,tuple)): varatts = [varatts]*len(rlist)
+      rvar = []
+      for rdata,ratts in zip(rlist,varatts):
+        vatts = self.atts.copy()
+        if ratts is not None: vatts.update(ratts)
+        rvar.append(self.copy(data=rdata, axes=axes, atts=vatts))
     else: # just return data array 
-      rvar = rdata
+      rvar = rlist
     # return results
-    return rvar
+    return rvar if nout is not None else rvar[0]
   
   def histogram(self, bins=None, binedgs=None, ldensity=True, asVar=True, name=None, axis=None, axis_idx=None, 
                 lflatten=False, lcheckVar=True, lcheckAxis=True, haxatts=None, hvaratts=None, fillValue=None, **kwargs):
@@ -1390,10 +1517,15 @@ class Variable(object):
       # create a helper function that apllies the histogram along the specified axis
       def histfct(data, axis=None):
         if axis < 0: axis += data.ndim
-        fct = functools.partial(histogram, bins=binedgs, **kwargs)         
-        hdata = apply_along_axis(fct, axis, data,)
-        # N.B.: the additional output of np.histogram must be suppressed, or np.apply_along_axis will
-        #       expand everything as tuples!
+        if set(kwargs.keys()) <= set(('density',)):
+          # N.B.: all histograms are computed at once (vectorized) and returned along the last axis
+          hdata = histogram(data, bins=binedgs, axis=axis, **kwargs)
+          hdata = np.rollaxis(hdata, axis=hdata.ndim-1, start=axis)
+        else:
+          fct = functools.partial(histogram, bins=binedgs, **kwargs)         
+          hdata = apply_along_axis(fct, axis, data,)
+          # N.B.: the additional output of np.histogram must be suppressed, or np.apply_along_axis will
+          #       expand everything as tuples!
         assert hdata.shape[axis] == len(binedgs)-1
         assert hdata.shape[:axis] == data.shape[:axis]
         assert hdata.shape[axis+1:] == data.shape[axis+1:]
@@ -1456,9 +1588,12 @@ class Variable(object):
     return cvar
 
   def percentile(self, q=None, asVar=True, name=None, axis=None, axis_idx=None, lflatten=False,  
-                 lcheckVar=True, lcheckAxis=True, qaxatts=None, qvaratts=None, fillValue=None, **kwargs):
-    ''' Compute percentiles along a given axis and preserve the other axes. 
-        N.B.: this involves sorting the array and hence makes a full copy of the data '''
+                 lcheckVar=True, lcheckAxis=True, qaxatts=None, qvaratts=None, fillValue=None, 
+                 lapprox=False, nbins=256, blocksize=None, **kwargs):
+    ''' Compute percentiles along a given axis and preserve the other axes; missing values are ignored.
+        N.B.: this involves partitioning the array and hence makes a full copy of the data; with lapprox=True,
+              percentiles are approximated by streaming histograms with nbins, so that the data (e.g. of a 
+              VarNC) are read in blocks and need not be loaded (the error is bounded by the bin width) '''
     # some input checking
     if lflatten and axis is not None: raise ArgumentError
     if not lflatten and axis is None: 
@@ -1500,22 +1635,31 @@ class Variable(object):
     q = tuple(100.*qq for qq in q) # for percentile function
     # define functions that perform actual computation
     # N.B.: these "operations" will be called through the reduce method (see above for details)
-    if lflatten: # totally by-pass reduce()...
-      # this is actually the default behavior of np.histogram()
+    if lapprox: # stream over blocks along the axis
+      if lflatten and self.ndim > 1: raise NotImplementedError, "Approximate percentiles require an axis."
+      qdata = self._approxPercentile(q=q, axis_idx=0 if lflatten else axis_idx, nbins=nbins, blocksize=blocksize)
+      if lflatten:
+        if asVar: qvar = Variable(data=qdata, axes=(Axis(coord=qcoord, atts=axatts),), atts=varatts)
+        else: qvar = qdata
+      else: 
+        qdata = np.rollaxis(qdata, axis=qdata.ndim-1, start=axis_idx) # percentile axis replaces axis
+        if asVar:
+          raxatts = self.axes[axis_idx].atts.copy(); raxatts.update(axatts) # same as in reduce()
+          axes = list(self.axes); axes[axis_idx] = Axis(coord=qcoord, atts=raxatts)
+          qvar = self.copy(data=qdata, axes=axes, atts=varatts)
+        else: qvar = qdata
+    elif lflatten: # totally by-pass reduce()...
       if self.masked: data = self.data_array.filled(fillValue)
       else: data = self.data_array
-      # N.B.: to ignore masked values they have to be replaced by NaNs or out-of-bounds values 
-      qdata = percentile(data.ravel(), q, axis)
+      # N.B.: to ignore masked values they have to be replaced by NaNs 
+      qdata = nanpercentile(data.ravel(), q, axis)
       # create new Axis and Variable objects (1-D)
       if asVar: qvar = Variable(data=qdata, axes=(Axis(coord=qcoord, atts=axatts),), atts=varatts)
       else: qvar = qdata
     else: # use reduce to only apply to selected axis      
-      # create a helper function that apllies the histogram along the specified axis
+      # create a helper function that computes percentiles along the specified axis (vectorized)
       def qfct(data, axis=None):
-        if axis < 0: axis += data.ndim
-        fct = functools.partial(percentile, q=q, axis=axis)         
-        qdata = apply_along_axis(fct, axis, data, laax=False)
-        return qdata
+        return nanpercentile(data, q, axis=axis) # percentile axis is moved to the back
       # call reduce to perform operation
       axatts['coord'] = qcoord # reduce() reads this and uses it as new axis coordinates
       qvar = self.reduce(operation=qfct, blklen=len(q), blkidx=None, axis=axis, mode='all', 
@@ -1524,10 +1668,37 @@ class Variable(object):
     # return new variable instance (or data)
     return qvar
   
+  def _approxPercentile(self, q=None, axis_idx=None, nbins=256, blocksize=None):
+    ''' Helper method to approximate percentiles along an axis by streaming blocks (which are read directly
+        from file, if the Variable is a VarNC and not loaded) through a QuantileSketch. '''
+    if blocksize is None: blocksize = reduce_blocksize
+    axlen = self.shape[axis_idx]
+    slcsize = self.dtype.itemsize * int(np.prod(self.shape)) // max(axlen,1) # size of a single slice along axis
+    step = max(1, blocksize // max(slcsize,1))
+    def blocks():
+      for i in xrange(0, axlen, step):
+        slc = [slice(None)]*self.ndim; slc[axis_idx] = slice(i,min(i+step,axlen)); slc = tuple(slc)
+        if self.data: block = self.data_array[slc]
+        elif getattr(self,'slices',None) is None: block = self[slc] # N.B.: VarNC instances read from file
+        else: self.load(); block = self.data_array[slc]
+        if isinstance(block,ma.MaskedArray): block = block.astype(np.float64).filled(np.NaN)
+        yield np.rollaxis(block, axis=axis_idx, start=0) # samples along first axis
+    # first pass: determine range of values
+    vmin = None; vmax = None
+    for block in blocks(): # N.B.: fmin/fmax ignore NaN's
+      bmin = np.fmin.reduce(block, axis=0); bmax = np.fmax.reduce(block, axis=0)
+      vmin = bmin if vmin is None else np.fmin(vmin, bmin)
+      vmax = bmax if vmax is None else np.fmax(vmax, bmax)
+    # second pass: accumulate histograms
+    sketch = QuantileSketch(vmin, vmax, nbins=nbins)
+    for block in blocks(): sketch.update(block)
+    return sketch.percentile(q)
+  
   def apply_stat_test(self, asVar=True, name=None, axis=None, axis_idx=None, test=None, dist='norm', 
                       lflatten=False, lstatistic=False, lonesided=False, fillValue=None, ignoreNaN=True,
-                      lcheckVar=True, lcheckAxis=True, paxatts=None, pvaratts=None, **kwargs):
-    ''' Apply a statistical test along a axis and return a variable containing the resulting p-values. '''
+                      lcheckVar=True, lcheckAxis=True, paxatts=None, pvaratts=None, lvectorize=True, **kwargs):
+    ''' Apply a statistical test along a axis and return a variable containing the resulting p-values; 
+        the tests are applied to all points at once, unless lvectorize=False (or no batched version exists). '''
 #     if ignoreNaN is None: 
 #       ignoreNaN = test.lower() != 'normaltest' or lflatten
     # some input checking
@@ -1593,30 +1764,48 @@ class Variable(object):
     else: # use reduce to only apply to selected axis      
       # select test function for multi-dimensional test
       # N.B.: these "operations" will be called through the reduce method (see above for details)
-      if test.lower() in ('normaltest',) and not ignoreNaN:
-        laax = False # the only exception
-        # N.B.: the normaltest just works on multi-dimensional data, but not with NaN removal!
-        testfct = functools.partial(normaltest_wrapper, ignoreNaN=ignoreNaN)
-      else:
-        laax = True # have to use Numpy's apply_along_axis for most cases
+      vecfct = None
+      if lvectorize: # batched implementations that operate on entire arrays (sample axis last)
+        from geodata.stats import anderson_vectorized, kstest_vectorized, normaltest_vectorized, shapiro_vectorized
         if test.lower() in ('normaltest',): 
-          testfct = functools.partial(normaltest_wrapper, ignoreNaN=ignoreNaN)
-        elif test.lower() in ('anderson',): 
-          testfct = functools.partial(anderson_wrapper, dist=dist, ignoreNaN=ignoreNaN)
+          vecfct = functools.partial(normaltest_vectorized, ignoreNaN=ignoreNaN)
+        elif test.lower() in ('anderson',) and dist in ('norm','expon'): # others require a fit at each point
+          vecfct = functools.partial(anderson_vectorized, dist=dist, ignoreNaN=ignoreNaN)
         elif test.lower() in ('kstest',):
-          testfct = functools.partial(kstest_wrapper, dist=dist, ignoreNaN=ignoreNaN, **kwargs)
+          vecfct = functools.partial(kstest_vectorized, dist=dist, ignoreNaN=ignoreNaN, **kwargs)
         elif test.lower() in ('shapiro',):
-          lreta = kwargs.pop('reta',True) # default: True
-          if lreta: 
-            global shapiro_a # global variable to retain parameters
-            shapiro_a = None # reset, just to be safe!
-            testfct = functools.partial(shapiro_wrapper, reta=lreta, ignoreNaN=ignoreNaN)
-          else: raise NotImplementedError, test
-      # create a helper function that apllies the histogram along the specified axis
-      def aaa_testfct(data, axis=None):
-        if axis < 0: axis += data.ndim
-        pval = apply_along_axis(testfct, axis, data, laax=laax)
-        return pval
+          kwargs.pop('reta',None) # coefficients are cached for each sample size
+          vecfct = functools.partial(shapiro_vectorized, ignoreNaN=ignoreNaN)
+      if vecfct is not None:
+        # create a helper function that applies the test to all points at once
+        def aaa_testfct(data, axis=None):
+          if axis < 0: axis += data.ndim
+          return vecfct(np.rollaxis(data, axis=axis, start=data.ndim))
+      else:
+        if test.lower() in ('normaltest',) and not ignoreNaN:
+          laax = False # the only exception
+          # N.B.: the normaltest just works on multi-dimensional data, but not with NaN removal!
+          testfct = functools.partial(normaltest_wrapper, ignoreNaN=ignoreNaN)
+        else:
+          laax = True # have to use Numpy's apply_along_axis for most cases
+          if test.lower() in ('normaltest',): 
+            testfct = functools.partial(normaltest_wrapper, ignoreNaN=ignoreNaN)
+          elif test.lower() in ('anderson',): 
+            testfct = functools.partial(anderson_wrapper, dist=dist, ignoreNaN=ignoreNaN)
+          elif test.lower() in ('kstest',):
+            testfct = functools.partial(kstest_wrapper, dist=dist, ignoreNaN=ignoreNaN, **kwargs)
+          elif test.lower() in ('shapiro',):
+            lreta = kwargs.pop('reta',True) # default: True
+            if lreta: 
+              global shapiro_a # global variable to retain parameters
+              shapiro_a = None # reset, just to be safe!
+              testfct = functools.partial(shapiro_wrapper, reta=lreta, ignoreNaN=ignoreNaN)
+            else: raise NotImplementedError, test
+        # create a helper function that apllies the histogram along the specified axis
+        def aaa_testfct(data, axis=None):
+          if axis < 0: axis += data.ndim
+          pval = apply_along_axis(testfct, axis, data, laax=laax)
+          return pval
       # call reduce to perform operation
       pvar = var.reduce(operation=aaa_testfct, blklen=0, blkidx=None, axis=axis, mode='all', 
                          offset=0, asVar=asVar, axatts=None, varatts=varatts, fillValue=fillValue)
@@ -1711,7 +1900,7 @@ class Variable(object):
         data_view = data_view.take(range(tlen-tover), axis=itime) # only use complete years 
       else:
         pshape = self.shape[:itime]+(12-tover,)+self.shape[itime+1:] # padding shape  
-        padding = np.ones(pshape)*self.fillValue # create padding using fillValue 
+        padding = np.ones(pshape)*(np.NaN if self.nanmasked else self.fillValue) # create padding using fillValue 
         data_view = np.concatenate((data_view,padding), axis=itime) # append paddign array
         if self.masked and data_view.mask: 
           data_view.mask[...,tlen-tover:] = True # also mask pad, if applicable
@@ -1785,7 +1974,8 @@ class Variable(object):
 #     if te%12 != 0 or not (taxis.coord[0]%12 == 0 or taxis.coord[0]%12 == 1): 
 #       raise NotImplementedError, 'Currently seasonal reduction only works with full years.'
     # hadling of exceptions: some variables in Datasets should only be averaged
-    if mean_list is not None and self.name in mean_list: operation = np.nanmean    
+    if mean_list is not None and self.name in mean_list and kwargs.get('nout') is None: 
+      operation = np.nanmean    
     # modify variable
     if asVar:      
       # create new time axis (yearly)
@@ -1807,12 +1997,13 @@ class Variable(object):
     avar =  self.reduce(operation, blklen=12, blkidx=idx, axis=taxis, mode='block', offset=offset, 
                         asVar=asVar, axatts=tatts, varatts=varatts, data_view=data_view, 
                         lcheckVar=lcheckVar, lcheckAxis=lcheckAxis, **kwargs)
-    # check shape of annual variable
-    assert avar.shape == self.shape[:tax]+(te/12,)+self.shape[tax+1:]
+    # check shape of annual variable(s)
+    avars = avar if isinstance(avar,list) else [avar] # N.B.: multiple results share the new axis
+    for var in avars: assert var.shape == self.shape[:tax]+(te/12,)+self.shape[tax+1:]
     # convert time coordinate to years (from month)
     if asVar:
       if tatts['units'].lower() == 'year' and taxis.units.lower() in monthlyUnitsList:
-        raxis = avar.getAxis(tatts['name'])
+        raxis = avars[0].getAxis(tatts['name'])
         if taxis.coord[0]%12 == 1: # special treatment, if we start counting at 1(instead of 0)
           raxis.coord -= 1; raxis.coord /= 12; raxis.coord += 1  
         else: raxis.coord /= 12 # just divide by 12, assuming we count from 0
@@ -1847,6 +2038,11 @@ class Variable(object):
     ''' Return a time-series of annual averages of the specified season. '''    
     return self.reduceToAnnual(season=season, operation=nf.nanmin, **kwargs)
   
+  def seasonalStats(self, season='annual', stats=('mean','std','min','max'), **kwargs):
+    ''' Return time-series of several annual statistics of the specified season, computed in a single 
+        pass; returns a dictionary of Variables (or arrays), or a Dataset (see _reduceStats). '''    
+    return self._reduceStats(reduction=self.reduceToAnnual, stats=stats, season=season, **kwargs)
+  
   def reduceToClimatology(self, operation, yridx=None, asVar=True, name=None, offset=0, taxis='time', 
                           lcheckVar=True, lcheckAxis=True, checkUnits=True, taxatts=None, varatts=None, 
                           mean_list=None, ltrim=False, lstrict=True, **kwargs):
@@ -1868,7 +2064,8 @@ class Variable(object):
 #     if te%12 != 0 or not (taxis.coord[0]%12 == 0 or taxis.coord[0]%12 == 1): 
 #       raise NotImplementedError, 'Currently reduction to climatology only works with full years.'
     # hadling of exceptions: some variables in Datasets should only be averaged
-    if mean_list is not None and self.name in mean_list: operation = np.nanmean    
+    if mean_list is not None and self.name in mean_list and kwargs.get('nout') is None: 
+      operation = np.nanmean    
     # modify variable
     if asVar:      
       # create new time axis (still monthly)
@@ -1885,12 +2082,13 @@ class Variable(object):
     avar =  self.reduce(operation, blklen=12, blkidx=yridx, axis=taxis, mode='periodic',
                         offset=offset, asVar=asVar, axatts=tatts, varatts=varatts, 
                         lcheckVar=lcheckVar, lcheckAxis=lcheckAxis, **kwargs)
-    # check shape of annual variable
-    assert avar.shape == self.shape[:tax]+(12,)+self.shape[tax+1:]
+    # check shape of annual variable(s)
+    avars = avar if isinstance(avar,list) else [avar] # N.B.: multiple results share the new axis
+    for var in avars: assert var.shape == self.shape[:tax]+(12,)+self.shape[tax+1:]
     # construct time coordinate
     if asVar:
       if tatts['units'].lower() in monthlyUnitsList:
-        raxis = avar.getAxis(tatts['name'])
+        raxis = avars[0].getAxis(tatts['name'])
         if raxis.coord[0] == 0: raxis.coord += 1 # customarily, month are counted, starting at 1, not 0 
     # return data
     return avar
@@ -1923,6 +2121,30 @@ class Variable(object):
     ''' Return a climatology of minima of monthly data. '''    
     return self.reduceToClimatology(yridx=yridx, operation=nf.nanmin, **kwargs)
   
+  def climStats(self, yridx=None, stats=('mean','std','min','max'), **kwargs):
+    ''' Return climatologies of several statistics of monthly data, computed in a single pass; 
+        returns a dictionary of Variables (or arrays), or a Dataset (see _reduceStats). '''    
+    return self._reduceStats(reduction=self.reduceToClimatology, stats=stats, yridx=yridx, **kwargs)
+  
+  def _reduceStats(self, reduction=None, stats=None, ddof=0, asVar=True, lDataset=False, **kwargs):
+    ''' Helper method that applies a reduction with several statistics at once (see nf.nanstats); 
+        the results are returned as a dictionary with statistics as keys or as a Dataset. '''
+    if isinstance(stats,basestring): stats = (stats,)
+    stats = tuple(stats)
+    if lDataset and not asVar: raise ArgumentError, "A Dataset can only be returned if 'asVar' is True."
+    # reduction operation computing all statistics in one pass
+    operation = functools.partial(nf.nanstats, stats=stats, ddof=ddof)
+    results = reduction(operation=operation, nout=len(stats), asVar=asVar, **kwargs)
+    if results is None: return None # invalid Variable or missing axis
+    # rename Variables and assemble results
+    if asVar:
+      for stat,var in zip(stats,results): var.name = '{:s}_{:s}'.format(var.name,stat)
+    if lDataset:
+      results = Dataset(name=self.name, varlist=results)
+    else: results = dict(zip(stats,results))
+    # return dictionary or Dataset
+    return results
+  
   def reorderAxes(self, axes=None, asVar=True, linplace=False, lcheckAxis=False):
     ''' reorder the axes of a Variable and replace the data array with an array view with 
         appropriately reordered dimensions '''
@@ -2024,7 +2246,8 @@ class Variable(object):
                  lcheckAxis=True, lstrict=False, linplace=False, lcopy=True, ltile=True):
     ''' Insert a dummy axis (and 'tile' the data) at a given location; to allow meaningful 
         application to datasets, a required axes 'req_axes' set can be specified; an Axis instance
-        can be created on-the-fly from a name ('axis') and a length ('length'). '''
+        can be created on-the-fly from a name ('axis') and a length ('length'); with lcopy=False,
+        a read-only broadcast view is used instead of a copy (see insertAxes). '''
     if req_axes is None or all(self.hasAxis(ax, strict=lstrict) for ax in req_axes):
       # generate new Axis instance, if necessary
       if isinstance(axis,basestring):
@@ -2046,19 +2269,17 @@ class Variable(object):
   def insertAxes(self, new_axes=None, req_axes=None, asVar=True, lcheckVar=None, lcheckAxis=True, 
                  lcopy=True, ltile=True, lstrict=False, linplace=False):
     ''' Insert dummy axes (and 'tile' the data) to match the axes in 'new_axes'; to allow meaningful 
-        application to datasets, a required axes 'req_axes' set can be specified '''
-    if not lcopy: warn("Replicating an array without duplicating memory is not save w.r.t. reshaping and aggregating!")
+        application to datasets, a required axes 'req_axes' set can be specified; with lcopy=False,
+        data are not replicated, but a read-only broadcast view is used (copy-on-write, see broadcastView) '''
     if req_axes is None or all(self.hasAxis(ax, strict=lstrict) for ax in req_axes):
       axes = [] # store new axes
       ldata = self.data
       if ldata:
         reshape_axes = []; new_shape = []
-        if lcopy: tile_axes = []
-        else: axes_strides = [] 
-        data = self.data_array.copy() # view on data array
+        tile_axes = []
+        data = self.data_array.copy() if lcopy else self.data_array
       else: data=None
       # loop over new axes
-      if not lcopy and ldata: i = 0
       for ax in new_axes:
         # add new axis or keep existing axis
         if self.hasAxis(ax, strict=lstrict):
@@ -2071,21 +2292,16 @@ class Variable(object):
           if ldata: 
             reshape_axes.append(len(own_axis))
             new_shape.append(len(own_axis))
-            if lcopy: tile_axes.append(1) # don't tile along existing axes
-            else: 
-              axes_strides.append(data.strides[i]); i += 1 # copy strides from original array
+            tile_axes.append(1) # don't tile along existing axes
         else:
           if not isinstance(ax,Axis): raise AxisError, "A new axis has to be an Axis instance."
           axes.append(ax) # add new axis
           if ldata: 
             reshape_axes.append(1) # insert new singleton dimension
             new_shape.append(len(ax))
-            if lcopy: tile_axes.append(len(ax)) # tile along new axes
-            else: axes_strides.append(0) 
-            # N.B.: if we set the stride to 0, we always get back to the same section in memory
+            tile_axes.append(len(ax)) # tile along new axes
       assert len(axes) == len(new_axes)
-      assert not lcopy or tuple(new_shape) == tuple(tl if rl==1 else rl for rl,tl in zip(reshape_axes,tile_axes))
-      assert lcopy or not ldata or i == data.ndim      
+      assert not ldata or tuple(new_shape) == tuple(tl if rl==1 else rl for rl,tl in zip(reshape_axes,tile_axes))
       # reshape/tile data
       if ldata:
         reshape_axes = tuple(reshape_axes); new_shape = tuple(new_shape)
@@ -2095,7 +2311,7 @@ class Variable(object):
           else:
             for iax,lax in enumerate(tile_axes):
               if lax>1: data = data.repeat(lax, axis=iax)
-        else: data = as_strided(data, shape=new_shape, strides=tuple(axes_strides)) # special numpy trick...
+        else: data = broadcastView(data, new_shape) # N.B.: strides of new axes are 0
         assert data.ndim == len(new_axes) and data.shape == new_shape 
         #assert isEqual(np.ma.mean(data),np.ma.mean(self.data_array)), '{}, {}'.format(np.ma.mean(data),np.ma.mean(self.data_array))
       if asVar:
@@ -2114,11 +2330,17 @@ class Variable(object):
   @UnaryCheckAndCreateVar
   def standardize(self, axis=None, name=None, linplace=False, lcheckVar=True, lcheckAxis=True,
                   lstandardize=True, ldetrend=False, ltrend=False, lsmooth=False, lresidual=False, 
-                  degree=1, rcond=None, w=None, window_len=11, window='hanning', casting=casting_rule):
-    ''' Standardize Variable, i.e. subtract mean and divide by standard deviation '''
+                  degree=1, rcond=None, w=None, window_len=11, window='hanning', lmonthly=False, 
+                  casting=casting_rule):
+    ''' Standardize Variable, i.e. subtract mean and divide by standard deviation; with lmonthly, anomalies 
+        are computed with respect to each calendar month (requires a monthly time axis) '''
     if self.dtype.kind in ('S',): 
       if lcheckVar: raise VariableError, "Standardization does not work with string Variables!"
       else: return None
+    if lmonthly:
+      if axis is None: raise ArgumentError, "Monthly anomalies require a time axis."
+      if not self.getAxis(axis).units.lower() in monthlyUnitsList: 
+        raise NotImplementedError, "Time units='month' required for monthly anomalies! (got '{:s}')".format(self.getAxis(axis).units)
     if name is None: name = '{:s}_std' # allow use of original name in function
     if linplace: 
       if not np.issubdtype(self.dtype, np.inexact):
@@ -2142,18 +2364,17 @@ class Variable(object):
     else:
       iaxis = self.axisIndex(axis, lcheck=lcheckAxis)
       # get axis coordinates
-      ax = self.axes[iaxis].coord if ldetrend else None
-      if ldetrend or lsmooth:
+      ax = self.axes[iaxis].coord
+      if ldetrend or lsmooth or lmonthly:
         if lsmooth and ax.size <= window_len: window_len = ax.size-1 # shrink window, if data too short
-        # prepare parallel function call
-        aaa_fct = functools.partial(detrend, ax=ax, lcopy=False, 
-                                    ldetrend=ldetrend, ltrend=ltrend, degree=degree, rcond=rcond, w=w, 
-                                    lsmooth=lsmooth, lresidual=lresidual, window_len=window_len, window=window)
-        # apply along selected axis
-        data = apply_along_axis(aaa_fct, iaxis, data, laax=True)
-        # reassigning array (apply_along_axis creates a new results array)
+        # N.B.: all series along the axis are fitted at once (batched least squares, see utils.misc.polyfit)
+        data = detrend(data, ax=ax, axis=iaxis, lcopy=False, lmonthly=lmonthly,
+                       ldetrend=ldetrend, ltrend=ltrend, degree=degree, rcond=rcond, w=w, 
+                       lsmooth=lsmooth, lresidual=lresidual, window_len=window_len, window=window)
     # standardize (subtract mean and divide by standard deviation)
-    if lstandardize:
+    if lstandardize and lmonthly:
+      data = monthlyAnomalies(data, axis=iaxis, months=np.round(ax).astype(np.int64), lstandardize=True)
+    elif lstandardize:
       # in-place with unsafe casting
       np.subtract(data, np.nanmean(data, axis=iaxis, keepdims=True), out=data, casting=casting)
       np.divide(data, np.nanstd(data, axis=iaxis, keepdims=True), out=data, casting=casting)
@@ -2404,6 +2625,7 @@ class Axis(Variable):
     else:
       # transform input based on conventions
       data = self._transformCoord(data)
+      self.__dict__['_spacing'] = None # reset cache
       # load data
       self._len = data.size    
       self.load(data=data, mask=None)
@@ -2461,53 +2683,98 @@ class Axis(Variable):
     # N.B.: using load() and getArray() should automatically take care of any special needs 
     return ax
 
+  @property
+  def spacing(self):
+    ''' The coordinate spacing, if the coordinates are uniformly spaced, otherwise None (cached). '''
+    if not self.data: return None
+    cache = self.__dict__.get('_spacing',None)
+    if cache is not None and cache[0] is self.coord: return cache[1]
+    coord = self.coord; n = len(coord); delta = None
+    if n > 1 and coord.dtype.kind in ('i','u','f'):
+      delta = float(coord[-1] - coord[0]) / (n-1)
+      # N.B.: deviations of a fraction of the spacing are allowed, because lookups are corrected locally
+      if np.any( np.abs( coord - ( coord[0] + delta*np.arange(n) ) ) > 0.01*abs(delta) ): delta = None
+    self.__dict__['_spacing'] = (coord,delta)
+    return delta
+
+  def _searchsorted(self, coord, value, delta=None):
+    ''' Equivalent to coord.searchsorted(value, side='right') for ascending coordinates; with uniform 
+        spacing, indices are computed arithmetically and corrected locally, so that results are exact. '''
+    if delta is None: return coord.searchsorted(value, side='right')
+    n = len(coord)
+    with np.errstate(invalid='ignore'):
+      idx = np.floor( ( value - coord[0] ) / delta )
+    idx = np.clip(np.nan_to_num(idx), -1, n-1).astype(np.intp) # index of last coordinate <= value
+    # correct rounding errors (one step is sufficient, because deviations are smaller than the spacing)
+    idx -= ( idx >= 0 ) & ( coord[np.maximum(idx,0)] > value )
+    idx += ( idx < n-1 ) & ( coord[np.minimum(idx+1,n-1)] <= value )
+    idx[np.isnan(value)] = n-1 # NaN's are sorted to the end
+    return idx + 1
+
   def getIndex(self, value, mode='closest', outOfBounds=None):
-    ''' Return the coordinate index that is closest to the value or suitable for index ranges (left/right). '''
+    ''' Return the coordinate index that is closest to the value or suitable for index ranges (left/right);
+        if value is an array, an array of indices is returned (a masked array, if outOfBounds is True, where
+        out-of-bounds values are masked, instead of None). Uniformly spaced axes use arithmetic indexing. '''
     if not self.data: raise DataError
+    lscalar = np.ndim(value) == 0
+    mode = mode.lower()
     if outOfBounds is None:
-      if mode.lower() == 'closest': outOfBounds = False
-#       elif mode.lower() in ('left','right'): outOfBounds = False # return lowest/highest index if out of bounds
+      if mode == 'closest': outOfBounds = False
+#       elif mode in ('left','right'): outOfBounds = False # return lowest/highest index if out of bounds
       else: outOfBounds = True # return None if value out of bounds
     # check coordinate order
-    coord = self.coord
+    coord = self.coord; n = self.len
+    if isinstance(coord,ma.MaskedArray): coord = coord.data # coordinates are never masked
+    if lscalar: values = value
+    else: values = np.asarray(value).ravel()
     if self.ascending: 
-      if outOfBounds and ( value < coord[0] or value > coord[-1] ): return None # check bounds
+      if outOfBounds: oob = ( values < coord[0] ) | ( values > coord[-1] ) # check bounds
     else: 
-      if outOfBounds and ( value > coord[0] or value < coord[-1] ): return None # check bounds before reversing
+      if outOfBounds: oob = ( values > coord[0] ) | ( values < coord[-1] ) # check bounds before reversing
       coord = coord[::-1] # reverse order
       # also swap left and right
-      if mode.lower() == 'left': mode = 'right'
-      elif mode.lower() == 'right': mode = 'left'    
-    # behavior depends on mode
-    if mode.lower() == 'left':
-      # returns value suitable for beginning of range (inclusive)
-#       return coord.searchsorted(value, side='left') 
-      idx = max(coord.searchsorted(value, side='right')-1,0)
-    elif mode.lower() == 'right':    
-      # returns value suitable for end of range (inclusive)
-      idx = coord.searchsorted(value, side='right')
-      if idx > 0 and coord[idx-1] == value: idx -= 1 # special case...
-    elif mode.lower() == 'closest':      
-      # search for closest index
+      if mode == 'left': mode = 'right'
+      elif mode == 'right': mode = 'left'    
+    if lscalar:
+      if outOfBounds and oob: return None
       idx = coord.searchsorted(value, side='right') # returns value 
-      # refine search
-      if idx <= 0: 
-        idx = 0
-      elif idx >= self.len: 
-        idx = self.len-1
-      else:
-        dl = value - coord[idx-1]
-        dr = coord[idx] - value
-        assert dl >= 0 and dr >= 0
-        if dr < dl: 
-          idx = idx
-        else: 
-          idx = idx-1 # can't be 0 at this point 
-    else: 
-      raise ValueError, "Mode '{:s}' unknown.".format(mode)      
+      # behavior depends on mode
+      if mode == 'left':
+        # returns value suitable for beginning of range (inclusive)
+        idx = max(idx-1,0)
+      elif mode == 'right':    
+        # returns value suitable for end of range (inclusive)
+        if idx > 0 and coord[idx-1] == value: idx -= 1 # special case...
+      elif mode == 'closest':      
+        # refine search
+        if idx <= 0: idx = 0
+        elif idx >= n: idx = n-1
+        elif coord[idx] - value >= value - coord[idx-1]: idx = idx-1 # can't be 0 at this point
+      else: 
+        raise ValueError, "Mode '{:s}' unknown.".format(mode)      
+    else:
+      delta = self.spacing
+      if delta is not None: delta = abs(delta)
+      ridx = self._searchsorted(coord, values, delta=delta)
+      # behavior depends on mode (same as above)
+      if mode == 'left':
+        idx = np.maximum(ridx-1,0)
+      elif mode == 'right':    
+        idx = ridx.copy()
+        idx[ ( ridx > 0 ) & ( coord[np.maximum(ridx-1,0)] == values ) ] -= 1
+      elif mode == 'closest':      
+        idx = np.clip(ridx, 0, n-1)
+        inner = ( ridx > 0 ) & ( ridx < n ); ii = ridx[inner]
+        lright = ( coord[ii] - values[inner] ) < ( values[inner] - coord[ii-1] )
+        idx[inner] = np.where(lright, ii, ii-1)
+      else: 
+        raise ValueError, "Mode '{:s}' unknown.".format(mode)      
     # return
-    if not self.ascending: idx = self.len - idx -1 # flip again
-    return idx 
+    if not self.ascending: idx = n - idx -1 # flip again
+    if not lscalar:
+      idx = idx.reshape(np.shape(value))
+      if outOfBounds: idx = ma.array(idx, mask=oob.reshape(np.shape(value)))
+    return idx
 
   def getIndices(self, coords):
     ''' Method to find occurences of coords and return their index values. '''
@@ -3075,9 +3342,16 @@ class Dataset(object):
       
 
 def concatVars(variables, axis=None, coordlim=None, idxlim=None, asVar=True, offset=None, 
-               name=None, units=None, axatts=None, varatts=None, lcheckAxis=True, lensembleAxis=None):
+               name=None, units=None, axatts=None, varatts=None, lcheckAxis=True, lensembleAxis=None,
+               lstream=False, sink=None, blocksize=None):
   ''' A function to concatenate Variables from different sources along a given axis;
-      this is useful to generate a continuous time series from an ensemble. '''
+      this is useful to generate a continuous time series from an ensemble. 
+      With lstream=True, no data are loaded (only meta data are checked) and a LazyVar is returned, which
+      reads members blockwise, when it is evaluated; if a sink (a NetCDF file or Dataset) is given, the 
+      result is streamed to the sink, so that memory is bounded by the block size. '''
+  if sink is not None: 
+    lstream = True
+    if not asVar: raise ArgumentError, "Streaming to a sink requires asVar=True."
   if lensembleAxis and axis is None: axis = 'ensemble'
   elif isinstance(axis,(Axis,basestring)) and not any([var.hasAxis(axis) for var in variables]):
     if lensembleAxis is None: lensembleAxis = True
@@ -3094,7 +3368,7 @@ def concatVars(variables, axis=None, coordlim=None, idxlim=None, asVar=True, off
   var0 = variables[0] # shortcut
   if not all([var.shape == var0.shape  for var in variables]): 
     raise AxisError, "All Variables need to have the same shape for concatenation!"
-  if not var0.data: var.load()
+  if not lstream and not var0.data: var0.load()
   # get some axis info
   if lnew:
     tax = 0 # add ensemble axis as first axis (assuming C order)
@@ -3105,7 +3379,7 @@ def concatVars(variables, axis=None, coordlim=None, idxlim=None, asVar=True, off
     if not isNumber(offset): raise TypeError
     delta = axt.coord[1] - axt.coord[0]
     for var in variables:
-      axdiff = np.diff(axt.coord)
+      axdiff = np.diff(var.getAxis(axis).coord) # N.B.: only meta data are used
       if lcheckAxis and not (axdiff.min()+100*floateps >= delta >=  axdiff.max()-100*floateps): 
         raise AxisError, "Concatenation axis has to be evenly spaced!"
   # slicing options
@@ -3116,6 +3390,9 @@ def concatVars(variables, axis=None, coordlim=None, idxlim=None, asVar=True, off
     lcoordlim = True
     if isinstance(coordlim,(tuple,list)): coordlim = {axis:coordlim}
     else: raise TypeError    
+    def coordIndices(var): # same as range slicing with coordinates
+      ax = var.getAxis(axis); i0,i1 = [ax.getIndex(c, outOfBounds=True) for c in coordlim[axis]]
+      return np.arange(len(ax))[i0:None if i1 is None else i1+1]
   elif idxlim is not None:
     lidxlim = True
     if isinstance(idxlim,slice): idxslc = idxlim
@@ -3125,7 +3402,7 @@ def concatVars(variables, axis=None, coordlim=None, idxlim=None, asVar=True, off
   shapes = []; tes = []
   for var in variables:
     shp = list(var.shape)
-    if lcoordlim: tes.append(len(axt(**coordlim)))
+    if lcoordlim: tes.append(len(coordIndices(var)))
     elif lidxlim:       
       tmpidx = idxslc.indices(len(axt))
       idxlen = 1 + (tmpidx[1] -1 - tmpidx[0]) / tmpidx[2]
@@ -3146,20 +3423,30 @@ def concatVars(variables, axis=None, coordlim=None, idxlim=None, asVar=True, off
     newshape = list(var0.shape)
     newshape[tax] = tlen
     newshape = tuple(newshape)
-  # load data
-  data = []
-  for var in variables:
-    if not var.data: var.load()
-    if lcoordlim: 
-      array = var(**coordlim)     
-    elif lidxlim:
-      array = var.getArray().take(xrange(*idxslc.indices(len(axt))), axis=tax)
-    else: 
-      array = var.getArray()
-    if lnew: array = array.reshape((1,)+array.shape) # add singleton dimension to concatenate over
-    data.append(array)
-  # concatenate
-  data = np.concatenate(data, axis=tax)
+  if lstream:
+    # N.B.: members are only read, when the concatenated array is evaluated (see geodata.lazy)
+    from geodata.lazy import ConcatArray, LazyVar # N.B.: circular import
+    indices = None
+    if lcoordlim: # indices of coordinate subsets
+      indices = [coordIndices(var) for var in variables]
+    elif lidxlim: indices = [np.arange(*idxslc.indices(len(axt)))]*len(variables)
+    if indices is not None and [len(idx) for idx in indices] != tes: raise AxisError, tes
+    data = ConcatArray(variables, axis=tax, indices=indices, lnew=lnew, shape=newshape, dtype=var0.dtype)
+  else:
+    # load data
+    data = []
+    for var in variables:
+      if not var.data: var.load()
+      if lcoordlim: 
+        array = var.getArray().take(coordIndices(var), axis=tax)
+      elif lidxlim:
+        array = var.getArray().take(xrange(*idxslc.indices(len(axt))), axis=tax)
+      else: 
+        array = var.getArray()
+      if lnew: array = array.reshape((1,)+array.shape) # add singleton dimension to concatenate over
+      data.append(array)
+    # concatenate
+    data = np.concatenate(data, axis=tax)
   assert data.shape[tax] == tlen
   assert data.shape == newshape
   # cast as variable
@@ -3186,19 +3473,28 @@ def concatVars(variables, axis=None, coordlim=None, idxlim=None, asVar=True, off
     vatts = var0.atts.copy()
     vatts['name'] = name or var0.name; vatts['units'] = units or var0.units
     if varatts is not None: vatts.update(varatts)
-    return Variable(data=data, axes=axes, atts=vatts)
+    if lstream: 
+      var = LazyVar(expression=data, axes=axes, atts=vatts, plot=var0.plot.copy())
+      if sink is not None: # file handles are left open
+        from utils.nctools import writeNetCDF
+        writeNetCDF(Dataset(name=var.name, varlist=[var]), sink, blocksize=blocksize, close=isinstance(sink,basestring))
+      return var
+    else: return Variable(data=data, axes=axes, atts=vatts)
     # or return data
   else: return data
   
   
 def concatDatasets(datasets, name=None, axis=None, coordlim=None, idxlim=None, offset=None, axatts=None,
                    title=None, lensembleAxis=None, lignoreConst=True, time_axes=None, check_vars=None,
-                   lcpOther=True, lcpAny=False, ldeepcopy=True, lcheckVars=True, lcheckAxis=True):
+                   lcpOther=True, lcpAny=False, ldeepcopy=True, lcheckVars=True, lcheckAxis=True,
+                   lstream=False, sink=None, blocksize=None):
   ''' A function to concatenate Datasets from different sources along a given axis; this
       function essentially applies concatVars to every Variable and creates a new dataset. 
       When concatenating station or shape arrays, use check_vars with an array of unique ID's
       to make sure they are all in the same order (since only the first axis and ID variable
-      (pseudo-axis) will be retained. '''
+      (pseudo-axis) will be retained. With lstream=True, concatenated Variables are LazyVars 
+      and if a sink (NetCDF file or Dataset) is given, the new dataset is streamed to the sink. '''
+  if sink is not None: lstream = True
   if lensembleAxis and axis is None: axis = 'ensemble'
   if lignoreConst and time_axes is None: time_axes = ('time','year')
   elif isinstance(axis,(Axis,basestring)) and not any([ds.hasAxis(axis) for ds in datasets]):
@@ -3268,7 +3564,7 @@ def concatDatasets(datasets, name=None, axis=None, coordlim=None, idxlim=None, o
           if lall: 
             variables[varname] = concatVars([ds.variables[varname] for ds in datasets], axis=axis, asVar=True,
                                             coordlim=coordlim, idxlim=idxlim, offset=offset, axatts=axatts,
-                                            lcheckAxis=lcheckAxis, lensembleAxis=lensembleAxis)
+                                            lcheckAxis=lcheckAxis, lensembleAxis=lensembleAxis, lstream=lstream)
           else:
             if lcheckVars:       
               raise DatasetError, "Variable '{:s}' is not present in all Datasets!".format(varname)
@@ -3284,8 +3580,13 @@ def concatDatasets(datasets, name=None, axis=None, coordlim=None, idxlim=None, o
         catax = variables.values()[c].getAxis(axis, lcheck=False); c += 1 # return None if not present
       axes[axis] = catax # add new concatenation axis
     # copy first dataset and replace concatenation axis and variables
-  return datasets[0].copy(axes=axes, name=name, title=title, variables=variables, varlist=None, 
-                          varargs=None, axesdeep=True, varsdeep=False)
+  dataset = datasets[0].copy(axes=axes, name=name, title=title, variables=variables, varlist=None, 
+                             varargs=None, axesdeep=True, varsdeep=False)
+  # stream concatenated dataset to sink
+  if sink is not None: # file handles are left open
+    from utils.nctools import writeNetCDF
+    writeNetCDF(dataset, sink, blocksize=blocksize, close=isinstance(sink,basestring))
+  return dataset
 
 
 class Ensemble(object):
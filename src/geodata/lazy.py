@@ -0,0 +1,286 @@
+'''
+Created on Oct 18, 2026
+
+A module that implements deferred evaluation of Variable arithmetic: arithmetic operations and ufuncs
+on LazyVar instances build an expression graph, rather than computing new data arrays; the expression
+is only evaluated when data are loaded, indexed or written to a NetCDF file, and it is evaluated in
+cache-sized blocks, so that temporary arrays remain small. Units, shapes and axes are checked, when
+the expression is built (using the same decorators as regular Variable arithmetic).
+
+@author: Andre R. Erler, GPL v3
+'''
+
+# external imports
+import numpy as np
+import numpy.ma as ma
+# internal imports
+from geodata.base import Variable
+from geodata.misc import joinDicts, ArgumentError, VariableError
+from utils.nctools import iterBlocks
+
+# default block size (in bytes) for evaluation of expressions (about the size of an L2 cache)
+lazy_blocksize = 2**18
+
+
+class BlockProxy(object):
+  ''' A minimal stand-in for a Variable, which is passed to the (undecorated) arithmetic methods of the
+      Variable class, so that these can be applied to a single block of data. '''
+  def __init__(self, data_array, name, units):
+    self.data_array = data_array
+    self.name = name
+    self.units = units
+
+
+class LazyArray(object):
+  '''
+    A deferred array expression: an operation applied to a list of operands, which can be Variables
+    (including LazyVars and VarNCs), arrays or scalars; the expression is only evaluated, when it is
+    indexed, and then only for the requested slice.
+
+    The operation is an undecorated Variable arithmetic method, which is called with a BlockProxy of
+    the first operand and blocks of the remaining operands; if the operation is None, the expression
+    simply returns a block of the first operand.
+  '''
+
+  def __init__(self, op=None, operands=None, opargs=None, shape=None, dtype=None):
+    ''' Save operation and operands; shape and dtype have to be known in advance. '''
+    if not isinstance(operands[0],Variable): raise TypeError, operands[0]
+    self.op = op
+    self.operands = tuple(operands)
+    self.opargs = dict() if opargs is None else opargs
+    self.shape = tuple(shape)
+    self.dtype = np.dtype(dtype)
+
+  @property
+  def ndim(self):
+    ''' The number of dimensions. '''
+    return len(self.shape)
+
+  @property
+  def size(self):
+    ''' The number of elements. '''
+    return int(np.prod(self.shape))
+
+  def _getBlock(self, operand, slcs):
+    ''' Extract a block from an operand; Variables with fewer dimensions are broadcast along trailing
+        dimensions (like in Variable arithmetic), arrays along leading dimensions (like in NumPy). '''
+    ndim = len(slcs)
+    if isinstance(operand,Variable):
+      oslcs = slcs[:operand.ndim]
+      if operand.data: block = operand.data_array[oslcs]
+      elif isinstance(operand,LazyVar) or getattr(operand,'slices',None) is None:
+        block = operand[oslcs] # N.B.: VarNC instances read blocks directly from file
+      else: 
+        operand.load(); block = operand.data_array[oslcs]
+      if operand.ndim < ndim: block = block.reshape(block.shape+(1,)*(ndim-operand.ndim))
+    elif isinstance(operand,np.ndarray) and operand.ndim > 0:
+      shape = (1,)*(ndim-operand.ndim) + operand.shape
+      block = operand.reshape(shape)[tuple(slc if n > 1 else slice(None) for slc,n in zip(slcs,shape))]
+    else: block = operand # scalars
+    return block
+
+  def _expandIndex(self, idx):
+    ''' Expand an index to a tuple of slices (one for every dimension) and a list of dimensions that were
+        indexed with integers (and have to be removed); returns None for advanced indexing. '''
+    if not isinstance(idx,tuple): idx = (idx,)
+    # expand Ellipsis and missing dimensions
+    if any(slc is Ellipsis for slc in idx):
+      i = idx.index(Ellipsis)
+      idx = idx[:i] + (slice(None),)*(self.ndim-len(idx)+1) + idx[i+1:]
+    idx = idx + (slice(None),)*(self.ndim-len(idx))
+    if len(idx) > self.ndim: raise IndexError, idx
+    # convert integer indices to slices and remove these dimensions later
+    slcs = []; sqax = []
+    for i,slc in enumerate(idx):
+      if isinstance(slc,(int,long,np.integer)):
+        slc = int(slc) % self.shape[i] # negative indices
+        slcs.append(slice(slc,slc+1)); sqax.append(i)
+      elif isinstance(slc,slice): slcs.append(slc)
+      else: return None # advanced indexing
+    return tuple(slcs), sqax
+
+  def _evaluate(self, slcs):
+    ''' Evaluate the expression for a tuple of slices (one for every dimension). '''
+    # evaluate operands and apply operation
+    blocks = [self._getBlock(operand, slcs) for operand in self.operands]
+    if self.op is None: data = blocks[0]
+    else:
+      proxy = BlockProxy(blocks[0], name=self.operands[0].name, units=self.operands[0].units)
+      data = self.op(proxy, *blocks[1:], **self.opargs)[0] # returns data, name, units
+    return data
+
+  def __getitem__(self, idx):
+    ''' Evaluate the expression for a slice (only basic indexing is evaluated blockwise). '''
+    expanded = self._expandIndex(idx)
+    if expanded is None: # advanced indexing: evaluate everything and index afterwards
+      return self.__getitem__(Ellipsis).__getitem__(idx)
+    slcs, sqax = expanded
+    data = self._evaluate(slcs)
+    if sqax: data = data.reshape([n for i,n in enumerate(data.shape) if i not in sqax])
+    return data
+
+
+class ConcatArray(LazyArray):
+  '''
+    A deferred concatenation of Variables along an axis; when a slice is evaluated, only the overlapping
+    parts of the members are read (VarNC members directly from file), so that memory is bounded by the
+    size of the slice. Members can be subsets along the concatenation axis (given as index arrays), or
+    they can be stacked along a new leading axis (lnew=True).
+  '''
+
+  def __init__(self, variables=None, axis=0, indices=None, lnew=False, shape=None, dtype=None):
+    ''' Save members and the index mapping along the concatenation axis. '''
+    if not all(isinstance(var,Variable) for var in variables): raise TypeError, variables
+    super(ConcatArray,self).__init__(op=None, operands=variables, shape=shape, dtype=dtype)
+    self.axis = 0 if lnew else axis
+    self.lnew = lnew
+    if lnew: indices = [np.zeros((1,), dtype=np.intp) for var in variables] # a single index each
+    elif indices is None: indices = [np.arange(var.shape[axis]) for var in variables]
+    self.indices = [np.asarray(idx, dtype=np.intp) for idx in indices]
+    self.offsets = np.cumsum([0]+[len(idx) for idx in self.indices])
+    if self.offsets[-1] != self.shape[self.axis]: raise ArgumentError, "Indices and shape are not compatible."
+
+  def _evaluate(self, slcs):
+    ''' Read the requested slices from all members that overlap with the slice. '''
+    positions = np.arange(*slcs[self.axis].indices(self.shape[self.axis])) # requested positions
+    members = zip(self.operands,self.indices,self.offsets[:-1],self.offsets[1:])
+    if len(positions) > 1 and positions[1] < positions[0]: members = members[::-1] # negative step
+    blocks = []
+    for var,idx,o0,o1 in members:
+      pos = positions[( positions >= o0 ) & ( positions < o1 )]
+      if len(pos) == 0: continue
+      if self.lnew: 
+        block = self._getBlock(var, slcs[1:])
+        block = block.reshape((1,)+block.shape)
+      else:
+        srcidx = idx[pos-o0]
+        # N.B.: use a slice, if possible, so that NetCDF reads are contiguous
+        if len(srcidx) == 1 or ( srcidx[1] > srcidx[0] and np.all(np.diff(srcidx) == srcidx[1]-srcidx[0]) ):
+          step = srcidx[1]-srcidx[0] if len(srcidx) > 1 else 1
+          srcslc = slice(srcidx[0], srcidx[-1]+1, step)
+        else: srcslc = srcidx
+        block = self._getBlock(var, slcs[:self.axis] + (srcslc,) + slcs[self.axis+1:])
+      blocks.append(block)
+    if len(blocks) == 0: # empty slice
+      return np.empty([len(xrange(*slc.indices(n))) for slc,n in zip(slcs,self.shape)], dtype=self.dtype)
+    elif len(blocks) == 1: return blocks[0]
+    if any(isinstance(block,ma.MaskedArray) for block in blocks): return ma.concatenate(blocks, axis=self.axis)
+    else: return np.concatenate(blocks, axis=self.axis)
+
+
+class LazyVar(Variable):
+  '''
+    A Variable whose data are defined by a deferred expression (a LazyArray); arithmetic and ufuncs
+    applied to LazyVars extend the expression, and data are only computed (in blocks), when they are
+    loaded, indexed or written to file.
+  '''
+
+  def __init__(self, expression=None, blocksize=None, **varargs):
+    '''
+      Initialize a Variable with a deferred expression instead of a data array.
+
+      Lazy Attributes:
+        expression = None # a LazyArray instance that computes the data
+        blocksize = lazy_blocksize # block size (in bytes) for evaluation of the expression
+    '''
+    if not isinstance(expression,LazyArray): raise TypeError, expression
+    if varargs.get('data',None) is not None: raise ArgumentError, "LazyVars are initialized without data."
+    varargs['dtype'] = expression.dtype
+    super(LazyVar,self).__init__(**varargs)
+    if self.shape != expression.shape: raise VariableError, "Shape of expression and axes are not compatible."
+    self.__dict__['expression'] = expression
+    self.__dict__['blocksize'] = lazy_blocksize if blocksize is None else blocksize
+
+  def evaluate(self, blocksize=None):
+    ''' Evaluate the expression in blocks and return the resulting array. '''
+    if blocksize is None: blocksize = self.blocksize
+    if self.ndim == 0: return self.expression[()]
+    data = None
+    for slc in iterBlocks(self.shape, self.dtype.itemsize, blocksize=blocksize):
+      block = self.expression[slc]
+      if data is None: data = np.empty(self.shape, dtype=block.dtype)
+      if isinstance(block,ma.MaskedArray) and not isinstance(data,ma.MaskedArray):
+        data = data.view(ma.MaskedArray)
+      data[slc] = block
+    return data
+
+  def load(self, data=None, **kwargs):
+    ''' Evaluate the expression and load the results (if no data are passed). '''
+    if data is None:
+      if self.data: return self # already evaluated
+      data = self.evaluate()
+    return super(LazyVar,self).load(data=data, **kwargs)
+
+  def __getitem__(self, slc):
+    ''' If data are not loaded, only evaluate the expression for the requested slice. '''
+    if self.data: return super(LazyVar,self).__getitem__(slc)
+    else: return self.expression[slc]
+
+  def getArray(self, **kwargs):
+    ''' Evaluate the expression, before data is returned. '''
+    if not self.data: self.load()
+    return super(LazyVar,self).getArray(**kwargs)
+
+  def copy(self, deepcopy=False, **newargs):
+    ''' Copies of unloaded LazyVars share the expression; otherwise a regular Variable is returned. '''
+    if deepcopy or self.data or newargs.get('data',None) is not None:
+      return super(LazyVar,self).copy(deepcopy=deepcopy, **newargs)
+    args = dict(expression=self.expression, blocksize=self.blocksize, axes=self.axes,
+                atts=self.atts.copy(), plot=self.plot.copy())
+    newargs.pop('data',None); newargs.pop('dtype',None)
+    args.update(newargs)
+    return LazyVar(**args)
+
+  def _apply_ufunc(self, ufunc=None, asVar=True, linplace=False, lwarn=True, **kwargs):
+    ''' Add ufunc to the expression (in-place operations are applied to the evaluated data). '''
+    if linplace:
+      return super(LazyVar,self)._apply_ufunc(ufunc=ufunc, asVar=asVar, linplace=linplace, lwarn=lwarn, **kwargs)
+    # N.B.: this is the undecorated Variable method, which computes data, name and units
+    op = Variable.__dict__['_apply_ufunc'].op
+    return deferOperation(op, self, opargs=dict(ufunc=ufunc, linplace=False, lwarn=lwarn, **kwargs),
+                          asVar=asVar, atts=self.atts.copy())
+
+
+def sampleData(operand):
+  ''' Return a single element with the dtype of an operand (scalars are returned as is, so that NumPy's
+      value-based casting rules apply). '''
+  if isinstance(operand,Variable):
+    return np.ones((1,)*operand.ndim, dtype=operand.dtype)
+  elif isinstance(operand,np.ndarray) and operand.ndim > 0:
+    return np.ones((1,)*operand.ndim, dtype=operand.dtype)
+  else: return operand
+
+def deferOperation(op, var, others=None, opargs=None, asVar=True, atts=None):
+  ''' Create a LazyVar that applies a Variable arithmetic method to var and other operands; name, units
+      and dtype are inferred by applying the method to single elements. '''
+  if not isinstance(var,LazyVar): var = asLazyVar(var)
+  others = () if others is None else tuple(others)
+  # figure out meta data, without computing anything
+  proxy = BlockProxy(sampleData(var), name=var.name, units=var.units)
+  with np.errstate(all='ignore'):
+    sample, name, units = op(proxy, *[sampleData(other) for other in others], **opargs)
+  # after warnings were issued once, suppress them during evaluation
+  if 'lwarn' in opargs: opargs = dict(opargs, lwarn=False)
+  expression = LazyArray(op=op, operands=(var,)+others, opargs=opargs, shape=var.shape, dtype=sample.dtype)
+  if atts is None: atts = var.atts.copy()
+  atts['name'] = name; atts['units'] = units
+  lvar = LazyVar(expression=expression, blocksize=var.blocksize, axes=var.axes, atts=atts)
+  # return LazyVar or evaluated data
+  return lvar if asVar else lvar.evaluate()
+
+def deferBinaryOp(binOp, orig, other, othername=None, otherunits=None, asVar=True, **kwargs):
+  ''' Defer a binary arithmetic operation (called from BinaryCheckAndCreateVar, after all checks). '''
+  if isinstance(other,Variable): atts = joinDicts(orig.atts, other.atts)
+  else: atts = orig.atts.copy()
+  opargs = dict(othername=othername, otherunits=otherunits, linplace=False, **kwargs)
+  return deferOperation(binOp, orig, others=(other,), opargs=opargs, asVar=asVar, atts=atts)
+
+def asLazyVar(var, name=None, atts=None, blocksize=None):
+  ''' Wrap a Variable (e.g. a VarNC) as a LazyVar, so that arithmetic with it is deferred; data are not
+      loaded and are read in blocks, when the expression is evaluated. '''
+  if not isinstance(var,Variable): raise TypeError, var
+  expression = LazyArray(op=None, operands=(var,), shape=var.shape, dtype=var.dtype)
+  vatts = var.atts.copy()
+  if atts is not None: vatts.update(atts)
+  if name is not None: vatts['name'] = name
+  return LazyVar(expression=expression, blocksize=blocksize, axes=var.axes, atts=vatts, plot=var.plot.copy())
@@ -8,9 +8,10 @@ A module that provides access to NetCDF datasets for GeoData datasets and variab
 
 # external imports
 import numpy as np
+import numpy.ma as ma
 import collections as col
 import netCDF4 as nc # netcdf python module
-import os, functools
+import os, glob, functools
 
 # import all base functionality from PyGeoDat
 # from nctools import * # my own netcdf toolkit
@@ -19,6 +20,11 @@ from geodata.misc import checkIndex, isEqual, joinDicts
 from geodata.misc import ( DatasetError, DataError, AxisError, NetCDFError, PermissionError, 
                            FileError, VariableError, ArgumentError, EmptyDatasetError )
 from utils.nctools import coerceAtts, writeNetCDF, add_var, add_coord, checkFillValue
+from utils.nctools import MultiFileDataset, MultiFileVariable, memmapNC3, writeBlocks
+
+# NetCDF Dataset and Variable types (including virtual multi-file datasets)
+ncDatasetTypes = (nc.Dataset, MultiFileDataset)
+ncVariableTypes = (nc.Variable, MultiFileVariable)
 
 
 def asVarNC(var=None, ncvar=None, mode='rw', axes=None, deepcopy=False, **kwargs):
@@ -37,7 +43,7 @@ def asVarNC(var=None, ncvar=None, mode='rw', axes=None, deepcopy=False, **kwargs
   else: axes = var.axes
   # create new VarNC instance (using the ncvar NetCDF Variable instance as file reference)
   if not isinstance(var,Variable): raise TypeError
-  if not isinstance(ncvar,(nc.Variable,nc.Dataset)): raise TypeError
+  if not isinstance(ncvar,ncVariableTypes+ncDatasetTypes): raise TypeError
   atts = kwargs.pop('atts',var.atts.copy()) # name and units are also stored in atts!
   plot = kwargs.pop('plot',var.plot.copy())
   varnc = VarNC(ncvar, axes=axes, atts=atts, plot=plot, dtype=var.dtype, mode=mode, **kwargs)
@@ -50,7 +56,7 @@ def asAxisNC(ax=None, ncvar=None, mode='rw', deepcopy=True, **kwargs):
   ''' Simple function to cast an Axis instance as a AxisNC (NetCDF-capable Axis subclass). '''
   # create new AxisNC instance (using the ncvar NetCDF Variable instance as file reference)
   if not isinstance(ax,Axis): raise TypeError
-  if not isinstance(ncvar,(nc.Variable,nc.Dataset)): raise TypeError # this is for the coordinate variable, not the dimension
+  if not isinstance(ncvar,ncVariableTypes+ncDatasetTypes): raise TypeError # this is for the coordinate variable, not the dimension
   # axes are handled automatically (self-reference)  )
   atts = kwargs.pop('atts',ax.atts.copy()) # name and units are also stored in atts!
   plot = kwargs.pop('plot',ax.plot.copy())
@@ -111,7 +117,7 @@ class VarNC(Variable):
   
   def __init__(self, ncvar, name=None, units=None, axes=None, data=None, dtype=None, scalefactor=1, 
                offset=0, transform=None, atts=None, plot=None, fillValue=None, mode='r', load=False, 
-               squeeze=False, slices=None):
+               squeeze=False, slices=None, memmap=False, scaledtype=None):
     ''' 
       Initialize Variable instance based on NetCDF variable.
       
@@ -120,9 +126,11 @@ class VarNC(Variable):
         ncvar = None # the associated netcdf variable
         scalefactor = 1 # linear scale factor w.r.t. values in netcdf file
         offset = 0 # constant offset w.r.t. values in netcdf file
+        scaledtype = None # dtype of scaled data (default: numpy type promotion, like netCDF4)
         transform = None # function that can perform non-trivial transforms upon load
         squeezed = False # if True, all singleton dimensions in NetCDF Variable are silently ignored
         slices = None # slice with respect to NetCDF Variable
+        memmap = False # read NetCDF3 files through a (copy-on-write) memory map, instead of netCDF4
     '''
     # check mode
     if not (mode == 'w' or mode == 'r' or mode == 'rw' or mode == 'wr'):  raise PermissionError  
@@ -140,11 +148,11 @@ class VarNC(Variable):
       else: 
         if dtype is None: raise TypeError, "No data (-type) to construct NetCDF variable!"
         ncvar = add_var(ncvar, name, dims=dims, shape=dimshape, atts=atts, dtype=dtype, fillValue=fillValue, zlib=True)
-    elif isinstance(ncvar,nc.Variable):
+    elif isinstance(ncvar,ncVariableTypes):
       if dtype is None: dtype = ncvar.dtype
     if dtype is not None: dtype = np.dtype(dtype) # proper formatting
     # some type checking
-    if not isinstance(ncvar,nc.Variable): raise TypeError, "Argument 'ncvar' has to be a NetCDF Variable or Dataset."        
+    if not isinstance(ncvar,ncVariableTypes): raise TypeError, "Argument 'ncvar' has to be a NetCDF Variable or Dataset."        
     if data is not None and slices is None and data.shape != ncvar.shape: raise DataError
     if data is not None and slices is not None and len(slices) != data.ndim:
       raise DataError, "Data and slice have incompatible dimensions!"      
@@ -202,6 +210,8 @@ class VarNC(Variable):
     self.__dict__['transform'] = transform
     self.__dict__['squeezed'] = False
     self.__dict__['slices'] = slices # initial default (i.e. everything)
+    self.__dict__['memmap'] = memmap
+    self.__dict__['scaledtype'] = scaledtype
     assert self.strvar == lstrvar
     assert self.strlen == strlen
     if squeeze: self.squeeze() # may set 'squeezed' to True
@@ -240,23 +250,108 @@ class VarNC(Variable):
         for i in xrange(self.ncvar.ndim):
           if self.ncvar.shape[i] == 1: slcs.insert(i, 0) # '0' automatically squeezes out this dimension upon retrieval
       # finally, get data!
-      data = self.ncvar.__getitem__(slcs) # exceptions handled by netcdf module
+      # N.B.: NetCDF scaling is fused with scalefactor and offset, so netCDF4 only has to read raw data
+      ncatts = self.ncvar.ncattrs()
+      lncscale = self.ncvar.scale and not self.strvar and ('scale_factor' in ncatts or 'add_offset' in ncatts)
+      if lncscale: self.ncvar.set_auto_scale(False)
+      try:
+        data = self._readMemmap(slcs) if self.memmap and 'w' not in self.mode else None
+        if data is None: data = self.ncvar.__getitem__(slcs) # exceptions handled by netcdf module
+      finally:
+        if lncscale: self.ncvar.set_auto_scale(True)
+      # apply NetCDF scaling, scalefactor and offset
+      if not self.strvar: data = self._scaleData(data, lncscale=lncscale)
+      if self.scaledtype is not None and not self.strvar: self.dtype = np.dtype(self.scaledtype) # explicitly requested
       if self.dtype is not None and not np.issubdtype(data.dtype,self.dtype):
-        if 'scale_factor' in self.ncvar.ncattrs():
-          self.dtype = data.dtype # data was scaled automatically in NetCDF module
+        if lncscale or self.scaledtype is not None or self.scalefactor != 1 or self.offset != 0:
+          self.dtype = data.dtype # data was scaled (and cast)
           if isinstance(data,np.ma.MaskedArray): self.fillValue = data.fill_value # possibly scaled
         else: 
           raise DataError, "NetCDF data dtype does not match Variable dtype (ncvar.dtype={:s})".format(self.ncvar.dtype) 
       if self.strvar: data = nc.chartostring(data)
       #assert self.ndim == data.ndim # make sure that squeezing works!
       # N.B.: the shape and even dimension number can change dynamically when a slice is loaded, so don't check for that, or it will fail!
-      # apply scalefactor and offset
-      if self.scalefactor != 1: data *= self.scalefactor
-      if self.offset != 0: data += self.offset
       if self.transform is not None: data = self.transform(data, var=self, slc=slc)
     # return data
     return data
   
+  def _scaleData(self, data, lncscale=True):
+    ''' Apply NetCDF scale_factor and add_offset (if lncscale), followed by scalefactor and offset, in-place
+        on the data buffer; only a change of dtype creates a copy. The mask is not touched until the end. 
+        The dtype is scaledtype or the dtype of the NetCDF scaling (like netCDF4), which is retained by 
+        scalefactor and offset (only integers are promoted, following numpy type promotion rules). '''
+    scale_factor = None; add_offset = None; scalars = []
+    if lncscale:
+      ncatts = self.ncvar.ncattrs()
+      scale_factor = self.ncvar.getncattr('scale_factor') if 'scale_factor' in ncatts else None
+      add_offset = self.ncvar.getncattr('add_offset') if 'add_offset' in ncatts else None
+      # N.B.: netCDF4 does not scale, if scale_factor and add_offset are trivial
+      if ( scale_factor is not None and scale_factor != 1 ) or ( add_offset is not None and add_offset != 0 ):
+        scalars += [att for att in (scale_factor,add_offset) if att is not None]
+      else: scale_factor = None; add_offset = None
+    vscalars = ([self.scalefactor] if self.scalefactor != 1 else []) + ([self.offset] if self.offset != 0 else [])
+    if len(scalars) == 0 and len(vscalars) == 0 and self.scaledtype is None: return data # nothing to do
+    # figure out dtype and get data buffer (without mask)
+    values = ma.getdata(data)
+    if self.scaledtype is not None: dtype = np.dtype(self.scaledtype)
+    else:
+      dtype = np.result_type(values, *scalars) # same as netCDF4
+      if dtype.kind in ('b','i','u') and vscalars: dtype = np.result_type(dtype, *vscalars)
+    if values.dtype.newbyteorder('=') != dtype or not values.flags.writeable: 
+      values = values.astype(dtype) # the only copy
+    # N.B.: the two transformations are applied one after the other (first netCDF4, then VarNC), 
+    #       rather than folded into one, so that rounding is the same as with separate scaling
+    if scale_factor is not None: values *= scale_factor
+    if add_offset is not None: values += add_offset
+    if self.scalefactor != 1: values *= self.scalefactor
+    if self.offset != 0: values += self.offset
+    # re-attach mask
+    if values is ma.getdata(data): pass # in-place
+    elif isinstance(data,ma.MaskedArray):
+      data = ma.array(values, mask=data.mask, fill_value=data.fill_value, copy=False)
+    else: data = values
+    return data
+  
+  def _readMemmap(self, slcs):
+    ''' Read data from a memory map of a NetCDF3 file (returns None for other formats); slices and integer
+        indices return views, index lists are applied along each axis (like in netCDF4), and masking and 
+        scaling attributes are applied, if enabled in the NetCDF variable (like in netCDF4). '''
+    if self.ncvar.mask and any(att in self.ncvar.ncattrs() for att in ('valid_min','valid_max','valid_range')):
+      return None # N.B.: valid ranges are not implemented; use netCDF4 instead
+    data = memmapNC3(self.ncvar)
+    if data is None: return None
+    # apply basic indices first (views), then index lists 
+    basic = []; lists = []
+    for slc in slcs:
+      if isinstance(slc,(list,tuple,np.ndarray)):
+        slc = np.asarray(slc)
+        if slc.dtype == np.bool_: slc = np.nonzero(slc)[0] 
+        lists.append((len(basic)-len([s for s in basic if isinstance(s,(int,np.integer))]),slc))
+        basic.append(slice(None))
+      else: basic.append(slc)
+    data = data.__getitem__(tuple(basic))
+    for iax,idx in lists: data = data.take(idx, axis=iax)
+    # mask missing values (the same way as netCDF4)
+    ncatts = self.ncvar.ncattrs() if self.ncvar.mask else []
+    if not self.ncvar.mask: fillValues = []
+    elif '_FillValue' in ncatts: fillValues = [self.ncvar.getncattr('_FillValue')]
+    elif data.dtype.itemsize > 1: fillValues = [nc.default_fillvals[data.dtype.str[1:]]]
+    else: fillValues = [] # byte variables are not masked by default 
+    if 'missing_value' in ncatts: fillValues += list(np.atleast_1d(self.ncvar.getncattr('missing_value')))
+    if len(fillValues) > 0 and data.dtype.kind != 'S':
+      mask = np.zeros(data.shape, dtype=np.bool)
+      for fillValue in fillValues: mask |= data == fillValue
+      if mask.any(): data = ma.array(data, mask=mask, fill_value=fillValues[0], copy=False)
+    # apply scale factor and offset (this creates a copy)
+    ncatts = self.ncvar.ncattrs() if self.ncvar.scale else []
+    scale_factor = self.ncvar.getncattr('scale_factor') if 'scale_factor' in ncatts else 1.
+    add_offset = self.ncvar.getncattr('add_offset') if 'add_offset' in ncatts else 0.
+    if scale_factor != 1.: 
+      data = data*scale_factor # new array
+      if add_offset != 0.: data += add_offset
+    elif add_offset != 0.: data = data+add_offset
+    return data
+  
   def slicing(self, lidx=None, lrng=None, years=None, listAxis=None, asVar=None, lsqueeze=True, 
               lcheck=False, lcopy=False, lslices=False, linplace=False, asNC=None, **axes):
     ''' This method implements access to slices via coordinate values and returns Variable objects. 
@@ -287,18 +382,20 @@ class VarNC(Variable):
       
       # create new VarNC instance with different slices
       newvar = asVarNC(newvar, self.ncvar, mode=self.mode, axes=axes, slices=slcs, squeeze=lsqueeze,
-                       scalefactor=self.scalefactor, offset=self.offset, transform=self.transform)
+                       scalefactor=self.scalefactor, offset=self.offset, transform=self.transform, 
+                       memmap=self.memmap, scaledtype=self.scaledtype)
     # N.B.: the copy method can also cast as VarNC and it is called in slicing; however, slicing
     #       can not communicate slices correctly, so that casting as VarNC has to happen here
     if lslices: return newvar, slcs
     else: return newvar
   
-  def getArray(self, idx=None, axes=None, broadcast=False, unmask=False, fillValue=None, copy=True):
+  def getArray(self, idx=None, axes=None, broadcast=False, unmask=False, fillValue=None, copy=True, lmasked=False,
+               ltile=False):
     ''' Copy the entire data array or a slice; option to unmask and to reorder/reshape to specified axes. '''
     # use __getitem__ to get slice
     if not self.data: self.load()       
-    return super(VarNC,self).getArray(idx=idx, axes=axes, broadcast=broadcast, unmask=unmask, 
-                                      fillValue=fillValue, copy=copy) # just call superior
+    return super(VarNC,self).getArray(idx=idx, axes=axes, broadcast=broadcast, unmask=unmask, fillValue=fillValue, 
+                                      copy=copy, lmasked=lmasked, ltile=ltile) # just call superior
    
   def squeeze(self, **kwargs):
     ''' A method to remove singleton dimensions; special handling of __getitem__() is necessary, 
@@ -323,6 +420,8 @@ class VarNC(Variable):
       if 'transform' not in newargs: newargs['transform'] = self.transform
       if 'offset' not in newargs: newargs['offset'] = self.offset
       if 'slices' not in newargs: newargs['slices'] = self.slices
+      if 'memmap' not in newargs: newargs['memmap'] = self.memmap
+      if 'scaledtype' not in newargs: newargs['scaledtype'] = self.scaledtype
       copyvar = asVarNC(var=copyvar, ncvar=self.ncvar, mode=self.mode, **newargs)
     else:
       if not copyvar.data and not 'data' in newargs: 
@@ -408,13 +507,16 @@ class VarNC(Variable):
       if self.data:
         fillValue = self.fillValue
         # special handling of some data types
+        # N.B.: data are written in blocks, so that masking and type casts don't copy the entire array
+        data = self.data_array
+        if self.squeezed and data.shape != ncvar.shape: data = data.reshape(ncvar.shape) # a view
         if isinstance(self.data_array,np.bool_): 
-          ncvar[:] = self.data_array.astype('i1') # cast boolean as 8-bit integers
+          writeBlocks(ncvar, data, dtype=np.dtype('i1')) # cast boolean as 8-bit integers
           if fillValue is not None: fillValue = 1 if fillValue else 0
         elif self.strvar:
           ncvar[:] = nc.stringtochar(self.data_array) # transform string array to char array with one more dimension
           if fillValue is not None: raise NotImplementedError
-        else: ncvar[:] = self.data_array # masking should be handled by the NetCDF module
+        else: writeBlocks(ncvar, data) # masking should be handled by the NetCDF module
         # reset scale factors etc.
         self.scalefactor = 1; self.offset = 0
         fillValue = checkFillValue(fillValue, self.dtype)
@@ -478,7 +580,8 @@ class DatasetNetCDF(Dataset):
   
   def __init__(self, name=None, title=None, dataset=None, filelist=None, varlist=None, variables=None,
       	       varatts=None, atts=None, axes=None, multifile=False, check_override=None, ignore_list=None, 
-               folder='', mode='r', ncformat='NETCDF4', squeeze=True, load=False, check_vars=None):
+               folder='', mode='r', ncformat='NETCDF4', squeeze=True, load=False, check_vars=None, 
+               aggdim=None, maxopen=None, memmap=False):
     ''' 
       Create a Dataset from one or more NetCDF files; Variables are created from NetCDF variables. 
       Alternatively, create a netcdf file from an existing Dataset (Variables can be added as well).  
@@ -491,7 +594,10 @@ class DatasetNetCDF(Dataset):
         varatts        : dict of dicts with arguments for the Variable/Axis constructor (for each variable/axis) 
         atts           : dict with attributes for the new dataset
         axes           : list/tuple of axes to use (Axis or AxisNC); overrides axes of same name in NetCDF file 
-        multifile      : open file list using the netCDF4 MFDataset multi-file option (logical)
+        multifile      : treat each element of the file list as a list of files (or a glob pattern), which are
+                         concatenated along the record dimension and opened on demand; read-only (logical)
+        aggdim         : record dimension for multi-file datasets (default: the unlimited dimension)
+        maxopen        : maximum number of simultaneously open files per multi-file dataset
         check_override : overrides consistency check for axes of same name for listed names (list/tuple of strings) 
         ignore_list    : ignore listed variables and dimensions and any variables that depend on listed dimensions (list/tuple/set of strings; original names)
         folder         : root folder for file list (string); this path is prepended to all filenames
@@ -499,6 +605,7 @@ class DatasetNetCDF(Dataset):
         ncformat       : format of NetCDF file, i.e. NETCDF3 NETCDF4 or NETCDF_CLASSIC (string; passed to netCDF4.Dataset)
         squeeze        : squeeze singleton dimensions from all variables
         load           : load data from disk immediately (passed on to VarNC)
+        memmap         : read NetCDF3 files through memory maps, instead of netCDF4 (passed on to VarNC)
                        
       NetCDF Attributes:
         mode           = 'r' # a string indicating whether read ('r') or write ('w') actions are intended/permitted
@@ -513,11 +620,11 @@ class DatasetNetCDF(Dataset):
     if len(folder) > 0 and folder[-1] != '/': folder += '/'
     if variables is None:
       # either use available NetCDF datasets directly, ...  
-      if isinstance(dataset,nc.Dataset):
+      if isinstance(dataset,ncDatasetTypes):
         datasets = [dataset]  # datasets is used later
         if 'filepath' in dir(dataset): filelist = [dataset.filepath] # only available in newer versions
       elif isinstance(dataset,(list,tuple)):
-        if not all([isinstance(ds,nc.Dataset) for ds in dataset]): raise TypeError
+        if not all([isinstance(ds,ncDatasetTypes) for ds in dataset]): raise TypeError
         datasets = dataset
         filelist = [dataset.filepath() for dataset in datasets if 'filepath' in dir(dataset)]
       # ... create a new NetCDF file, ...
@@ -549,17 +656,22 @@ class DatasetNetCDF(Dataset):
         ncmode = 'a' if 'r' in mode and 'w' in mode else mode # 'rw' -> 'a' for "append"     
         # open netcdf datasets from netcdf files
         if not isinstance(filelist,col.Iterable): raise TypeError
+        if multifile and ncmode != 'r': raise PermissionError, "Multi-file datasets are read-only."
         # check if file exists
         for filename in filelist:
-          if not os.path.exists(folder+filename): 
-            raise FileError, "File {0:s} not found in folder {1:s}".format(filename,folder)     
+          if multifile and isinstance(filename,(list,tuple)): filenames = filename
+          elif multifile: filenames = [] if glob.glob(folder+filename) else [filename] # glob pattern
+          else: filenames = [filename]
+          for filename in filenames:
+            if not os.path.exists(folder+filename): 
+              raise FileError, "File {0:s} not found in folder {1:s}".format(filename,folder)     
         datasets = []; filenames = []
         for ncfile in filelist:        
           try: # NetCDF4 error messages are not very helpful...
-            if multifile: # open a netCDF4 multi-file dataset 
+            if multifile: # open a virtual multi-file dataset (aggregated along the record dimension) 
               if isinstance(ncfile,(list,tuple)): tmpfile = [folder+ncf for ncf in ncfile]
-              else: tmpfile = folder+ncfile # multifile via regular expressions
-              datasets.append(nc.MFDataset(tmpfile), mode=ncmode, format=ncformat, clobber=False)
+              else: tmpfile = folder+ncfile # multifile via glob patterns
+              datasets.append(MultiFileDataset(tmpfile, aggdim=aggdim, maxopen=maxopen))
             else: # open a simple single-file dataset
               tmpfile = folder+ncfile
               datasets.append(nc.Dataset(tmpfile, mode=ncmode, format=ncformat, clobber=False))
@@ -651,12 +763,12 @@ class DatasetNetCDF(Dataset):
               # N.B.: apparently len(dim) does not work properly - ncvar.shape is more reliable
               # create new variable using the override parameters in varatts
               variables[tmpatts['name']] = VarNC(ncvar=ncvar, axes=varaxes, dtype=strtype, 
-                                                 mode=mode, squeeze=squeeze, load=load, **tmpatts)
+                                                 mode=mode, squeeze=squeeze, load=load, memmap=memmap, **tmpatts)
             elif all([dim in axes for dim in ncvar.dimensions]):
               varaxes = [axes[dim] for dim in ncvar.dimensions] # collect axes
               # create new variable using the override parameters in varatts
               variables[tmpatts['name']] = VarNC(ncvar=ncvar, axes=varaxes, 
-                                                 mode=mode, squeeze=squeeze, load=load, **tmpatts)
+                                                 mode=mode, squeeze=squeeze, load=load, memmap=memmap, **tmpatts)
               # N.B.: using tmpatts['name'] as key is more reliable in preventing duplicate variables,
               #       because it also works when NetCDF names are different across files
             elif not any([dim in ignore_list for dim in ncvar.dimensions]): # legitimate omission
@@ -664,12 +776,12 @@ class DatasetNetCDF(Dataset):
       variables = variables.values()
     else:
       if isinstance(variables,dict): variables = variables.values()
-      if isinstance(dataset,nc.Dataset):
+      if isinstance(dataset,ncDatasetTypes):
         datasets = [dataset]  # datasets is used later
         if 'filepath' in dir(dataset): filelist = [dataset.filepath] # only available in newer versions
         else: raise ValueError
       elif isinstance(dataset,(list,tuple)):
-        if not all([isinstance(ds,nc.Dataset) for ds in dataset]): raise TypeError
+        if not all([isinstance(ds,ncDatasetTypes) for ds in dataset]): raise TypeError
         datasets = dataset
         filelist = [dataset.filepath() for dataset in datasets if 'filepath' in dir(dataset)]
         if len(filelist) == 0: raise ValueError
@@ -677,7 +789,7 @@ class DatasetNetCDF(Dataset):
       if filelist is None: raise ArgumentError
       mode = 'r' # for now, only allow read
     # get attributes from NetCDF dataset
-    ncattrs = joinDicts(*[ds.__dict__ for ds in datasets])
+    ncattrs = joinDicts(*[{att:ds.getncattr(att) for att in ds.ncattrs()} for ds in datasets])
     # update NC atts with attributes passed to constructor
     if atts is not None: ncattrs.update(atts) # update with attributes passed to constructor
     self.__dict__['mode'] = mode
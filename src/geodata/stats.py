@@ -12,13 +12,16 @@ subclasses for handling distribution functions over grid points.
 import numpy as np
 import numpy.ma as ma
 import scipy.stats as ss
+from scipy.stats.morestats import _Avals_norm, _Avals_expon # critical values for Anderson-Darling Test
+from scipy import optimize
 from numpy.linalg.linalg import LinAlgError
 from processing.multiprocess import apply_along_axis
 import functools
+import hashlib
 # internal imports
 from geodata.base import Variable, Axis
 from geodata.misc import DataError, ArgumentError, VariableError, AxisError, DistVarError
-from utils.misc import standardize, smooth, detrend, apply_over_arrays
+from utils.misc import standardize, smooth, detrend
 import utils.stats as myss # modified stats fucntions from scipy 
 from plotting.properties import getPlotAtts
 
@@ -105,10 +108,193 @@ def shapiro_wrapper(data, reta=False, ignoreNaN=True):
   # N.B.: a only depends on the length of data, so it can be easily reused in array operation
 
 
+## vectorized univariate tests
+# N.B.: these functions operate on entire arrays with the sample axis last and only return p-values; NaN's 
+#       are removed from each series (at least 3 valid values are required) and results match SciPy
+
+# sort samples along the last axis
+def sort_1samp(data, ignoreNaN=True, nmin=3):
+  ''' sort samples along the last axis (NaN's last); returns the sorted array, the number of valid values, 
+      a mask of series with enough valid values and a mask of valid elements '''
+  data = np.sort(data, axis=-1)
+  lnonan = np.invert(np.isnan(data))
+  n = lnonan.sum(axis=-1).astype(np.float64)
+  if ignoreNaN: lvalid = n >= nmin
+  else: lvalid = n == data.shape[-1] # NaN's are not removed
+  return data, n, lvalid, lnonan
+
+# vectorized single-sample Kolmogorov-Smirnov Test
+def kstest_vectorized(data, dist='norm', args=None, ignoreNaN=True, N=None, alternative='two-sided', mode='approx'):
+  ''' Kolmogorov-Smirnov Test for all series along the last axis at once, using sorted samples and a 
+      broadcasted CDF evaluation; 'args' can be a tuple of distribution parameters (shape, loc, scale) or 
+      an array with parameters for each series along the last axis ('N' is not used). '''
+  data, n, lvalid, lnonan = sort_1samp(data, ignoreNaN=ignoreNaN)
+  if args is None: args = ()
+  elif isinstance(args, np.ndarray) and args.ndim == data.ndim: # parameters for each series
+    lvalid = lvalid & np.invert(np.any(np.isnan(args), axis=-1))
+    args = [args[...,i:i+1] for i in xrange(args.shape[-1])] # column vectors broadcast against samples
+  if isinstance(dist, basestring): dist = getattr(ss,dist)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    cdfvals = dist.cdf(data, *args)
+    i = np.arange(1., data.shape[-1]+1); nn = n[...,np.newaxis]
+    Dplus = np.where(lnonan, i/nn - cdfvals, -np.inf).max(axis=-1)
+    Dmin = np.where(lnonan, cdfvals - (i-1.)/nn, -np.inf).max(axis=-1)
+    if alternative == 'greater': pval = ss.ksone.sf(Dplus, n)
+    elif alternative == 'less': pval = ss.ksone.sf(Dmin, n)
+    elif alternative in ('two-sided','two_sided'):
+      D = np.maximum(Dplus, Dmin)
+      pval = ss.kstwobign.sf(D * np.sqrt(n))
+      if mode == 'approx': # same as SciPy
+        pval = np.where(( n > 2666 ) | ( pval > 0.80 - n*0.3/1000 ), pval, 2 * ss.ksone.sf(D, n))
+      elif mode != 'asymp': raise ArgumentError, mode
+    else: raise ArgumentError, alternative
+  return np.where(lvalid, pval, np.NaN)
+
+# vectorized Anderson-Darling Test
+def anderson_vectorized(data, dist='norm', ignoreNaN=True):
+  ''' Anderson-Darling Test for all series along the last axis at once; only the normal and exponential 
+      distributions are supported (the other distributions require a fit for each series). '''
+  if dist not in ('norm','expon'): raise NotImplementedError, dist
+  data, n, lvalid, lnonan = sort_1samp(data, ignoreNaN=ignoreNaN)
+  nn = n[...,np.newaxis]; sig = np.array([15, 10, 5, 2.5, 1])
+  with np.errstate(invalid='ignore', divide='ignore'):
+    xbar = np.nansum(data, axis=-1)[...,np.newaxis] / nn
+    if dist == 'norm':
+      s = np.sqrt(np.nansum(( data - xbar )**2, axis=-1)[...,np.newaxis] / ( nn - 1 ))
+      w = ( data - xbar ) / s
+      critical = np.around(_Avals_norm / (1.0 + 4.0/nn - 25.0/nn/nn), 3)
+    else:
+      w = data / xbar
+      critical = np.around(_Avals_expon / (1.0 + 0.6/nn), 3)
+    logcdf = getattr(ss,dist).logcdf(w); logsf = getattr(ss,dist).logsf(w)
+    # pair every element with the element at the mirrored position of the valid part of the series
+    idx = np.arange(data.shape[-1])
+    logsf = take_along_last(logsf, np.where(lnonan, nn-1-idx, 0).astype(np.intp))
+    A2 = -n - np.where(lnonan, ( 2*idx + 1. ) / nn * ( logcdf + logsf ), 0.).sum(axis=-1)
+    ncrit = ( critical < A2[...,np.newaxis] ).sum(axis=-1) # same as np.searchsorted
+  pval = sig[np.maximum(0, ncrit-1)]/100.
+  return np.where(lvalid & np.invert(np.isnan(A2)), pval, np.NaN)
+
+# vectorized normaltest (D'Agostino and Pearson)
+def normaltest_vectorized(data, ignoreNaN=True):
+  ''' Test for normality for all series along the last axis at once, based on the skewness and kurtosis
+      of each series (skewtest and kurtosistest); at least 8 valid values are required. '''
+  n = np.invert(np.isnan(data)).sum(axis=-1).astype(np.float64)
+  lvalid = ( n >= 8 ) if ignoreNaN else ( n == data.shape[-1] ) & ( n >= 8 )
+  with np.errstate(invalid='ignore', divide='ignore'):
+    dm = data - ( np.nansum(data, axis=-1) / n )[...,np.newaxis]
+    m2 = np.nansum(dm**2, axis=-1) / n; m3 = np.nansum(dm**3, axis=-1) / n; m4 = np.nansum(dm**4, axis=-1) / n
+    # skewtest
+    b2 = np.where(m2 == 0, 0, m3 / m2**1.5) 
+    y = b2 * np.sqrt(((n + 1) * (n + 3)) / (6.0 * (n - 2)))
+    beta2 = (3.0 * (n**2 + 27*n - 70) * (n+1) * (n+3) / ((n-2.0) * (n+5) * (n+7) * (n+9)))
+    W2 = -1 + np.sqrt(2 * (beta2 - 1))
+    delta = 1 / np.sqrt(0.5 * np.log(W2))
+    alpha = np.sqrt(2.0 / (W2 - 1))
+    y = np.where(y == 0, 1, y)
+    Zs = delta * np.log(y / alpha + np.sqrt((y / alpha)**2 + 1))
+    # kurtosistest
+    b2 = np.where(m2 == 0, 0, m4 / m2**2)
+    E = 3.0*(n-1) / (n+1)
+    varb2 = 24.0*n*(n-2)*(n-3) / ((n+1)*(n+1.)*(n+3)*(n+5))
+    x = (b2-E) / np.sqrt(varb2)
+    sqrtbeta1 = 6.0*(n*n-5*n+2)/((n+7)*(n+9)) * np.sqrt((6.0*(n+3)*(n+5)) / (n*(n-2)*(n-3)))
+    A = 6.0 + 8.0/sqrtbeta1 * (2.0/sqrtbeta1 + np.sqrt(1+4.0/(sqrtbeta1**2)))
+    term1 = 1 - 2/(9.0*A)
+    denom = 1 + x*np.sqrt(2/(A-4.0))
+    denom = np.where(denom < 0, 99, denom)
+    term2 = np.power((1-2.0/A)/denom, 1/3.0)
+    Zk = np.where(denom == 99, 0, (term1 - term2) / np.sqrt(2/(9.0*A)))
+    pval = ss.chi2.sf(Zs*Zs + Zk*Zk, 2)
+  return np.where(lvalid, pval, np.NaN)
+
+# table of Shapiro-Wilk coefficients for each sample size
+shapiro_coefficients = dict()
+def shapiro_coeffs(n):
+  ''' return the Shapiro-Wilk coefficients for sample size n (only depend on n; computed once with SciPy) '''
+  if n not in shapiro_coefficients:
+    W, pval, a = ss.shapiro(np.linspace(-1,1,n), reta=True); del W, pval # any sample will do
+    shapiro_coefficients[n] = np.asarray(a, dtype=np.float64)
+  return shapiro_coefficients[n]
+
+# p-value of the Shapiro-Wilk statistic
+def shapiro_pval(W, n):
+  ''' p-value of the Shapiro-Wilk statistic W for sample size n (Royston's approximation, like SciPy) '''
+  poly = lambda c, x: np.polyval(c[::-1], x) # coefficients in ascending order
+  with np.errstate(invalid='ignore', divide='ignore'):
+    if n == 3: return np.maximum(6./np.pi * ( np.arcsin(np.sqrt(W)) - np.pi/3. ), 0.)
+    w1 = np.log(1. - W)
+    if n <= 11:
+      gamma = poly([-2.273,.459], n)
+      m = poly([.544,-.39978,.025054,-6.714e-4], n); s = np.exp(poly([1.3822,-.77857,.062767,-.0020322], n))
+      return np.where(w1 >= gamma, 1e-99, ss.norm.sf(-np.log(gamma - w1), m, s))
+    else:
+      m = poly([-1.5861,-.31082,-.083751,.0038915], np.log(n)); s = np.exp(poly([-.4803,-.082676,.0030302], np.log(n)))
+      return ss.norm.sf(w1, m, s)
+
+# vectorized Shapiro-Wilk test of normality
+def shapiro_vectorized(data, ignoreNaN=True):
+  ''' Shapiro-Wilk Test for all series along the last axis at once; series are grouped by the number of 
+      valid values, so that the coefficients are only computed once for each sample size. '''
+  shape = data.shape[:-1]; data = data.reshape((-1,data.shape[-1])) # also works for a single series
+  data, n, lvalid, lnonan = sort_1samp(data, ignoreNaN=ignoreNaN)
+  pval = np.zeros(n.shape) + np.NaN
+  for nv in np.unique(n[lvalid]).astype(np.int):
+    lsel = lvalid & ( n == nv ); y = data[lsel][:,:nv] # valid part of sorted series
+    a = shapiro_coeffs(nv); h = nv//2
+    with np.errstate(invalid='ignore', divide='ignore'):
+      W = np.dot(y[:,::-1][:,:h] - y[:,:h], a)**2 / (( y - y.mean(axis=-1)[:,np.newaxis] )**2).sum(axis=-1)
+    pval[lsel] = shapiro_pval(np.minimum(W, 1.), nv)
+  return pval.reshape(shape)
+
+
 ## bivariate statistical tests
+
+# N.B.: the vectorized versions of the tests operate on entire arrays with the sample axis last; they use the
+#       same NaN handling as the wrappers (at least 3 valid values in each sample) and only return p-values
+
+# count valid values for vectorized two-sample tests
+def count_valid_2samp(data1, data2, ignoreNaN=True, nmin=3):
+  ''' count valid (non-NaN) values in each sample and determine where enough values are available '''
+  n1 = np.invert(np.isnan(data1)).sum(axis=-1).astype(np.float64)
+  n2 = np.invert(np.isnan(data2)).sum(axis=-1).astype(np.float64)
+  if ignoreNaN: lvalid = ( n1 >= nmin ) & ( n2 >= nmin )
+  else: lvalid = ( n1 == data1.shape[-1] ) & ( n2 == data2.shape[-1] ) # NaN's are not removed
+  return n1, n2, lvalid
+
+# sort merged samples along the last axis
+def sort_2samp(data1, data2):
+  ''' sort the merged samples along the last axis; returns the sorted array, a mask indicating elements from 
+      the first sample, a mask of valid (non-NaN) elements, and a mask indicating the last element of each
+      group of tied values (N.B.: NaN's are sorted last and never tied) '''
+  if data1.ndim != data2.ndim: # broadcast a single reference series
+    shape = np.broadcast(data1[...,0], data2[...,0]).shape
+    data1 = np.broadcast_to(data1, shape+data1.shape[-1:]); data2 = np.broadcast_to(data2, shape+data2.shape[-1:])
+  data = np.concatenate((data1, data2), axis=-1)
+  order = np.argsort(data, axis=-1, kind='mergesort')
+  data = take_along_last(data, order)
+  lfirst = order < data1.shape[-1]
+  lvalid = np.invert(np.isnan(data))
+  lend = np.ones(data.shape, dtype=np.bool)
+  with np.errstate(invalid='ignore'): lend[...,:-1] = data[...,1:] != data[...,:-1]
+  return data, lfirst, lvalid, lend
+
+# rank merged samples along the last axis
+def rank_2samp(data1, data2):
+  ''' rank the merged samples along the last axis (average ranks for ties, ignoring NaN's); returns the rank 
+      sum of the first sample and the tie term sum(t**3 - t) over all groups of ties '''
+  data, lfirst, lvalid, lend = sort_2samp(data1, data2)
+  n = data.shape[-1]; idx = np.arange(n)
+  lstart = np.ones(data.shape, dtype=np.bool); lstart[...,1:] = lend[...,:-1]
+  start = np.maximum.accumulate(np.where(lstart, idx, 0), axis=-1) 
+  end = np.minimum.accumulate(np.where(lend, idx, n)[...,::-1], axis=-1)[...,::-1]
+  ranks = ( start + end ) / 2. + 1.
+  ranksum = np.where(lvalid & lfirst, ranks, 0.).sum(axis=-1)
+  ties = np.where(lvalid, ( end - start + 1. )**2 - 1., 0.).sum(axis=-1) # N.B.: each element contributes t**2-1
+  return ranksum, ties
     
 # Kolmogorov-Smirnov Test on 2 samples
-def ks_2samp(sample1, sample2, lstatistic=False, ignoreNaN=True, **kwargs):
+def ks_2samp(sample1, sample2, lstatistic=False, ignoreNaN=True, lvectorize=True, **kwargs):
   ''' Apply the Kolmogorov-Smirnov Test, to test whether two samples are drawn from the same
       underlying (continuous) distribution; a high p-value means, the two samples are likely
       drawn from the same distribution. 
@@ -116,7 +302,8 @@ def ks_2samp(sample1, sample2, lstatistic=False, ignoreNaN=True, **kwargs):
       distributions (normal and non-normal). '''
   if lstatistic: raise NotImplementedError, "Return of test statistic is not yet implemented; only p-values are returned."
   testfct = functools.partial(ks_2samp_wrapper, ignoreNaN=ignoreNaN)
-  pvar = apply_stat_test_2samp(sample1, sample2, fct=testfct, laax=True, 
+  vecfct = functools.partial(ks_2samp_vectorized, ignoreNaN=ignoreNaN) if lvectorize else None
+  pvar = apply_stat_test_2samp(sample1, sample2, fct=testfct, vfct=vecfct, laax=True, 
                                lpval=True, lrho=False, **kwargs)
   return pvar
 kstest = ks_2samp # alias
@@ -138,16 +325,31 @@ def ks_2samp_wrapper(data, size1=None, ignoreNaN=True):
   D, pval = ss.ks_2samp(data1, data2); del D
   return pval  
 
+# vectorized Kolmogorov-Smirnov Test on 2 samples
+def ks_2samp_vectorized(data1, data2, ignoreNaN=True):
+  ''' Apply the Kolmogorov-Smirnov Test to all pairs of samples along the last axis at once; the maximum 
+      distance between the empirical CDFs is found from the sorted merged samples. '''
+  n1, n2, lvalid = count_valid_2samp(data1, data2, ignoreNaN=ignoreNaN)
+  data, lfirst, lnonan, lend = sort_2samp(data1, data2)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    # difference of empirical CDFs at the end of each group of tied values
+    cdfdiff = np.cumsum(lfirst & lnonan, axis=-1) / n1[...,np.newaxis] - np.cumsum(~lfirst & lnonan, axis=-1) / n2[...,np.newaxis]
+    D = np.where(lend & lnonan, np.abs(cdfdiff), 0.).max(axis=-1)
+    en = np.sqrt(n1 * n2 / ( n1 + n2 ))
+    pval = ss.kstwobign.sf(( en + 0.12 + 0.11 / en ) * D)
+  return np.where(lvalid, pval, np.NaN)
+
 
 # Stundent's T-test for two independent samples
-def ttest_ind(sample1, sample2, equal_var=True, lstatistic=False, ignoreNaN=True, **kwargs):
+def ttest_ind(sample1, sample2, equal_var=True, lstatistic=False, ignoreNaN=True, lvectorize=True, **kwargs):
   ''' Apply the Stundent's T-test for two independent samples, to test whether the samples 
       are drawn from the same underlying (continuous) distribution; a high p-value means, 
       the two samples are likely drawn from the same distribution. 
-      The T-test implementation is vectoriezed (unlike all other tests).'''
+      The vectorized implementation computes the moments of all samples at once and ignores NaN's.'''
   if lstatistic: raise NotImplementedError, "Return of test statistic is not yet implemented; only p-values are returned."
   testfct = functools.partial(ttest_ind_wrapper, ignoreNaN=ignoreNaN, equal_var=equal_var)
-  pvar = apply_stat_test_2samp(sample1, sample2, fct=testfct, laax=False, 
+  vecfct = functools.partial(ttest_ind_vectorized, ignoreNaN=ignoreNaN, equal_var=equal_var) if lvectorize else None
+  pvar = apply_stat_test_2samp(sample1, sample2, fct=testfct, vfct=vecfct, laax=False, 
                                lpval=True, lrho=False, **kwargs)
   return pvar
 ttest = ttest_ind # alias
@@ -171,9 +373,29 @@ def ttest_ind_wrapper(data, size1=None, axis=None, ignoreNaN=True, equal_var=Tru
   D, pval = ss.ttest_ind(data1, data2, axis=axis, equal_var=equal_var); del D
   return pval  
 
+# vectorized Stundent's T-test for two independent samples
+def ttest_ind_vectorized(data1, data2, ignoreNaN=True, equal_var=True):
+  ''' Apply the Stundent's (or Welch's, if equal_var=False) T-test to all pairs of samples along the last axis 
+      at once, using moments of the valid values. '''
+  n1, n2, lvalid = count_valid_2samp(data1, data2, ignoreNaN=ignoreNaN)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    m1 = np.nansum(data1, axis=-1) / n1; m2 = np.nansum(data2, axis=-1) / n2
+    v1 = np.nansum(( data1 - m1[...,np.newaxis] )**2, axis=-1) / ( n1 - 1 ) # unbiased variance
+    v2 = np.nansum(( data2 - m2[...,np.newaxis] )**2, axis=-1) / ( n2 - 1 )
+    if equal_var:
+      df = n1 + n2 - 2.
+      denom = np.sqrt(( ( n1 - 1 ) * v1 + ( n2 - 1 ) * v2 ) / df * ( 1. / n1 + 1. / n2 ))
+    else:
+      vn1 = v1 / n1; vn2 = v2 / n2
+      df = ( vn1 + vn2 )**2 / ( vn1**2 / ( n1 - 1 ) + vn2**2 / ( n2 - 1 ) )
+      df = np.where(np.isnan(df), 1., df) # same as SciPy
+      denom = np.sqrt(vn1 + vn2)
+    pval = ss.t.sf(np.abs(( m1 - m2 ) / denom), df) * 2
+  return np.where(lvalid, pval, np.NaN)
+
 # Mann-Whitney Rank Test on 2 samples
 def mannwhitneyu(sample1, sample2, ignoreNaN=True, lonesided=False, lstatistic=False, 
-                 use_continuity=True, **kwargs):
+                 use_continuity=True, lvectorize=True, **kwargs):
   ''' Apply the Mann-Whitney Rank Test, to test whether two samples are drawn from the same
       underlying (continuous) distribution; a high p-value means, the two samples are likely
       drawn from the same distribution.
@@ -185,7 +407,9 @@ def mannwhitneyu(sample1, sample2, ignoreNaN=True, lonesided=False, lstatistic=F
   if lstatistic: raise NotImplementedError, "Return of test statistic is not yet implemented; only p-values are returned."
   testfct = functools.partial(mannwhitneyu_wrapper, ignoreNaN=ignoreNaN, 
                               use_continuity=use_continuity)
-  pvar = apply_stat_test_2samp(sample1, sample2, fct=testfct, laax=True, 
+  vecfct = functools.partial(mannwhitneyu_vectorized, ignoreNaN=ignoreNaN, 
+                             use_continuity=use_continuity) if lvectorize else None
+  pvar = apply_stat_test_2samp(sample1, sample2, fct=testfct, vfct=vecfct, laax=True, 
                                lpval=True, lrho=False, **kwargs)
   if not lonesided: # transform to twosided (multiply p-value by 2)
     if isinstance(pvar,Variable): pvar.data_array *= 2.
@@ -213,9 +437,25 @@ def mannwhitneyu_wrapper(data, size1=None, ignoreNaN=True, use_continuity=True,
   D, pval = ss.mannwhitneyu(data1, data2, use_continuity=use_continuity); del D
   return pval  
 
+# vectorized Mann-Whitney Rank Test on 2 samples
+def mannwhitneyu_vectorized(data1, data2, ignoreNaN=True, use_continuity=True):
+  ''' Apply the Mann-Whitney Rank Test (with tie correction) to all pairs of samples along the last axis at 
+      once; returns the one-sided p-value, like the SciPy function. '''
+  n1, n2, lvalid = count_valid_2samp(data1, data2, ignoreNaN=ignoreNaN)
+  ranksum, ties = rank_2samp(data1, data2)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    u1 = n1*n2 + ( n1 * ( n1 + 1 ) ) / 2. - ranksum 
+    u2 = n1*n2 - u1
+    n = n1 + n2
+    T = 1. - ties / ( n**3 - n ) # tie correction
+    sd = np.sqrt(T * n1 * n2 * ( n + 1 ) / 12.)
+    z = ( np.maximum(u1, u2) - ( n1*n2/2. + 0.5*use_continuity ) ) / sd
+    pval = ss.norm.sf(np.abs(z))
+  return np.where(lvalid & ( T > 0 ), pval, np.NaN)
+
 
 # Wilcoxon Ranksum Test on 2 samples
-def ranksums(sample1, sample2, lstatistic=False, ignoreNaN=True, **kwargs):
+def ranksums(sample1, sample2, lstatistic=False, ignoreNaN=True, lvectorize=True, **kwargs):
   ''' Apply the Wilcoxon Ranksum Test, to test whether two samples are drawn from the same
       underlying (continuous) distribution; a high p-value means, the two samples are likely
       drawn from the same distribution. 
@@ -224,7 +464,8 @@ def ranksums(sample1, sample2, lstatistic=False, ignoreNaN=True, **kwargs):
       Mann-Whitney Test and does not handle ties between ranks. '''
   if lstatistic: raise NotImplementedError, "Return of test statistic is not yet implemented; only p-values are returned."
   testfct = functools.partial(ranksums_wrapper, ignoreNaN=ignoreNaN)
-  pvar = apply_stat_test_2samp(sample1, sample2, fct=testfct, laax=True, 
+  vecfct = functools.partial(ranksums_vectorized, ignoreNaN=ignoreNaN) if lvectorize else None
+  pvar = apply_stat_test_2samp(sample1, sample2, fct=testfct, vfct=vecfct, laax=True, 
                                lpval=True, lrho=False, **kwargs)
   return pvar
 wrstest = ranksums # alias
@@ -246,22 +487,38 @@ def ranksums_wrapper(data, size1=None, ignoreNaN=True):
   D, pval = ss.ranksums(data1, data2); del D
   return pval  
 
+# vectorized Wilcoxon Ranksum Test on 2 samples
+def ranksums_vectorized(data1, data2, ignoreNaN=True):
+  ''' Apply the Wilcoxon Ranksum Test to all pairs of samples along the last axis at once (like the SciPy 
+      function, there is no correction for ties). '''
+  n1, n2, lvalid = count_valid_2samp(data1, data2, ignoreNaN=ignoreNaN)
+  ranksum, ties = rank_2samp(data1, data2); del ties
+  with np.errstate(invalid='ignore', divide='ignore'):
+    z = ( ranksum - n1 * ( n1 + n2 + 1 ) / 2. ) / np.sqrt(n1 * n2 * ( n1 + n2 + 1 ) / 12.)
+    pval = 2 * ss.norm.sf(np.abs(z))
+  return np.where(lvalid, pval, np.NaN)
+
 
 ## bivariate statistical functions
 
 # Pearson's Correlation Coefficient between two samples
-def pearsonr(sample1, sample2, lpval=False, lrho=True, ignoreNaN=True, lstandardize=False, 
+def pearsonr(sample1, sample2, lpval=False, lrho=True, ignoreNaN=True, lstandardize=False, lvectorize=True, 
              lsmooth=False, window_len=11, window='hanning', ldetrend=False, dof=None, **kwargs):
   ''' Compute and return the linear correlation coefficient and/or the p-value
       of Pearson's correlation. 
       Pearson's Correlation Coefficient measures the linear relationship between
       the two sample variables (this is the ordinary correlation coefficient);
       the p-values assume that the samples are normally distributed. 
-      Standardization and smoothing is also supported; detrending is not implemented yet. '''
+      Standardization and smoothing is also supported; detrending is not implemented yet. 
+      Without smoothing or detrending, all points are computed at once (one sample can also be a single 
+      reference series); dof can be an array with effective degrees of freedom for each point. '''
   testfct = functools.partial(pearsonr_wrapper, lpval=lpval, lrho=lrho, ignoreNaN=ignoreNaN,
                               lstandardize=lstandardize, ldetrend=ldetrend, dof=dof,
                               lsmooth=lsmooth, window_len=window_len, window=window)
-  rvar = apply_stat_test_2samp(sample1, sample2, fct=testfct, 
+  if lvectorize and not ( lsmooth or ldetrend ): # N.B.: standardization does not affect correlation
+    vecfct = functools.partial(pearsonr_vectorized, lpval=lpval, lrho=lrho, ignoreNaN=ignoreNaN, dof=dof)
+  else: vecfct = None
+  rvar = apply_stat_test_2samp(sample1, sample2, fct=testfct, vfct=vecfct,
                                lpval=lpval, lrho=lrho, laax=True, **kwargs)
   return rvar
 corrcoef = pearsonr
@@ -301,9 +558,16 @@ def pearsonr_wrapper(data, size1=None, lpval=False, lrho=True, ignoreNaN=True, l
   elif lpval: return pval
   else: raise ArgumentError  
 
+# vectorized Pearson's Correlation Coefficient on 2 samples
+def pearsonr_vectorized(data1, data2, lpval=False, lrho=True, ignoreNaN=True, dof=None):
+  ''' Compute the Pearson's Correlation Coefficient for all series along the last axis at once; a single 
+      1D reference series is correlated with all series of the other sample using one matrix operation. '''
+  rho, pval = myss.pearsonr_vectorized(data1, data2, dof=dof, ignoreNaN=ignoreNaN)
+  return select_corr_output(rho, pval, lrho=lrho, lpval=lpval)
+
 
 # Spearman's Rank-order Correlation Coefficient between two samples
-def spearmanr(sample1, sample2, lpval=False, lrho=True, ignoreNaN=True, lstandardize=False, 
+def spearmanr(sample1, sample2, lpval=False, lrho=True, ignoreNaN=True, lstandardize=False, lvectorize=True, 
               lsmooth=False, window_len=11, window='hanning', ldetrend=False, dof=None, **kwargs):
   ''' Compute and return the linear correlation coefficient and/or the p-value
       of Spearman's Rank-order Correlation Coefficient. 
@@ -311,13 +575,17 @@ def spearmanr(sample1, sample2, lpval=False, lrho=True, ignoreNaN=True, lstandar
       relationship between the two samples; it is more robust for non-linear
       and non-normally distributed samples than the ordinary correlation
       coefficient.  
-      Standardization and smoothing is also supported; detrending is not implemented yet. '''
+      Standardization and smoothing is also supported; detrending is not implemented yet. 
+      Without smoothing or detrending, all points are ranked and computed at once. '''
   testfct = functools.partial(spearmanr_wrapper, lpval=lpval, lrho=lrho, ignoreNaN=ignoreNaN,
                               lstandardize=lstandardize, ldetrend=ldetrend, dof=dof,
                               lsmooth=lsmooth, window_len=window_len, window=window)
-  laax = lsmooth or ldetrend # true, if any of these, false otherwise
-  rvar = apply_stat_test_2samp(sample1, sample2, fct=testfct, 
-                               lpval=lpval, lrho=lrho, laax=laax, **kwargs)
+  if lvectorize and not ( lsmooth or ldetrend ): # N.B.: standardization does not affect ranks
+    vecfct = functools.partial(spearmanr_vectorized, lpval=lpval, lrho=lrho, ignoreNaN=ignoreNaN, dof=dof)
+  else: vecfct = None
+  # N.B.: the SciPy function returns a correlation matrix for 2D arrays, so it has to be applied to each point
+  rvar = apply_stat_test_2samp(sample1, sample2, fct=testfct, vfct=vecfct,
+                               lpval=lpval, lrho=lrho, laax=True, **kwargs)
   return rvar
 spearmancc = spearmanr
 
@@ -350,7 +618,7 @@ def spearmanr_wrapper(data, size1=None, axis=None, lpval=False, lrho=True, ignor
     data1 = smooth(data1, window_len=window_len, window=window)
     data2 = smooth(data2, window_len=window_len, window=window)
   if ldetrend:
-    data1 = detrend(data1); data2 = detrend(data2)
+    data1 = detrend(data1, axis=axis); data2 = detrend(data2, axis=axis)
   # apply test
   rho, pval = myss.spearmanr(data1, data2, axis=axis, dof=dof)
   # select output
@@ -360,14 +628,32 @@ def spearmanr_wrapper(data, size1=None, axis=None, lpval=False, lrho=True, ignor
   elif lpval: return pval
   else: raise ArgumentError  
 
+# vectorized Spearman's Rank-order Correlation Coefficient on 2 samples
+def spearmanr_vectorized(data1, data2, lpval=False, lrho=True, ignoreNaN=True, dof=None):
+  ''' Compute the Spearman's Rank-order Correlation Coefficient for all series along the last axis at once, 
+      using batched ranking; NaN's are removed pairwise before ranking. '''
+  rho, pval = myss.spearmanr_vectorized(data1, data2, dof=dof, ignoreNaN=ignoreNaN)
+  return select_corr_output(rho, pval, lrho=lrho, lpval=lpval)
+
+# select output of vectorized correlation functions
+def select_corr_output(rho, pval, lrho=True, lpval=False):
+  ''' return correlation coefficient and/or p-value (stacked along the last axis, like the wrappers) '''
+  if lrho and lpval: return np.stack((rho,pval), axis=-1)
+  elif lrho: return rho
+  elif lpval: return pval
+  else: raise ArgumentError  
+
 
 # generic applicator function for 2 sample statistical tests
-def apply_stat_test_2samp(sample1, sample2, fct=None, axis=None, axis_idx=None, name=None, laax=True, 
+def apply_stat_test_2samp(sample1, sample2, fct=None, vfct=None, axis=None, axis_idx=None, name=None, laax=True, 
                           lflatten=False, fillValue=None, lpval=True, lrho=False, asVar=None,
                           lcheckVar=True, lcheckAxis=True, pvaratts=None, rvaratts=None, **kwargs):
   ''' Apply a bivariate statistical test or function to two sample Variables and return the result 
       as a Variable object; the function will be applied along the specified axis or over flattened arrays. 
-      This function can return both, the p-value and the function result (other than the p-value). '''
+      This function can return both, the p-value and the function result (other than the p-value). 
+      If a vectorized function 'vfct' is given, it is applied to both sample arrays at once (sample axis 
+      last), instead of applying 'fct' to each point. One of the samples can also be a single 1D 
+      reference series, which is compared to all series of the other sample. '''
   # some input checking
   if lflatten and axis is not None: raise ArgumentError
   if not lflatten and axis is None and axis_idx is None: 
@@ -402,6 +688,12 @@ def apply_stat_test_2samp(sample1, sample2, fct=None, axis=None, axis_idx=None,
   elif lflatten: axis_idx1 = axis_idx2 = 0
   else: raise ArgumentError
   del axis_idx # should not be used any longer    
+  # a single reference series can be compared to all series of the other sample
+  lref1 = not lflatten and sample1.ndim == 1 and sample2.ndim > 1
+  lref2 = not lflatten and sample2.ndim == 1 and sample1.ndim > 1
+  if lref1: axis_idx1 = 0
+  if lref2: axis_idx2 = 0
+  fullsample, full_idx = (sample2, axis_idx2) if lref1 else (sample1, axis_idx1) # determines output shape
   # check sample variables
   for sample,lvar in ((sample1,lvar1),(sample2,lvar2)):
     if sample.dtype.kind in ('S',):
@@ -425,11 +717,12 @@ def apply_stat_test_2samp(sample1, sample2, fct=None, axis=None, axis_idx=None,
 #   if sample1.dtype.kind != sample2.dtype.kind: 
 #     raise TypeError, "Samples need to have same dtype kind: {:s} != {:s}".kind(sample1.dtype.kind, sample2.dtype.kind)
   if not lflatten:
-    if sample1.ndim != sample2.ndim: raise AxisError, "Samples need to have same number of dimensions."
-    rshape = sample1.shape[:axis_idx1] + sample1.shape[axis_idx1+1:]
-    if rshape != sample2.shape[:axis_idx2] + sample2.shape[axis_idx2+1:]: 
+    if sample1.ndim != sample2.ndim and not ( lref1 or lref2 ): 
+      raise AxisError, "Samples need to have same number of dimensions."
+    rshape = fullsample.shape[:full_idx] + fullsample.shape[full_idx+1:]
+    if not ( lref1 or lref2 ) and rshape != sample2.shape[:axis_idx2] + sample2.shape[axis_idx2+1:]: 
       raise AxisError, "Samples need to have same shape (except sample axis)."
-    if lvar1 and lvar2:
+    if lvar1 and lvar2 and not ( lref1 or lref2 ):
       axes1 = tuple(ax.name for ax in sample1.axes if ax.name != axis)
       axes2 = tuple(ax.name for ax in sample2.axes if ax.name != axis)
       if axes1 != axes2: raise AxisError, "Axes of samples are inconsistent."
@@ -477,7 +770,7 @@ def apply_stat_test_2samp(sample1, sample2, fct=None, axis=None, axis_idx=None,
     return data
   data1 = preprocess(sample1, axis_idx1)
   data2 = preprocess(sample2, axis_idx2)
-  assert lflatten or data1.shape[:-1] == data2.shape[:-1]
+  assert lflatten or lref1 or lref2 or data1.shape[:-1] == data2.shape[:-1]
   # apply test (serial)
   if lflatten:
     assert data1.ndim == 1 and data2.ndim == 1
@@ -494,30 +787,38 @@ def apply_stat_test_2samp(sample1, sample2, fct=None, axis=None, axis_idx=None,
   # apply test (parallel)
   else: 
     axis_idx = data1.ndim-1; size1 = data1.shape[-1] # shorcuts
-    # merge sample arrays, save dividing index 'size1' (only one argument array per point along axis)
-    data_array = np.concatenate((data1, data2), axis=axis_idx) 
-    # select test and set parameters
-    fct = functools.partial(fct, size1=size1)
-    res = apply_along_axis(fct, axis_idx, data_array, chunksize=500000//len(data_array), laax=laax) # apply test in parallel, distributing the data
+    if vfct is not None:
+      # apply vectorized test to entire arrays
+      res = vfct(data1, data2)
+    else:
+      # expand reference series to all points
+      if lref1: data1 = np.broadcast_to(data1, data2.shape[:-1]+data1.shape[-1:])
+      if lref2: data2 = np.broadcast_to(data2, data1.shape[:-1]+data2.shape[-1:])
+      axis_idx = data1.ndim-1
+      # merge sample arrays, save dividing index 'size1' (only one argument array per point along axis)
+      data_array = np.concatenate((data1, data2), axis=axis_idx) 
+      # select test and set parameters
+      fct = functools.partial(fct, size1=size1)
+      res = apply_along_axis(fct, axis_idx, data_array, chunksize=500000//len(data_array), laax=laax) # apply test in parallel, distributing the data
     # handle masks etc.
-    if (lvar1 and sample1.masked) or (lvar2 and sample1.masked): 
+    if (lvar1 and sample1.masked) or (lvar2 and sample2.masked): 
       res = ma.masked_invalid(res, copy=False) 
       # N.B.: comparisons with NaN always evaluate to False!
       if fillValue is not None:
         res = ma.masked_equal(res, fillValue)
       ma.set_fill_value(res,fillValue)
     if lrho and lpval:
-      assert res.ndim == sample1.ndim
+      assert res.ndim == fullsample.ndim
       assert res.shape == rshape+(2,)
       res = np.rollaxis(res, axis=res.ndim-1, start=0)
       rvar = res[0,:]; pvar = res[1,:]
     else:
-      assert res.ndim == sample1.ndim-1
+      assert res.ndim == fullsample.ndim-1
       assert res.shape == rshape
       if lpval: pvar = res
       elif lrho: rvar = res
     if asVar:
-      axes = sample1.axes[:axis_idx1] + sample1.axes[axis_idx1+1:]
+      axes = fullsample.axes[:full_idx] + fullsample.axes[full_idx+1:]
       if lpval: pvar = Variable(data=pvar, axes=axes, atts=pvaratts, plot=pvarplot)
       if lrho: rvar = Variable(data=rvar, axes=axes, atts=rvaratts, plot=rvarplot)
   # return results
@@ -526,6 +827,152 @@ def apply_stat_test_2samp(sample1, sample2, fct=None, axis=None, axis_idx=None,
   elif lrho: return rvar
   else: ArgumentError
 
+## resampling utilities
+
+# get a random number generator
+def random_state(seed=None):
+  ''' Return a RandomState instance; None uses the global Numpy random state (so that np.random.seed 
+      applies), an integer seeds a new RandomState, and RandomState instances are passed through. '''
+  if seed is None: return np.random.mtrand._rand
+  elif isinstance(seed, np.random.RandomState): return seed
+  else: return np.random.RandomState(seed)
+
+# vectorized version of np.random.choice along the last axis
+def resample_indices(shape, nsamples=None, replace=True, seed=None):
+  ''' Generate random indices for all series along the last dimension of an array with the given shape at 
+      once; returns an integer array of shape shape[:-1]+(nsamples,), which can be used with take_along_last. '''
+  rng = random_state(seed); sz = shape[-1]
+  if nsamples is None: nsamples = sz
+  if replace: 
+    return rng.randint(sz, size=tuple(shape[:-1])+(nsamples,))
+  else: # random permutations (draws without replacement)
+    if nsamples > sz: raise ValueError, "Cannot draw more samples than available without replacement."
+    return np.argsort(rng.random_sample(shape), axis=-1)[...,:nsamples]
+  
+# gather samples along the last axis
+def take_along_last(samples, idx):
+  ''' Select elements along the last axis of 'samples' for each series, using an index array with the same 
+      leading dimensions (like np.take_along_axis); idx can have additional leading dimensions. '''
+  if idx.shape[idx.ndim-samples.ndim:-1] != samples.shape[:-1]: raise AxisError, idx.shape
+  offset = np.arange(0, samples.size, samples.shape[-1]).reshape(samples.shape[:-1]+(1,))
+  return np.ravel(samples).take(idx + offset)
+
+
+## field significance
+# N.B.: these functions operate on p-value fields, like the ones produced by the vectorized statistical tests;
+#       the permutation engine shuffles the sample axis with the same indices at all points, so that the 
+#       spatial correlation of the data is preserved, and evaluates the vectorized test for all points at once
+
+# False Discovery Rate (FDR) adjustment of p-values
+def fdr_adjust(pval, method='bh', name=None):
+  ''' Return FDR-adjusted p-values (q-values) for a field of p-values, using the Benjamini-Hochberg ('bh') 
+      or the Benjamini-Yekutieli ('by') procedure; NaN's and masked values are not counted as tests and 
+      remain invalid. Points with q <= alpha are significant at a False Discovery Rate of alpha. 
+      Accepts p-value Variables (returns a Variable) as well as (masked) arrays. '''
+  lvar = isinstance(pval, Variable)
+  data = pval.getArray(unmask=False, copy=False) if lvar else pval
+  lmasked = isinstance(data, ma.MaskedArray)
+  if lmasked: data = data.astype(np.float64).filled(np.NaN)
+  else: data = np.asarray(data, dtype=np.float64)
+  # sort valid p-values
+  flat = data.ravel(); lvalid = np.invert(np.isnan(flat)) 
+  pv = flat[lvalid]; m = pv.size; order = np.argsort(pv)
+  if method.lower() in ('bh','benjamini-hochberg'): c = 1.
+  elif method.lower() in ('by','benjamini-yekutieli'): c = ( 1. / np.arange(1,m+1) ).sum() # arbitrary dependence
+  else: raise ArgumentError, method
+  # compute q-values: enforce monotonicity, starting from the largest p-value
+  qs = pv[order] * ( c * m / np.arange(1,m+1) )
+  qs = np.minimum(np.minimum.accumulate(qs[::-1])[::-1], 1.)
+  qval = np.zeros_like(flat) + np.NaN; qv = np.empty_like(pv); qv[order] = qs; qval[lvalid] = qv
+  qval = qval.reshape(data.shape)
+  if lmasked: qval = ma.masked_invalid(qval, copy=False)
+  # return a Variable or an array
+  if lvar:
+    atts = pval.atts.copy(); atts['name'] = name or '{:s}_fdr'.format(pval.name)
+    atts['long_name'] = 'FDR-adjusted {:s}'.format(pval.atts.get('long_name','p-value'))
+    qval = pval.copy(data=qval, atts=atts)
+  return qval
+
+# p-value threshold for a given False Discovery Rate
+def fdr_threshold(pval, alpha=0.05, method='bh'):
+  ''' Return the largest p-value that is still significant at a False Discovery Rate of alpha (0, if no 
+      point is significant); p-values below the threshold are significant (see fdr_adjust). '''
+  if isinstance(pval, Variable): pval = pval.getArray(unmask=False, copy=False)
+  if isinstance(pval, ma.MaskedArray): pval = pval.astype(np.float64).filled(np.NaN)
+  pval = np.asarray(pval, dtype=np.float64); qval = fdr_adjust(pval, method=method)
+  with np.errstate(invalid='ignore'): lsig = qval <= alpha
+  return pval[lsig].max() if np.any(lsig) else 0.
+
+# evaluate a chunk of permutations (has to be defined at module level for multiprocessing)
+def permutation_worker(perms, data=None, size1=None, vfct=None, alpha=0.05, axis=1):
+  ''' apply a vectorized two-sample test to the pooled data for each permutation of the sample axis and 
+      return the number of locally significant points and the smallest p-value for each permutation;
+      the pooled data are shared by all chunks (see apply_along_axis) '''
+  res = np.zeros((len(perms),2))
+  for i,perm in enumerate(perms):
+    shuffled = data.take(perm, axis=-1) # the same shuffled indices for all points
+    pval = vfct(shuffled[...,:size1], shuffled[...,size1:])
+    with np.errstate(invalid='ignore'): 
+      res[i,0] = ( pval < alpha ).sum()
+    res[i,1] = np.nanmin(pval) if np.any(np.isfinite(pval)) else np.NaN
+  return res
+
+# permutation-based field significance for vectorized two-sample tests
+def permutation_test_2samp(data1, data2, vfct=None, nperm=1000, alpha=0.05, seed=None, NP=0, chunksize=20):
+  ''' Permutation-based field significance for a vectorized two-sample test (sample axis last): the 
+      pooled samples are shuffled along the sample axis with the same indices at all points, and the test 
+      is re-evaluated for the entire field; permutations are distributed over NP worker processes. 
+      Returns the observed p-values, family-wise adjusted p-values (Westfall-Young minP) and the field 
+      significance (the probability of observing as many locally significant points by chance). '''
+  # a single reference series is expanded to all points
+  if data1.ndim < data2.ndim: data1 = np.broadcast_to(data1, data2.shape[:-1]+data1.shape[-1:])
+  if data2.ndim < data1.ndim: data2 = np.broadcast_to(data2, data1.shape[:-1]+data2.shape[-1:])
+  size1 = data1.shape[-1]
+  # observed test statistic
+  pobs = vfct(data1, data2)
+  with np.errstate(invalid='ignore'): nsig = ( pobs < alpha ).sum()
+  # draw permutations up front, so that results do not depend on the number of processes
+  data = np.concatenate((data1, data2), axis=-1) 
+  perms = resample_indices((nperm,data.shape[-1]), replace=False, seed=seed)
+  # N.B.: the pooled field is copied into shared memory once; workers only receive chunks of permutations
+  fct = functools.partial(permutation_worker, size1=size1, vfct=vfct, alpha=alpha)
+  res = apply_along_axis(fct, 1, perms, NP=NP, chunksize=chunksize, laax=False, shared=dict(data=data))
+  nsig_perm = res[:,0]; pmin = res[:,1]; pmin = np.sort(pmin[np.isfinite(pmin)])
+  # adjusted local p-values and field significance (counting the observed field as one permutation)
+  with np.errstate(invalid='ignore'):
+    padj = ( np.searchsorted(pmin, pobs, side='right') + 1. ) / ( len(pmin) + 1. )
+  padj = np.where(np.isnan(pobs), np.NaN, padj)
+  pfield = ( ( nsig_perm >= nsig ).sum() + 1. ) / ( nperm + 1. )
+  return pobs, padj, pfield
+
+# vectorized two-sample tests that can be used for field significance
+vectorized_2samp_tests = dict(ks=ks_2samp_vectorized, kstest=ks_2samp_vectorized, ttest=ttest_ind_vectorized,
+                              mw=mannwhitneyu_vectorized, mwtest=mannwhitneyu_vectorized, 
+                              wrs=ranksums_vectorized, wrstest=ranksums_vectorized)
+
+# field significance of a two-sample test applied to Variables
+def field_significance(sample1, sample2, test='ttest', nperm=1000, alpha=0.05, seed=None, NP=0, 
+                       chunksize=20, ignoreNaN=True, name=None, **kwargs):
+  ''' Apply a two-sample test to two sample Variables along an axis and assess the field significance 
+      using permutations of the sample axis (see permutation_test_2samp); 'test' can be the name of a 
+      vectorized test or a vectorized function. Returns family-wise adjusted p-values (as a Variable, by 
+      default) and the field significance (the observed p-values are returned by the test itself). '''
+  if isinstance(test, basestring):
+    if test.lower() not in vectorized_2samp_tests: raise ArgumentError, test
+    vfct = functools.partial(vectorized_2samp_tests[test.lower()], ignoreNaN=ignoreNaN)
+  else: vfct = test
+  results = dict() # to retrieve the field significance
+  def fieldfct(data1, data2):
+    pobs, padj, results['pfield'] = permutation_test_2samp(data1, data2, vfct=vfct, nperm=nperm, alpha=alpha, 
+                                                           seed=seed, NP=NP, chunksize=chunksize)
+    return padj
+  pvaratts = dict(long_name='Permutation-adjusted p-value', nperm=nperm)
+  if name: pvaratts['long_name'] = 'Permutation-adjusted p-value ({:s})'.format(name)
+  if kwargs.get('pvaratts',None): pvaratts.update(kwargs.pop('pvaratts'))
+  pvar = apply_stat_test_2samp(sample1, sample2, vfct=fieldfct, lflatten=False, name=name, lpval=True, lrho=False, 
+                               pvaratts=pvaratts, **kwargs)
+  return pvar, results['pfield']
+
 ## distribution variable classes 
 
 # dictionary with distribution definitions for common variables  
@@ -627,14 +1074,21 @@ class DistVar(Variable):
 
   def __init__(self, name=None, units=None, axes=None, samples=None, nsamples=None, params=None, axis=None, 
                dtype=None, lflatten=False, masked=None, mask=None, fillValue=None, atts=None, ldebug=False, 
-               lbootstrap=False, nbs=1000, bootstrap_axis='bootstrap', 
+               lbootstrap=False, nbs=1000, bootstrap_axis='bootstrap', bootstrap_blocksize=None, seed=None,
                lcrossval=False, ncv=0.2, crossval_mode='random', **kwargs):
     '''
       This method creates a new DisVar instance from data and parameters. If data is provided, a sample
       axis has to be specified or the last (innermost) axis is assumed to be the sample axis.
       An estimation/fit will be performed at every grid point and stored in an array.
       Note that 'dtype' and 'units' refer to the sample data, not the distribution.
+      Bootstrap samples are reproducible with a 'seed'; if 'bootstrap_blocksize' is set, bootstrap
+      samples are generated and fitted in blocks, so that the full bootstrap ensemble is never stored.
+      Cross-validation subsets are stored as integer indices; 'crossval_mode' can be 'random' (a random 
+      subset for each point), 'shared' (the same random subset for all points), 'regular' (every ncv-th
+      element) or 'kfold' (ncv random folds, which are fitted in addition to the full sample).
     '''
+    crossval_idx = None; crossval_params = None # cross-validation indices and parameters of k-fold fits
+    crossval_diagnostics = None # fit diagnostics of k-fold fits (MLE only)
     # if parameters are provided
     if params is not None:
       if samples is not None: raise ArgumentError 
@@ -691,65 +1145,79 @@ class DistVar(Variable):
       if nsamples < 2: raise ValueError, nsamples
       if nsamples > sz: raise ValueError, sz  
       ## add bootstrap axis and generate bootstrap samples
+      rng = random_state(seed)
+      lstream = lbootstrap and bool(bootstrap_blocksize)
+      if lstream and lcrossval: raise ArgumentError, "Cross-validation is not supported with blockwise bootstrapping."
       if lbootstrap:
         # create and add bootstrap axis
         bsatts = dict(name=bootstrap_axis,units='',long_name='Bootstrap Samples')
         bsax = Axis(coord=np.arange(nbs), atts=bsatts)
         axes = (bsax,) + axes # add this axis as outer-most
-        shape = (nbs,) + samples.shape
-        # resample the samples (nbs times)
-        bootstrap = np.zeros(shape, dtype=samples.dtype) # allocate memory
-        if lns: # select a random subset (without replacement)
-          bootstrap[0,:] = np.apply_along_axis(np.random.choice, -1, samples, size=nsamples, replace=False)
-        else: bootstrap[0,:] = samples # first element is the real sample data
-        for i in xrange(1,nbs): # take random draws with replacement
-          bootstrap[i,:] = np.apply_along_axis(np.random.choice, -1, samples, size=nsamples, replace=True)
-          #idx = np.random.randint(sz, size=nsamples) # select random indices
-          #bootstrap[i,:] = samples.take(idx, axis=-1) # write random sample into array
-        samples = bootstrap
+        # first element is the real sample data (or a random subset without replacement)
+        if lns: sample0 = take_along_last(samples, resample_indices(samples.shape, nsamples, replace=False, seed=rng))
+        else: sample0 = samples
+        # random draws with replacement for all grid points and bootstrap samples at once
+        population = samples # N.B.: samples is reassigned later
+        draw_bootstrap = lambda nb: take_along_last(population, resample_indices((nb,)+population.shape, nsamples, 
+                                                                                replace=True, seed=rng))
+        if lstream:
+          samples = sample0 # generate and fit blocks below
+          bounds = range(0,nbs,bootstrap_blocksize)+[nbs]
+          if len(bounds) > 2 and bounds[-1]-bounds[-2] == 1: del bounds[-2] # avoid singleton blocks
+        else:
+          samples = np.concatenate((sample0.reshape((1,)+sample0.shape),draw_bootstrap(nbs-1)), axis=0)
         # N.B.: from here one everything should proceed normally, with the extra bootstrap axis in the 
         #       resulting DistVar object; obtain confidence intervalls as percentiles along this axis
-        # N.B.: In order to save memory, this could be inplemented more efficiently within the fit-       
-        #       functions, so that the resampling only occurs immediately before fitting.
-        #       Essentially, there would be two separate estimations, one with the original sample 
-        #       vector, and a given number of estimations with prior resampling; these would then be 
-        #       stacked along the bootstrap axis.
-        # N.B.: Performing resampling and estimation iteratively, one by one, would also save memory, 
-        #       but prevent parallelization of the bootstrap process.
       elif lns: 
         # select a random subset (without replacement)
-        samples = np.apply_along_axis(np.random.choice, -1, samples, size=nsamples, replace=False)
+        samples = take_along_last(samples, resample_indices(samples.shape, nsamples, replace=False, seed=rng))
       sz = samples.shape[-1] # update
-      ## exclude a regular subset/fraction for cross-validation 
+      ## exclude a random or regular subset/fraction for cross-validation 
+      # N.B.: only the indices of the validation subset are stored (shared by all points, if possible)
       if lcrossval:
         idx_dtype = np.int16 if sz < 32767 else (np.int32 if sz < 2147483647 else np.int64) # save some memory
-        #ncv = 3 if lcrossval is True else int(lcrossval)
         if 1 < ncv < 2: raise ValueError, lcrossval
-        if crossval_mode.lower() == 'random': # default: use a random subset
+        crossval_mode = crossval_mode.lower()
+        if crossval_mode in ('random','shared'): # default: use a random subset
           if ncv < 1: nncv = int(np.round((1-ncv)*sz)) # convert fraction to number of elements
           else: nncv = int(sz - np.round(sz/ncv)) # treat as denominator of fraction used for validation
-          idx_rng = np.tile(np.arange(sz, dtype=idx_dtype), samples.shape[:-1]+(1,))
-          idx_rng = np.apply_along_axis(np.random.choice, -1, idx_rng, size=nncv, replace=False)
-          # save cross-validation mask
-          crossval_mask = np.ones(samples.shape, dtype=np.bool8, order='C')
-          apply_over_arrays(np.put, crossval_mask, idx_rng, v=np.bool(0), mode='raise')
-          check_mask = crossval_mask.sum(axis=-1)
-          assert crossval_mask.shape == samples.shape
-          assert check_mask.min() == check_mask.max(), (check_mask.min(),check_mask.max()) 
-          assert check_mask.mean() == sz-nncv, (check_mask.mean(),nncv) 
-        else:
-          # a deterministic subset 
-          if ncv < 1: raise ValueError, lcrossval # denominator of fraction used for validation
-          idx_rng = []
-          for icv in xrange(0,sz,ncv):
-            idx_rng += np.arange(icv,min(icv+ncv-1,sz), order='C', dtype=idx_dtype)
-          idx_rng = np.concatenate(idx_rng)
-        #idx_rng = np.random.randint(saxlen, size=saxlen)[idx_rng] # use a randome sample...
-        subsample = np.zeros_like(idx_rng, dtype=samples.dtype, order='C', subok=True) # allocate subsample
-        apply_over_arrays(np.take, samples, idx_rng, axis=-1, out=subsample, mode='raise')
-        samples = subsample # use subsample instead of full sample
+          perm = resample_indices(samples.shape if crossval_mode == 'random' else (sz,), replace=False, seed=rng)
+          train_idx = np.sort(perm[...,:nncv], axis=-1).astype(idx_dtype)
+          crossval_idx = np.sort(perm[...,nncv:], axis=-1).astype(idx_dtype)
+        elif crossval_mode == 'regular': # a deterministic subset 
+          if ncv < 1 or int(ncv) != ncv: raise ValueError, lcrossval # denominator of fraction used for validation
+          lval = np.zeros(sz, dtype=np.bool); lval[int(ncv)-1::int(ncv)] = True
+          train_idx = np.flatnonzero(~lval).astype(idx_dtype); crossval_idx = np.flatnonzero(lval).astype(idx_dtype)
+        elif crossval_mode == 'kfold': # ncv random folds of equal size (shared by all points)
+          if ncv < 2 or int(ncv) != ncv: raise ValueError, lcrossval # number of folds
+          ncv = int(ncv); nval = sz//ncv # remaining elements are always used for training
+          crossval_idx = resample_indices((sz,), replace=False, seed=rng)[:ncv*nval].reshape((ncv,nval))
+          crossval_idx = np.sort(crossval_idx, axis=-1).astype(idx_dtype)
+          lval = np.zeros((ncv,sz), dtype=np.bool); lval[np.arange(ncv).reshape((ncv,1)),crossval_idx] = True
+          train_idx = np.nonzero(~lval)[1].reshape((ncv,sz-nval)).astype(idx_dtype)
+        else: raise ArgumentError, "Invalid cross-validation mode: '{:s}'".format(crossval_mode)
+        if crossval_mode == 'kfold':
+          # fit all folds at once, with the fold axis in front (the distribution is fitted to the full sample)
+          folds = np.rollaxis(samples.take(train_idx, axis=-1), axis=samples.ndim-1, start=0)
+          crossval_params = self._estimate_distribution(folds, ldebug=ldebug, **kwargs); del folds
+          crossval_diagnostics = getattr(self, 'fit_diagnostics', None) # overwritten by the full fit below
+        elif train_idx.ndim == 1: samples = samples.take(train_idx, axis=-1) # same subset for all points 
+        else: samples = take_along_last(samples, train_idx) # use subsample instead of full sample
       # estimate distribution parameters
-      params = self._estimate_distribution(samples, ldebug=ldebug, **kwargs)
+      if lstream:
+        # N.B.: bootstrap samples are generated in blocks and fitted immediately, in order to save memory
+        params = []; diagnostics = []
+        for i0,i1 in zip(bounds[:-1],bounds[1:]):
+          block = draw_bootstrap(i1-max(i0,1))
+          if i0 == 0: block = np.concatenate((sample0.reshape((1,)+sample0.shape),block), axis=0)
+          params.append(self._estimate_distribution(block, ldebug=ldebug, **kwargs))
+          diagnostics.append(getattr(self, 'fit_diagnostics', None))
+        params = np.concatenate(params, axis=0)
+        if diagnostics[0] is not None: # concatenate diagnostics of all blocks along the bootstrap axis
+          self.fit_diagnostics = {key:np.concatenate([diags[key] for diags in diagnostics], axis=0) 
+                                  for key in diagnostics[0]}
+      else:
+        params = self._estimate_distribution(samples, ldebug=ldebug, **kwargs)
       # N.B.: the method estimate() should be implemented by specific child classes      
       # N.B.: 'ic' are initial guesses for parameter values; 'kwargs' are for the estimator algorithm 
     # sample fillValue
@@ -773,7 +1241,10 @@ class DistVar(Variable):
     assert self.masked == masked
     self.dtype = dtype # property is overloaded in DistVar
     self.crossval = ncv if lcrossval and samples is not None else 0
-    self.crossval_mask = crossval_mask if lcrossval and crossval_mode.lower() == 'random' else None
+    self.crossval_mode = crossval_mode.lower() if self.crossval else None
+    self.crossval_idx = crossval_idx # validation indices (or None)
+    self.crossval_params = crossval_params # parameters for each fold (only k-fold)
+    self.crossval_diagnostics = crossval_diagnostics # fit diagnostics for each fold (only k-fold)
     # N.B.: in this variable dtype and units refer to the sample data, not the distribution!
     if params.ndim > 0 and self.hasAxis(params_name):
       self.paramAxis = self.getAxis(params_name) 
@@ -1109,14 +1580,122 @@ def kde_cdf(kde, support=None, n=0, fillValue=np.NaN):
       res = np.asarray([fct(s) for s in support])
     return res
   
+# binned Gaussian KDE for many samples at once
+def kde_binned_estimate(samples, ngrid=256, bw_method=None, cut=4.):
+  ''' Estimate Gaussian KDEs for all samples along the last axis at once: each sample is binned onto a regular
+      grid with ngrid points (linear binning), which extends 'cut' bandwidths beyond the sample range, and is 
+      convolved with the kernel via FFT; the bandwidth follows the rules of scipy.stats.gaussian_kde.
+      Returns the grid origin and spacing, followed by the density on the grid (along the last axis). '''
+  x = np.asarray(samples, dtype=np.float64)
+  shape = x.shape[:-1]; x = x.reshape((-1,x.shape[-1])); ns = len(x)
+  valid = np.isfinite(x); n = valid.sum(axis=1).astype(np.float64)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    # bandwidth: same as gaussian_kde (factor times the standard deviation, with ddof=1)
+    if bw_method is None or bw_method == 'scott': factor = n**(-1./5.)
+    elif bw_method == 'silverman': factor = (n*3./4.)**(-1./5.)
+    elif np.isscalar(bw_method) and not isinstance(bw_method,basestring): factor = float(bw_method)
+    else: raise ArgumentError, "Binned KDE only supports 'scott', 'silverman' or a scalar bandwidth factor."
+    mean = np.where(valid, x, 0.).sum(axis=1) / n
+    bw = factor * np.sqrt(np.where(valid, (x-mean[:,np.newaxis])**2, 0.).sum(axis=1) / (n-1))
+    lok = ( n > 1 ) & ( bw > 0 ) # N.B.: gaussian_kde also fails for constant samples
+    # grid for each sample
+    lo = np.fmin.reduce(x, axis=1) - cut*bw 
+    dx = ( np.fmax.reduce(x, axis=1) + cut*bw - lo ) / (ngrid-1)
+    lo[~lok] = 0.; dx[~lok] = 1. # dummy values
+    # linear binning (with zero padding to avoid wrap-around)
+    nfft = 2**int(np.ceil(np.log2(2*ngrid)))
+    t = np.where(valid & lok[:,np.newaxis], ( x - lo[:,np.newaxis] ) / dx[:,np.newaxis], -1.)
+  lbin = t >= 0; t = t[lbin]
+  i = np.minimum(np.floor(t).astype(np.intp), ngrid-2); w = t - i
+  i += ( np.arange(ns, dtype=np.intp)*nfft ).reshape((ns,1)).repeat(x.shape[1], axis=1)[lbin]
+  counts = np.bincount(i, weights=1-w, minlength=ns*nfft) + np.bincount(i+1, weights=w, minlength=ns*nfft)
+  counts = counts.reshape((ns,nfft))
+  # Gaussian kernel on the (circular) grid of each sample
+  j = np.arange(nfft); j = np.minimum(j, nfft-j)
+  kernel = np.exp(-0.5*( j * ( dx / np.where(lok, bw, 1.) )[:,np.newaxis] )**2)
+  kernel /= kernel.sum(axis=1, keepdims=True)
+  # convolve and normalize
+  density = np.fft.irfft(np.fft.rfft(counts, axis=1)*np.fft.rfft(kernel, axis=1), n=nfft, axis=1)[:,:ngrid]
+  with np.errstate(invalid='ignore', divide='ignore'):
+    density = np.maximum(density, 0.) / ( n * dx )[:,np.newaxis] 
+  params = np.concatenate((lo[:,np.newaxis], dx[:,np.newaxis], density), axis=1)
+  params[~lok,:] = np.NaN
+  return params.reshape(shape+(ngrid+2,))
+
+# interpolate binned KDE (or CDF) values at given positions on the grid
+def kde_binned_interp(values, t):
+  ''' linear interpolation of values at (fractional) grid positions t along the last axis; also returns a 
+      boolean array indicating positions inside the grid '''
+  ngrid = values.shape[-1]
+  with np.errstate(invalid='ignore'): 
+    linside = ( t >= 0 ) & ( t <= ngrid-1 )
+  t = np.where(linside, t, 0.)
+  i = np.minimum(np.floor(t).astype(np.intp), ngrid-2); w = t - i
+  return take_along_last(values, i)*(1-w) + take_along_last(values, i+1)*w, linside
+
+# binned KDE CDF on the grid
+def kde_binned_gridcdf(params):
+  ''' integrate binned densities on the grid (trapezoidal rule) and normalize '''
+  density = params[...,2:]
+  cdf = np.zeros_like(density)
+  np.cumsum(( density[...,1:] + density[...,:-1] ) / 2., axis=-1, out=cdf[...,1:])
+  with np.errstate(invalid='ignore', divide='ignore'): 
+    cdf /= cdf[...,-1:] # N.B.: the total mass is one, except for rounding errors
+  return cdf
+
+# evaluate binned KDE PDF over a given support
+def kde_binned_eval(params, support=None, fillValue=np.NaN):
+  ''' evaluate binned KDEs (see kde_binned_estimate) over a support by linear interpolation '''
+  lo = params[...,:1]; dx = params[...,1:2]
+  pdf, linside = kde_binned_interp(params[...,2:], ( support - lo ) / dx)
+  return np.where(np.isnan(lo), fillValue, np.where(linside, pdf, 0.))
+
+# evaluate binned KDE CDF over a given support
+def kde_binned_cdf(params, support=None, fillValue=np.NaN):
+  ''' evaluate the CDF of binned KDEs (see kde_binned_estimate) over a support by linear interpolation '''
+  lo = params[...,:1]; dx = params[...,1:2]; t = ( support - lo ) / dx
+  cdf, linside = kde_binned_interp(kde_binned_gridcdf(params), t)
+  with np.errstate(invalid='ignore'): cdf = np.where(linside, cdf, np.where(t > 0, 1., 0.))
+  return np.where(np.isnan(lo), fillValue, cdf)
+
+# draw samples from binned KDEs
+def kde_binned_resample(params, n=0, fillValue=np.NaN, seed=None):
+  ''' draw n samples from binned KDEs by inverse transform sampling with the (piecewise linear) CDF '''
+  shape = params.shape[:-1]; lo = params[...,0].ravel(); dx = params[...,1].ravel()
+  cdf = kde_binned_gridcdf(params).reshape((-1,params.shape[-1]-2)); ns, ngrid = cdf.shape
+  u = random_state(seed).random_sample((ns,n))
+  # find grid intervals for all samples at once (rows are offset, so that they don't overlap)
+  offset = 2.*np.arange(ns).reshape((ns,1))
+  # N.B.: masked rows (all NaN) have to be monotonic as well, otherwise the search fails for other rows
+  i = np.searchsorted(( np.where(np.isnan(cdf), 0., cdf) + offset ).ravel(), ( u + offset ).ravel(), side='right') 
+  i = np.clip(i.reshape((ns,n)) - 1 - np.arange(ns).reshape((ns,1))*ngrid, 0, ngrid-2)
+  c0 = take_along_last(cdf, i); c1 = take_along_last(cdf, i+1)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    w = np.where(c1 > c0, ( u - c0 ) / ( c1 - c0 ), 0.5)
+    res = lo[:,np.newaxis] + ( i + w ) * dx[:,np.newaxis] 
+  res[np.isnan(lo),:] = fillValue
+  return res.reshape(shape+(n,))
+  
 # Subclass of DistVar implementing Kernel Density Estimation
 class VarKDE(DistVar):
-  ''' A subclass of DistVar implementing Kernel Density Estimation (scipy.stats.kde) ''' 
+  ''' A subclass of DistVar implementing Kernel Density Estimation (scipy.stats.kde); with lbinned=True, 
+      densities are estimated for all grid points at once on a regular grid and stored as parameters ''' 
   dist_type = 'kde'
   
+  @property
+  def lbinned(self):
+    ''' A flag indicating if densities are stored on a grid (binned KDE), instead of KDE objects. '''
+    return self.paramAxis is not None
+  
+  def _binned_params(self):
+    ''' return parameters of binned KDEs with NaN's for masked values '''
+    return ma.filled(self.data_array, np.NaN) if isinstance(self.data_array,ma.MaskedArray) else self.data_array
+  
   # distribution-specific method; should be overloaded by subclass
-  def _estimate_distribution(self, samples, ic_shape=None, ic_args=None, ic_loc=None, ic_scale=None, ldebug=False, **kwargs):
+  def _estimate_distribution(self, samples, ic_shape=None, ic_args=None, ic_loc=None, ic_scale=None, ldebug=False, 
+                             lbinned=False, ngrid=256, **kwargs):
     ''' esimtate/fit distribution from sample array for each grid point and return parameters as ndarray  '''
+    if lbinned: return kde_binned_estimate(samples, ngrid=ngrid, **kwargs)
     fct = functools.partial(kde_estimate, ldebug=ldebug, **kwargs)
     kernels = apply_along_axis(fct, samples.ndim-1, samples, chunksize=100//len(samples)).squeeze()
     assert samples.shape[:-1] == kernels.shape
@@ -1127,6 +1706,7 @@ class VarKDE(DistVar):
   def _density_distribution(self, support):
     ''' compute PDF at given support points for each grid point and return as ndarray '''
     n = len(support); fillValue = self.fillValue or np.NaN
+    if self.lbinned: return kde_binned_eval(self._binned_params(), support=support, fillValue=fillValue)
     data = self.data_array.reshape(self.data_array.shape+(1,)) # expand
     fct = functools.partial(kde_eval, support=support, n=n, fillValue=fillValue)
     pdf = apply_along_axis(fct, self.ndim, data, chunksize=100//n)
@@ -1138,6 +1718,10 @@ class VarKDE(DistVar):
     ''' draw n samples from the distribution for each grid point and return as ndarray '''
     n = len(support) # in order to use _get_dist(), we have to pass a dummy support
     fillValue = self.fillValue or np.NaN # for masked values
+    if self.lbinned: 
+      samples = kde_binned_resample(self._binned_params(), n=n, fillValue=fillValue).astype(self.dtype)
+      assert samples.shape == self.shape[:-1] + (n,)
+      return samples
     data = self.data_array.reshape(self.data_array.shape+(1,)) # expand
     fct = functools.partial(kde_resample, support=support, n=n, fillValue=fillValue, dtype=self.dtype)
     samples = apply_along_axis(fct, self.ndim, data, chunksize=100//n)
@@ -1149,6 +1733,7 @@ class VarKDE(DistVar):
   def _cumulative_distribution(self, support):
     ''' integrate PDF over given support to produce a CDF and return as ndarray '''
     n = len(support); fillValue = self.fillValue or np.NaN
+    if self.lbinned: return kde_binned_cdf(self._binned_params(), support=support, fillValue=fillValue)
     data = self.data_array.reshape(self.data_array.shape+(1,))
     fct = functools.partial(kde_cdf, support=support, n=n, fillValue=fillValue)
     cdf = apply_along_axis(fct, self.ndim, data, chunksize=100//n)
@@ -1160,15 +1745,133 @@ class VarKDE(DistVar):
 # N.B.: need to define helper functions outside of class definition, otherwise pickle / multiprocessing 
 #       will fail... need to fix arguments with functools.partial
 
+# distributions that support vectorized estimation with L-moments and the method of moments
+lmom_dists = ('norm','gumbel_r','gumbel_l','logistic','expon','gamma','genextreme','genpareto','weibull_min')
+mom_dists = ('norm','gumbel_r','gumbel_l','logistic','expon','gamma')
+
+# sample L-moments for many samples at once
+def sample_lmoments(samples, nmom=3):
+  ''' Compute sample L-moments along the last axis of an array from unbiased probability-weighted moments; 
+      returns a list with l1, l2 and the L-moment ratios t3 and t4 (up to nmom); NaN's are ignored. '''
+  if not 1 <= nmom <= 4: raise ArgumentError, nmom
+  x = np.sort(samples, axis=-1) # N.B.: NaN's are sorted to the end
+  valid = np.isfinite(x)
+  n = valid.sum(axis=-1).astype(np.float64); nn = n.reshape(n.shape+(1,))
+  x = np.where(valid, x, 0.)
+  i = np.arange(x.shape[-1], dtype=np.float64) # rank (starting from 0)
+  b = []; w = 1.
+  with np.errstate(divide='ignore', invalid='ignore'):
+    for r in xrange(nmom):
+      if r > 0: w = w * (i-r+1) / (nn-r) # N.B.: weights are zero for i < r
+      b.append((w*x).sum(axis=-1)/n)
+    lmom = [b[0]]
+    if nmom > 1: lmom.append(2*b[1] - b[0])
+    if nmom > 2: lmom.append((6*b[2] - 6*b[1] + b[0]) / lmom[1])
+    if nmom > 3: lmom.append((20*b[3] - 30*b[2] + 12*b[1] - b[0]) / lmom[1])
+  return lmom
+
+# vectorized parameter estimation with L-moments or the method of moments
+def rv_estimate(samples, dist_type=None, method='lmom'):
+  ''' Estimate parameters of a distribution for all samples along the last axis at once, using L-moments 
+      ('lmom', after Hosking, 1990) or the method of moments ('mom'); returns parameters in SciPy order 
+      (shape, loc, scale) along the last axis; samples with too few valid values return NaN. '''
+  from scipy.special import gammaln
+  plen = getattr(ss,dist_type).numargs + 2
+  method = method.lower()
+  if method == 'lmom':
+    if dist_type not in lmom_dists: raise NotImplementedError, "L-moments are not implemented for '{:s}'.".format(dist_type)
+    lmom = sample_lmoments(samples, nmom=min(plen,3))
+    l1, l2 = lmom[:2]; t3 = lmom[2] if plen > 2 else None
+  elif method == 'mom':
+    if dist_type not in mom_dists: raise NotImplementedError, "Method of moments is not implemented for '{:s}'.".format(dist_type)
+    with np.errstate(invalid='ignore'):
+      mean = np.nanmean(samples, axis=-1); std = np.nanstd(samples, axis=-1)
+      if plen > 2: # skewness (biased estimate, as in scipy.stats.skew)
+        skew = np.nanmean((samples - mean[...,np.newaxis])**3, axis=-1) / std**3
+  else: raise ArgumentError, method
+  with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+    ## two parameter distributions
+    if dist_type == 'norm':
+      if method == 'lmom': params = (l1, l2*np.sqrt(np.pi))
+      else: params = (mean, std)
+    elif dist_type in ('gumbel_r','gumbel_l'):
+      scale = l2/np.log(2) if method == 'lmom' else std*np.sqrt(6)/np.pi
+      loc = l1 if method == 'lmom' else mean
+      if dist_type == 'gumbel_r': params = (loc - np.euler_gamma*scale, scale)
+      else: params = (loc + np.euler_gamma*scale, scale)
+    elif dist_type == 'logistic':
+      if method == 'lmom': params = (l1, l2)
+      else: params = (mean, std*np.sqrt(3)/np.pi)
+    elif dist_type == 'expon':
+      scale = 2*l2 if method == 'lmom' else std
+      params = ((l1 if method == 'lmom' else mean) - scale, scale)
+    ## three parameter distributions
+    elif dist_type == 'gamma': # Pearson type III with positive skewness
+      if method == 'lmom': 
+        t3 = np.abs(t3) # only positive skewness is supported
+        z = np.where(t3 < 1./3., 3*np.pi*t3**2, 1-t3) # rational approximation (Hosking, 1990)
+        a = np.where(t3 < 1./3., (1+0.2906*z)/(z+0.1882*z**2+0.0442*z**3), 
+                     (0.36067*z-0.59567*z**2+0.25361*z**3)/(1-2.78861*z+2.56096*z**2-0.77045*z**3))
+        scale = l2*np.sqrt(np.pi)*np.exp(gammaln(a)-gammaln(a+0.5))
+        loc = l1 - a*scale
+      else:
+        skew = np.abs(skew)
+        a = 4/skew**2; scale = std*skew/2; loc = mean - a*scale
+      params = (a, loc, scale)
+    elif dist_type in ('genextreme','weibull_min'):
+      if dist_type == 'weibull_min': l1 = -l1; t3 = -t3 # reversed GEV
+      z = 2/(3+t3) - np.log(2)/np.log(3) 
+      k = 7.8590*z + 2.9554*z**2 # approximation (Hosking et al., 1985); same sign convention as SciPy
+      lgumbel = np.abs(k) < 1e-6
+      k = np.where(lgumbel, 1., k) # avoid division by zero; replaced by Gumbel limit below
+      scale = np.where(lgumbel, l2/np.log(2), l2*k/((1-2**-k)*np.exp(gammaln(1+k))))
+      loc = np.where(lgumbel, l1 - np.euler_gamma*scale, l1 - scale*(1-np.exp(gammaln(1+k)))/k)
+      k = np.where(lgumbel, 0., k)
+      if dist_type == 'genextreme': params = (k, loc, scale)
+      else: 
+        k = np.where(k > 0, k, np.NaN) # only defined for an upper bound of the reversed GEV 
+        params = (1/k, -loc-scale/k, scale/k)
+    elif dist_type == 'genpareto':
+      k = (1-3*t3)/(1+t3) # Hosking's shape parameter has the opposite sign
+      params = (-k, l1-(2+k)*l2, (1+k)*(2+k)*l2)
+    else: raise NotImplementedError, dist_type
+  params = np.concatenate([np.asarray(p, dtype=np.float64)[...,np.newaxis] for p in params], axis=-1)
+  # invalidate samples with too few values or without variance
+  linvalid = ( np.isfinite(samples).sum(axis=-1) < plen ) | ~( params[...,-1] > 0 ) 
+  params = np.where(np.asarray(linvalid)[...,np.newaxis], np.NaN, params)
+  return params
+
 # persistent variables with most recent successful fit parameters
 global_loc   = None # location parameter ("mean")
 global_scale = None # scale parameter ("standard deviation")
 global_shape = None # single shape parameter
 global_args  = None # multiple shape parameters
 # N.B.: globals are only visible within the process, so this works nicely with multiprocessing
+# convergence diagnostics of the most recent fit (nnlf, converged, number of function evaluations)
+fit_status = None
+
+# optimizer for rv_continuous.fit that records convergence diagnostics
+def fit_optimizer(func, x0, args=(), disp=0):
+  ''' the default optimizer of rv_continuous.fit (optimize.fmin), which also saves diagnostics in fit_status '''
+  global fit_status
+  xopt, fopt, niter, nfev, warnflag = optimize.fmin(func, x0, args=args, disp=disp, full_output=True)
+  fit_status = (fopt, float(warnflag == 0), nfev)
+  return xopt
+
 # estimate RV from sample vector
-def rv_fit(sample, dist_type=None, ic_shape=None, ic_args=None, ic_loc=None, ic_scale=None, plen=None, 
-           lpersist=False, ldebug=False, lpositiveShape=False, lnegativeShape=False, **kwargs):
+def rv_fit(sample, dist_type=None, ic_shape=None, ic_args=None, ic_loc=None, ic_scale=None, plen=None, nic=0,
+           lpersist=False, ldiagnostics=False, ldebug=False, lpositiveShape=False, lnegativeShape=False, **kwargs):
+  global fit_status
+  fit_status = None
+  if ldiagnostics and 'optimizer' not in kwargs: kwargs['optimizer'] = fit_optimizer 
+  lic = False
+  if nic: # initial guesses are stored in front of the sample (see VarRV._estimate_distribution)
+    ic = sample[:nic]; sample = sample[nic:]
+    if np.all(np.isfinite(ic)):
+      lic = True # N.B.: initial guesses for each sample take precedence over persistent parameters
+      if nic > 3: ic_args = tuple(ic[:-2])
+      elif nic == 3: ic_shape = ic[0]
+      ic_loc = ic[-2]; ic_scale = ic[-1]
   nonans = np.invert(np.isnan(sample)) # test for NaN's
   if np.sum(nonans) < plen: 
     res = (np.NaN,)*plen # require at least plen non-NaN points 
@@ -1187,8 +1890,8 @@ def rv_fit(sample, dist_type=None, ic_shape=None, ic_args=None, ic_loc=None, ic_
         print('masked'); res = (np.NaN,)*plen
     # begin actual computation
     try:
-      if lpersist:
-        global global_loc, global_scale, global_shape, global_args # load globals
+      if lpersist: global global_loc, global_scale, global_shape, global_args # load globals
+      if lpersist and not lic:
         if global_loc is not None:   ic_loc   = global_loc
         if global_scale is not None: ic_scale = global_scale
       # estimate location and scale, if not specified
@@ -1202,7 +1905,7 @@ def rv_fit(sample, dist_type=None, ic_shape=None, ic_args=None, ic_loc=None, ic_
         res = getattr(ss,dist_type).fit(sample, loc=ic_loc, scale=ic_scale, **kwargs)
         if lpersist: global_loc = res[0]; global_scale = res[1] # update first guess
       elif plen == 3: # additional shape parameter (e.g. Generalized Extreme Value and Pareto distributions)
-        if lpersist and global_shape is not None: ic_shape = global_shape
+        if lpersist and not lic and global_shape is not None: ic_shape = global_shape
         res = getattr(ss,dist_type).fit(sample, ic_shape, loc=ic_loc, scale=ic_scale, **kwargs)
         if lpositiveShape and res[0] < 0 and not 'f0' in kwargs:
           # if fit fails/is unrealistic, fix shape parameter at zero
@@ -1212,7 +1915,7 @@ def rv_fit(sample, dist_type=None, ic_shape=None, ic_args=None, ic_loc=None, ic_
           res = getattr(ss,dist_type).fit(sample, 0, loc=ic_loc, scale=ic_scale, f0=0, **kwargs)
         if lpersist: global_shape = res[0]; global_loc = res[1]; global_scale = res[2] # update first guess
       elif plen > 3: # everything with more than one shape parameter...
-        if lpersist and global_args is not None:  ic_args  = global_args
+        if lpersist and not lic and global_args is not None:  ic_args  = global_args
         if ic_loc is not None or ic_scale is not None:
           newargs = kwargs.copy(); newargs['ic_loc'] = ic_loc; newargs['ic_scale'] = ic_scale 
         else: newargs = kwargs   
@@ -1222,8 +1925,40 @@ def rv_fit(sample, dist_type=None, ic_shape=None, ic_args=None, ic_loc=None, ic_
     except LinAlgError:
       if ldebug: print('linalgerr')
       res = (np.NaN,)*plen
+  if ldiagnostics: # append diagnostics of the (last) fit
+    if not np.all(np.isfinite(res)): fit_status = (np.NaN,)*3
+    elif fit_status is None: # closed-form estimate (no optimizer was used)
+      fit_status = (getattr(ss,dist_type).nnlf(res, sample), 1., 0.)
+    res = tuple(res) + tuple(fit_status)
   return res # already is a tuple
 
+# cache of fitted parameters (and diagnostics), keyed by a hash of each sample and the fitting options
+rv_fit_cache = dict()
+rv_fit_cache_size = 1000000 # the cache is cleared, when it grows larger than this
+# N.B.: the cache also stores the most recent parameters for each grid, which can be used as initial guesses
+
+def clear_fit_cache():
+  ''' remove all entries from the cache of fitted parameters '''
+  rv_fit_cache.clear()
+
+# hash keys for the fit cache
+def rv_fit_keys(samples, dist_type=None, **kwargs):
+  ''' compute a hash key for each sample along the last axis, which also depends on the distribution type 
+      and fitting options; returns a flat list of keys '''
+  opts = repr((dist_type, sorted(kwargs.items())))
+  flat = np.ascontiguousarray(samples, dtype=np.float64).reshape((-1,samples.shape[-1]))
+  return [hashlib.sha1(opts + row.tostring()).hexdigest() for row in flat]
+
+# initial guesses from a coarse-fit pass
+def rv_coarse_guesses(data, fct, coarsen=4, lshared=False):
+  ''' fit every coarsen-th point along each (non-sample) axis and use the fitted parameters as initial guesses 
+      for the neighbouring points (the nearest coarse point) '''
+  shape = data.shape[:-1]
+  coarse = data[tuple(slice(None,None,coarsen) for n in shape)]
+  guesses = apply_along_axis(fct, coarse.ndim-1, coarse, chunksize=max(1,100//coarse.shape[-1]), lshared=lshared)
+  for i,n in enumerate(shape): guesses = guesses.take(np.arange(n)//coarsen, axis=i) # expand to full grid
+  return guesses
+
 # evaluate a RV distribution type over a given support with given parameters
 def rv_eval(params, dist_type=None, fct_type=None, support=None, n=None, fillValue=np.NaN):
   if np.any(np.isnan(params)): res = np.zeros(len(support))+fillValue 
@@ -1251,6 +1986,41 @@ def rv_resample(params, dist_type=None, n=None, fillValue=np.NaN, dtype=np.float
   else: res = np.asarray(getattr(ss,dist_type).rvs(*params[:-2], loc=params[-2], scale=params[-1], size=n), dtype=dtype)
   return res
 
+# RV methods that do not broadcast over parameter arrays (these have to be applied to each point)
+rv_pointwise_fcts = ('moment', 'expect', 'nnlf', 'fit')
+
+# evaluate a RV distribution method for all points at once
+def rv_broadcast(params, dist_type=None, fct_type=None, support=None, moments=None, n=None, fillValue=np.NaN, 
+                 dtype=np.float):
+  ''' apply a method of a RV distribution type to all parameter sets (along the last axis) in a single call, 
+      using broadcasting; results for support points, moments or random draws ('rvs' with n samples) are 
+      stored along the last axis, and points with NaN parameters are set to fillValue '''
+  shape = params.shape[:-1]
+  params = params.reshape((-1,params.shape[-1]))
+  lvalid = np.invert(np.any(np.isnan(params), axis=-1))
+  pv = params[lvalid] # only evaluate valid points
+  args = [pv[:,i:i+1] for i in xrange(pv.shape[-1]-2)]; loc = pv[:,-2:-1]; scale = pv[:,-1:] # column vectors
+  dist = getattr(ss,dist_type)
+  if fct_type == 'rvs': nout = n
+  elif support is not None: nout = len(support)
+  elif moments is not None: nout = len(moments)
+  else: nout = 1
+  res = np.asarray(np.zeros((len(params),nout))+fillValue, dtype=dtype) # same as rv_resample
+  if len(pv) > 0:
+    if fct_type == 'rvs':
+      pres = dist.rvs(*args, loc=loc, scale=scale, size=(len(pv),n))
+    elif support is not None:
+      pres = getattr(dist, fct_type)(support, *args, loc=loc, scale=scale)
+    else: # N.B.: some scalar methods (e.g. entropy) only work with flat parameter arrays
+      args = [arg.ravel() for arg in args]; loc = loc.ravel(); scale = scale.ravel()
+      if moments is not None: # stats returns a tuple of moments (unless there is only one)
+        pres = getattr(dist, fct_type)(*args, loc=loc, scale=scale, moments=moments)
+        pres = np.stack(pres if len(moments) > 1 else (pres,), axis=-1)
+      else:
+        pres = getattr(dist, fct_type)(*args, loc=loc, scale=scale).reshape((len(pv),1))
+    res[lvalid] = np.broadcast_to(pres, (len(pv),nout)) # also checks the shape
+  return res.reshape(shape+(nout,))
+
 # perform a goodness of fit test
 # N.B.: due to many levels of wrapping and pre-processing, this is not particularly fast...
 def rv_stats_test(data_array, nparams=0, dist_type=None, stats_test=None, ignoreNaN=True, N=20, 
@@ -1271,6 +2041,23 @@ def rv_stats_test(data_array, nparams=0, dist_type=None, stats_test=None, ignore
     else: raise ArgumentError, stats_test
   return pval
 
+# perform a goodness of fit test for all points at once
+def rv_stats_test_vectorized(params, samples, dist_type=None, stats_test=None, ignoreNaN=True, 
+                             alternative='two-sided', mode='approx'):
+  ''' vectorized version of rv_stats_test: parameters and samples are separate arrays (with the parameter 
+      and sample axis last); NaN parameters result in NaN p-values '''
+  if stats_test is None:
+    stats_test = 'sw' if dist_type == 'norm' else 'ks'
+  else: stats_test = stats_test.lower()
+  if stats_test in ('ks','kstest'): 
+    pval = kstest_vectorized(samples, dist=dist_type, args=params, ignoreNaN=ignoreNaN, alternative=alternative, mode=mode)
+  elif stats_test in ('normtest','normaltest'): 
+    pval = normaltest_vectorized(samples, ignoreNaN=ignoreNaN)
+  elif stats_test in ('sw','shapiro','shapirowilk'): 
+    pval = shapiro_vectorized(samples, ignoreNaN=ignoreNaN)
+  else: raise ArgumentError, stats_test
+  return np.where(np.any(np.isnan(params), axis=-1), np.NaN, pval)
+
 # Subclass of DistVar implementing various random variable distributions
 class VarRV(DistVar):
   ''' A subclass of DistVar implementing Random Variable distributions (scipy.stats.rv_continuous) '''
@@ -1304,8 +2091,9 @@ class VarRV(DistVar):
                          #N=2000, alternative='two-sided', mode='approx',
                          asVar=False, lcheckVar=True, lcheckAxis=True).mean()
       #pval = pval if isinstance(pval,(str,basestring)) else "{:3.2f}".format(pval)
-      pval = "{:3.2f}".format(float(pval.mean()))
-      if self.crossval > 1: crossval = "1/{:d}".format(self.crossval)
+      pval = "{:3.2f}".format(float(pval))
+      if self.crossval_mode == 'kfold': crossval = "{:d}-fold".format(self.crossval)
+      elif self.crossval > 1: crossval = "1/{:d}".format(self.crossval)
       else: crossval = "{:2.0f}%".format(100*self.crossval)
       print("{:s} Cross-validation: {:s} (K-S test, {:s})".format(self.name, pval, crossval)) 
   
@@ -1322,31 +2110,98 @@ class VarRV(DistVar):
     return attr
   
   # distribution-specific method; should be overloaded by subclass
-  def _estimate_distribution(self, samples, ic_shape=None, ic_args=None, ic_loc=None, ic_scale=None, lpersist=False, ldebug=False, **kwargs):
-    ''' esimtate/fit distribution from sample array for each grid point and return parameters as ndarray  '''
+  def _estimate_distribution(self, samples, ic_shape=None, ic_args=None, ic_loc=None, ic_scale=None, lpersist=False, 
+                             ldebug=False, estimator='mle', ic_estimator='lmom', warmstart=None, coarsen=4, 
+                             lcache=False, lshared=True, **kwargs):
+    ''' esimtate/fit distribution from sample array for each grid point and return parameters as ndarray; 
+        the 'estimator' can be 'mle' (maximum likelihood), 'lmom' (L-moments) or 'mom' (method of moments),
+        and L-moment or moment estimates are used as initial guesses for the MLE (unless ic_estimator=None);
+        MLE initial guesses can also be warm-started from a coarse-fit pass (warmstart='coarse', fitting every 
+        coarsen-th point) or from the most recent cached fit of the same grid (warmstart='cache'); fitted 
+        parameters of identical samples and fitting options are reused from a cache (lcache=True, but not
+        for warm starts), and convergence diagnostics are stored in the fit_diagnostics attribute (of the 
+        most recent call; blockwise bootstrap fits are concatenated by the caller) '''
+    global global_loc, global_scale, global_shape, global_args
+    estimator = estimator.lower()
+    if estimator in ('lmom','mom'): # vectorized estimators
+      return rv_estimate(samples, dist_type=self.dist_type, method=estimator)
+    elif estimator != 'mle': raise ArgumentError, estimator
+    plen = self.dist_class.numargs + 2 # infer number of parameters
+    shape = samples.shape[:-1]; size = int(np.prod(shape))
+    fitopts = dict(ic_shape=ic_shape, ic_args=ic_args, ic_loc=ic_loc, ic_scale=ic_scale, lpersist=lpersist, **kwargs)
+    gridkey = ('grid', self.dist_type, shape, repr(sorted(fitopts.items())))
+    # look up parameters of identical samples (parameters and diagnostics)
+    res = np.zeros((size,plen+3)) + np.NaN; lfit = np.ones(size, dtype=np.bool)
+    if lcache:
+      # N.B.: the keys have to include all options that affect the fit, including initial guesses
+      keys = rv_fit_keys(samples, dist_type=self.dist_type, ic_estimator=ic_estimator, warmstart=warmstart, 
+                         coarsen=coarsen if warmstart else None, **fitopts)
+      if warmstart is None: # warm-started fits depend on other fits, hence no lookup
+        for i,key in enumerate(keys):
+          if key in rv_fit_cache: res[i,:] = rv_fit_cache[key]; lfit[i] = False
+    lnew = lfit.copy() # points that are fitted in this call (including coarse points)
+    # compute initial guesses for each sample and store them in front of the sample
+    ics = np.zeros(shape+(plen,)) + np.NaN # N.B.: NaN's are ignored by rv_fit
+    if ( ic_estimator and self.dist_type in (lmom_dists if ic_estimator.lower() == 'lmom' else mom_dists) 
+         and all(ic is None for ic in (ic_shape, ic_args, ic_loc, ic_scale)) ):
+      ics = rv_estimate(samples, dist_type=self.dist_type, method=ic_estimator)
+    fct = functools.partial(rv_fit, ic_shape=ic_shape, ic_args=ic_args, ic_loc=ic_loc, ic_scale=ic_scale, plen=plen, 
+                            nic=plen, dist_type=self.dist_type, lpersist=lpersist, ldiagnostics=True, ldebug=ldebug, **kwargs)
+    # warm start: replace initial guesses with coarse fits or with recent parameters (where available)
+    if not np.any(lfit) or warmstart is None: guesses = None
+    elif warmstart.lower() == 'coarse':
+      guesses = rv_coarse_guesses(np.concatenate((ics, samples), axis=-1), fct, coarsen=coarsen, lshared=lshared)
+      # N.B.: the coarse points themselves are already fitted and are not fitted again
+      lcoarse = np.zeros(shape, dtype=np.bool); lcoarse[tuple(slice(None,None,coarsen) for n in shape)] = True
+      lcoarse = lcoarse.ravel() & lfit
+      res[lcoarse,:] = guesses.reshape((size,plen+3))[lcoarse,:]; lfit[lcoarse] = False
+      guesses = np.where(guesses[...,plen+1:plen+2] == 1, guesses[...,:plen], np.NaN) # only converged fits
+    elif warmstart.lower() == 'cache': guesses = rv_fit_cache.get(gridkey, None)
+    else: raise ArgumentError, warmstart
+    if guesses is not None: 
+      ics = np.where(np.all(np.isfinite(guesses), axis=-1)[...,np.newaxis], guesses, ics)
     if lpersist: # reset global parameters
       global_loc   = None # location parameter ("mean")
       global_scale = None # scale parameter ("standard deviation")
       global_shape = None # single shape parameter
       global_args  = None # multiple shape parameters
-    plen = self.dist_class.numargs + 2 # infer number of parameters
-    fct = functools.partial(rv_fit, ic_shape=ic_shape, ic_args=ic_args, ic_loc=ic_loc, ic_scale=ic_scale, plen=plen, 
-                            dist_type=self.dist_type, lpersist=lpersist, ldebug=ldebug, **kwargs)
-    params = apply_along_axis(fct, samples.ndim-1, samples, chunksize=100//plen//len(samples))
+    # fit remaining samples (in parallel)
+    if np.any(lfit):
+      data = np.concatenate((ics, samples), axis=-1).reshape((size,plen+samples.shape[-1]))[lfit,:]
+      res[lfit,:] = apply_along_axis(fct, 1, data, chunksize=max(1,100//plen//len(samples)), lshared=lshared)
+      del data
     if lpersist: # reset global parameters 
       global_loc   = None # location parameter ("mean")
       global_scale = None # scale parameter ("standard deviation")
       global_shape = None # single shape parameter
       global_args  = None # multiple shape parameters
+    # update cache
+    res = res.reshape(shape+(plen+3,)); params = res[...,:plen]
+    if lcache:
+      if len(rv_fit_cache) + np.sum(lnew) > rv_fit_cache_size: rv_fit_cache.clear() 
+      flat = res.reshape((size,plen+3))
+      for i in np.flatnonzero(lnew): rv_fit_cache[keys[i]] = flat[i,:].copy()
+      rv_fit_cache[gridkey] = np.where(res[...,plen+1:plen+2] == 1, params, np.NaN) # only converged fits
+    # convergence diagnostics for each point (of the most recent fit)
+    self.fit_diagnostics = dict(nnlf=res[...,plen], converged=res[...,plen+1] == 1, nfev=res[...,plen+2])
     assert samples.shape[:-1]+(plen,) == params.shape
     # return an array of kernels
     return params
 
   # universal RV method applicator for distributions
   def _compute_distribution(self, *args, **kwargs):
-    ''' compute a given distribution type over the given support points for each grid point and return as ndarray '''
+    ''' compute a given distribution type over the given support points for each grid point and return as ndarray;
+        SciPy methods are applied to all points at once, unless they do not broadcast over parameters '''
     if 'rv_fct' not in kwargs: raise ArgumentError
     else: rv_fct = kwargs.pop('rv_fct')
+    if rv_fct not in rv_pointwise_fcts and len(args) < 2 and 'n' not in kwargs:
+      support = args[0] if len(args) == 1 else None
+      try:
+        dist = rv_broadcast(self.data_array, dist_type=self.dist_type, fct_type=rv_fct, support=support, 
+                            fillValue=self.fillValue or np.NaN, **kwargs)
+        assert dist.shape[:-1] == self.shape[:-1]
+        return dist
+      except (ValueError, TypeError): pass # N.B.: fall back to applying the method to each point
     if  len(args) == 0:
       fillValue = self.fillValue or np.NaN
       fct = functools.partial(rv_stats, dist_type=self.dist_type, fct_type=rv_fct, fillValue=fillValue, **kwargs)
@@ -1393,8 +2248,12 @@ class VarRV(DistVar):
     ''' draw n samples from the distribution for each grid point and return as ndarray '''
     n = len(support) # in order to use _get_dist(), we have to pass a dummy support
     fillValue = self.fillValue or np.NaN # for masked values
-    fct = functools.partial(rv_resample, dist_type=self.dist_type, n=n, fillValue=fillValue, dtype=self.dtype)
-    samples = apply_along_axis(fct, self.ndim-1, self.data_array, chunksize=10000//n)
+    try: # draw samples for all points at once
+      samples = rv_broadcast(self.data_array, dist_type=self.dist_type, fct_type='rvs', n=n, 
+                             fillValue=fillValue, dtype=self.dtype)
+    except (ValueError, TypeError): # apply to each point
+      fct = functools.partial(rv_resample, dist_type=self.dist_type, n=n, fillValue=fillValue, dtype=self.dtype)
+      samples = apply_along_axis(fct, self.ndim-1, self.data_array, chunksize=10000//n)
     assert samples.shape == self.shape[:-1] + (n,)
     assert np.issubdtype(samples.dtype, self.dtype)
     return samples
@@ -1509,8 +2368,10 @@ class VarRV(DistVar):
   # statistical test for goodness-of-fit
   def fittest(self, samples, nsamples=None, name=None, axis_idx=None, lstatistic=False, lcrossval=False,
               fillValue=None, ignoreNaN=True, N=1000, alternative='two-sided', mode='approx', reta=False,
-              stats_test=None, asVar=True, lcheckVar=True, lcheckAxis=True, pvaratts=None, **kwargs):
-    ''' apply a Kolmogorov-Smirnov Test to the sample data, based on this distribution '''
+              stats_test=None, asVar=True, lcheckVar=True, lcheckAxis=True, pvaratts=None, lvectorize=True, **kwargs):
+    ''' apply a Kolmogorov-Smirnov Test to the sample data, based on this distribution; with k-fold 
+        cross-validation, all folds are tested at once and the mean p-value is returned; all points are
+        tested at once, unless lvectorize=False '''
     # check input
     if self.dtype.kind in ('S',): 
       if lcheckVar: raise VariableError, "Statistical tests does not work with string Variables!"
@@ -1522,15 +2383,19 @@ class VarRV(DistVar):
                                           lcheckVar=True, lcheckAxis=True)
     # select cross-validation subset/fraction
     sz = sample_data.shape[-1] # all sample dimensions should be collapsed by now
+    lkfold = False
     if lcrossval: 
       idx_dtype = np.int16 if sz < 32767 else (np.int32 if sz < 2147483647 else np.int64) # save some memory
-      if self.crossval_mask is not None: # created for random subset (default)
-        assert self.crossval_mask.shape == sample_data.shape, self.crossval_mask.shape 
-        check_mask = self.crossval_mask.sum(axis=-1); mask_len = check_mask.mean() 
-        subsample = np.zeros(check_mask.shape+(mask_len,), dtype=sample_data.dtype, order='C')
-        apply_over_arrays(np.compress, self.crossval_mask, sample_data, out=subsample, axis=-1)
-        sample_data = subsample # replace sample with appropriate sub-sample
-        #print sample_data.shape, sample_data.mean()
+      if self.crossval_idx is not None: # created during initialization
+        lkfold = self.crossval_mode == 'kfold'
+        if lkfold: # shared folds; fold axis in front, like the parameters of the folds
+          sample_data = sample_data.take(self.crossval_idx, axis=-1)
+          sample_data = np.rollaxis(sample_data, axis=sample_data.ndim-2, start=0)
+        elif self.crossval_idx.ndim == 1: # same subset for all points
+          sample_data = sample_data.take(self.crossval_idx, axis=-1)
+        else: # a different subset for each point
+          assert self.crossval_idx.shape[:-1] == sample_data.shape[:-1], self.crossval_idx.shape 
+          sample_data = take_along_last(sample_data, self.crossval_idx)
       else:
         ncv = self.crossval if lcrossval is True else lcrossval
         if ncv == 0 or int(ncv) != ncv: raise ValueError, self.crossval
@@ -1545,13 +2410,19 @@ class VarRV(DistVar):
     if nsamples > sz: raise ValueError, sz        
     # select a random subset
     if lns:
-      sample_data = np.apply_along_axis(np.random.choice, -1, sample_data, size=nsamples, replace=False)
+      sample_data = take_along_last(sample_data, resample_indices(sample_data.shape, nsamples, replace=False))
     # apply test function (parallel)
     #print sample_data.shape, sample_data.mean()
-    fct = functools.partial(rv_stats_test, nparams=len(self.paramAxis), dist_type=self.dist_type, reta=reta,
-                            stats_test=stats_test, ignoreNaN=ignoreNaN, N=N, alternative=alternative, mode=mode)
-    data_array = np.concatenate((self.data_array, sample_data), axis=sax) # merge params and sample arrays (only one argument array per point along axis) 
-    pval = apply_along_axis(fct, sax, data_array, chunksize=100000//len(data_array)) # apply test in parallel, distributing the data
+    params = self.crossval_params if lkfold else self.data_array
+    if lvectorize:
+      pval = rv_stats_test_vectorized(np.asarray(params), sample_data, dist_type=self.dist_type, stats_test=stats_test, 
+                                      ignoreNaN=ignoreNaN, alternative=alternative, mode=mode)
+    else:
+      fct = functools.partial(rv_stats_test, nparams=len(self.paramAxis), dist_type=self.dist_type, reta=reta,
+                              stats_test=stats_test, ignoreNaN=ignoreNaN, N=N, alternative=alternative, mode=mode)
+      data_array = np.concatenate((params, sample_data), axis=params.ndim-1) # merge params and sample arrays (only one argument array per point along axis) 
+      pval = apply_along_axis(fct, params.ndim-1, data_array, chunksize=100000//len(data_array)) # apply test in parallel, distributing the data
+    if lkfold: pval = pval.mean(axis=0) # average over folds
     assert pval.ndim == sax
     assert pval.shape == self.shape[:-1]
     #print pval.shape,pval.mean()
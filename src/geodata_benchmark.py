@@ -0,0 +1,61 @@
+'''
+Created on 2026-10-18
+
+A simple benchmark that compares the performance of masked array storage and NaN storage (see
+geodata.base.nan_storage) for typical Variable reductions and arithmetic.
+
+@author: Andre R. Erler, GPL v3
+'''
+
+import numpy as np
+import numpy.ma as ma
+from timeit import Timer
+
+# import geodata modules
+from geodata.base import Variable, Axis
+
+# benchmark settings
+nyears = 30 # length of the time series in years
+ny, nx = 100, 120 # horizontal grid size
+frac = 0.3 # fraction of missing values
+nrep = 5 # number of repetitions (the best time is reported)
+
+def makeVariable(lnan=False):
+  ''' Create a monthly time series with missing values, stored as masked array or with NaN's. '''
+  time = Axis(name='time', units='month', coord=np.arange(nyears*12))
+  lat = Axis(name='lat', units='deg N', coord=np.linspace(-45,45,ny))
+  lon = Axis(name='lon', units='deg E', coord=np.linspace(0,120,nx))
+  np.random.seed(42)
+  data = np.random.randn(len(time),ny,nx)
+  mask = np.random.rand(ny,nx) < frac
+  data = ma.array(data, mask=np.broadcast_arrays(mask,data)[0])
+  var = Variable(name='test', units='n/a', axes=(time,lat,lon), atts=dict(fillValue=-9999.))
+  return var.load(data, lnan=lnan)
+
+def timeOperation(var, operation):
+  ''' Return the best time for an operation (in seconds). '''
+  timer = Timer(lambda: operation(var))
+  return min(timer.repeat(repeat=nrep, number=1))
+
+# the operations to benchmark
+operations = [('mean(time)', lambda var: var.mean(axis='time')),
+              ('std(time)', lambda var: var.std(axis='time')),
+              ('seasonalMean', lambda var: var.seasonalMean(season='annual')),
+              ('climMean', lambda var: var.climMean()),
+              ('seasonalStats', lambda var: var.seasonalStats(season='annual')),
+              ('var + var', lambda var: var + var),
+              ('var * 2.', lambda var: var * 2.),]
+
+
+if __name__ == '__main__':
+
+  mvar = makeVariable(lnan=False)
+  nvar = makeVariable(lnan=True)
+  assert mvar.masked and nvar.nanmasked
+  print("\nShape: {:s}, missing fraction: {:3.1f}\n".format(str(mvar.shape),frac))
+  print("{:16s}  {:>10s}  {:>10s}  {:>8s}".format('Operation','masked [s]','NaN [s]','Speedup'))
+  for name,operation in operations:
+    tm = timeOperation(mvar, operation)
+    tn = timeOperation(nvar, operation)
+    print("{:16s}  {:10.4f}  {:10.4f}  {:8.2f}".format(name,tm,tn,tm/tn))
+  print('')
@@ -17,10 +17,12 @@ import gc
 # import modules to be tested
 import utils.nanfunctions as nf
 from utils.nctools import writeNetCDF
-from geodata.misc import isZero, isOne, isEqual, isNumber
+from geodata.misc import isZero, isOne, isEqual, isNumber, VariableError
 from geodata.base import Variable, Axis, Dataset, Ensemble, concatVars, concatDatasets
-from geodata.stats import VarKDE, VarRV, asDistVar
+from geodata.lazy import LazyVar, asLazyVar
+from geodata.stats import VarKDE, VarRV, asDistVar, rv_fit_cache
 from geodata.stats import kstest, ttest, mwtest, wrstest, pearsonr, spearmanr
+from geodata.stats import field_significance, fdr_adjust, fdr_threshold
 from datasets.common import data_root
 from wrfavg.wrfout_average import ldebug
 from copy import deepcopy
@@ -125,6 +127,13 @@ class BaseVarTest(unittest.TestCase):
       assert ax.getIndex(val, 'left') is None
       assert ax.getIndex(val, 'right') is None
       assert ax.getIndex(val, 'closest') == len(ax)-1
+      # test vectorized retrieval (uniform spacing uses arithmetic indexing)
+      assert ax.spacing is not None
+      vals = np.concatenate((coord, ( coord[1:] + 2*coord[:-1] ) / 3., coord[[0,-1]] + 2*( coord[[0,-1]] - coord[[1,-2]] )))
+      for mode in ('left','right','closest'):
+        idxs = ax.getIndex(vals, mode)
+        assert isinstance(idxs,ma.MaskedArray) == ( mode != 'closest' ) # out-of-bounds values are masked
+        assert idxs.tolist() == [ax.getIndex(val, mode) for val in vals]
       # test batch value retrieval (exact match only)
       vals = coord[[0,1,2]]
       assert np.all(ax.getIndices(vals) == np.asarray([0,1,2])) 
@@ -179,7 +188,21 @@ class BaseVarTest(unittest.TestCase):
     #print var.shape # this is what it was
     #print data.shape # this is what it is
     #print new_shape # this is what it should be
-    assert data.shape == new_shape 
+    assert data.shape == new_shape
+    # broadcast arrays are read-only views, unless they are tiled
+    assert not data.flags.writeable and data.strides[1] == 0
+    assert np.all(data == var.getArray(axes=new_axes, broadcast=True, ltile=True))
+    # by default, inserted axes are replicated in a writable copy
+    cvar = var.insertAxes(new_axes=var.axes[0:1] + (z,) + var.axes[1:])
+    cvar.data_array[0,0] = 99.; assert cvar.data_array.flags.writeable
+    assert isEqual(var.getArray(), self.data, masked_equal=True) # original is unchanged
+    # optionally, inserting axes uses views; in-place operations make a copy first (copy-on-write)
+    ivar = var.insertAxes(new_axes=var.axes[0:1] + (z,) + var.axes[1:], lcopy=False)
+    assert ivar.shape == var.shape[0:1] + (len(z),) + var.shape[1:] and ivar.data_array.strides[1] == 0
+    assert isEqual(ivar.mean(axis='z').getArray(), var.getArray(), masked_equal=True)
+    ivar *= 2
+    assert ivar.data_array.flags.writeable and isEqual(ivar[:,-1,:], 2*var[:], masked_equal=True)
+    assert isEqual(var.getArray(), self.data, masked_equal=True) # original is unchanged
     
   def testConcatVars(self):
     ''' test concatenation of variables '''
@@ -204,6 +227,27 @@ class BaseVarTest(unittest.TestCase):
     assert isEqual(concat_var[:].take(xrange(12)),concat_data.take(xrange(12)))
     tlen = var.shape[tax]
     assert isEqual(concat_var[:].take(xrange(12,24), axis=tax),concat_data.take(xrange(tlen,tlen+12), axis=tax))    
+    # streaming (lazy) concatenation
+    lazy_var = concatVars([var,copy], axis='time', lcheckAxis=lckax, idxlim=(0,12), offset=1000, lstream=True)
+    assert lazy_var.shape == concat_var.shape
+    assert isEqual(lazy_var[:], concat_var[:], masked_equal=True)
+    assert isEqual(lazy_var[10:14], concat_var[10:14], masked_equal=True)
+    # streaming with coordinate limits and to a NetCDF sink
+    tcoord = var.getAxis('time').coord; coordlim = (tcoord[2],tcoord[9])
+    mem_var = concatVars([var,copy], axis='time', lcheckAxis=lckax, coordlim=coordlim, offset=1000)
+    shape[tax] = 2 * 8
+    assert mem_var.shape == tuple(shape)
+    lazy_var = concatVars([var,copy], axis='time', lcheckAxis=lckax, coordlim=coordlim, offset=1000, lstream=True)
+    assert lazy_var.shape == mem_var.shape and isEqual(lazy_var[:], mem_var[:], masked_equal=True)
+    filename = workdir + 'test_concat.nc'
+    if os.path.exists(filename): os.remove(filename)
+    sink_var = concatVars([var,copy], axis='time', lcheckAxis=lckax, coordlim=coordlim, offset=1000, 
+                          sink=filename, blocksize=1024) # several blocks per member
+    assert sink_var.shape == mem_var.shape
+    ncfile = nc.Dataset(filename, mode='r')
+    assert isEqual(ncfile.variables[mem_var.name][:], mem_var[:], masked_equal=True)
+    assert isEqual(ncfile.variables['time'][:], mem_var.time.coord)
+    ncfile.close(); os.remove(filename)
     # simple test with ensemble
     concat_var = concatVars([var,copy], axis='ensemble', asVar=True, lcheckAxis=lckax)
     # N.B.: some datasets have tiem units in days or hours, which is not uniform 
@@ -284,6 +328,23 @@ class BaseVarTest(unittest.TestCase):
         assert tmp1.units  == tmp2.units
         assert tmp1.dtype  == tmp2.dtype
         isEqual(tmp1[:],tmp2[:])
+        # binned KDE (evaluated by interpolation) should be close to the KDE objects
+        bkde = var.kde(axis=t.name, lbinned=True)
+        assert bkde.lbinned and not distvar.lbinned
+        support = np.linspace(var.min()-1,var.max()+1,25)
+        bpdf = bkde.pdf(support=support, asVar=False); pdf = distvar.pdf(support=support, asVar=False)
+        assert bpdf.shape == pdf.shape
+        assert np.allclose(bpdf, pdf, atol=1e-2*np.nanmax(pdf), equal_nan=True)
+        assert bkde.resample(N=10).shape == var.shape[1:]+(10,)
+        # masked points must not affect resampling of valid points
+        xax = Axis(name='x', units='', coord=np.arange(6)); sax = Axis(name='s', units='', coord=np.arange(200))
+        mdata = np.random.RandomState(42).randn(6,200) + 10.*np.arange(6).reshape((6,1))
+        mdata = ma.array(mdata, mask=np.zeros(mdata.shape, dtype=np.bool)); mdata.mask[[1,3],:] = True
+        mkde = Variable(name='masked', units='', axes=(xax,sax), data=mdata).kde(axis='s', lbinned=True)
+        rdata = ma.filled(mkde.resample(N=1000).data_array, np.NaN)
+        assert np.all(np.isnan(rdata[[1,3],:])) and not np.any(np.isnan(rdata[[0,2,4,5],:]))
+        assert np.allclose(rdata[[0,2,4,5],:].mean(axis=-1), [0,20,40,50], atol=0.3)
+        assert np.allclose(rdata[[0,2,4,5],:].std(axis=-1), 1., atol=0.3)
       print "\n   ***   computed {:s} distribution   ***".format(dist.upper())
       # some VarRV-specific stuff
       if dist != 'kde':
@@ -307,6 +368,54 @@ class BaseVarTest(unittest.TestCase):
         assert not lsimple or isEqual(mom0.data_array, var.data_array.mean(axis=0), eps=0.1)
         assert distvar.entropy().shape == var.shape[1:]
         del mom0; gc.collect()
+        if dist == 'gumbel_r': # vectorized L-moment estimates are close to the MLE
+          lmvar = var.gumbel_r(axis=t.name, estimator='lmom')
+          assert lmvar.shape == distvar.shape
+          assert np.allclose(lmvar.data_array, distvar.data_array, rtol=0.1)
+          # PDF and moments are evaluated for all points at once; compare with SciPy for each point
+          support = np.linspace(-2,8,11); params = distvar.data_array.reshape((-1,2))
+          pdf = distvar.PDF(support=support, asVar=False).reshape((-1,len(support)))
+          assert np.allclose(pdf, [ss.gumbel_r.pdf(support, loc=p[0], scale=p[1]) for p in params])
+          mv = distvar.stats(moments='mv', asVar=False).reshape((-1,2))
+          assert np.allclose(mv, [ss.gumbel_r.stats(loc=p[0], scale=p[1], moments='mv') for p in params])
+        if dist == 'genextreme': # MLE fits report convergence, are cached and can be warm-started
+          ncache = len(rv_fit_cache)
+          mlvar = var.genextreme(axis=t.name)
+          assert len(rv_fit_cache) == ncache # the cache is opt-in
+          diags = mlvar.fit_diagnostics
+          assert diags['nnlf'].shape == diags['nfev'].shape == var.shape[1:]
+          assert diags['converged'].dtype == np.bool and np.any(diags['converged'])
+          assert isEqual(var.genextreme(axis=t.name, lcache=True).data_array, mlvar.data_array, masked_equal=True)
+          ncache = len(rv_fit_cache); assert ncache > 0
+          assert isEqual(var.genextreme(axis=t.name, lcache=True).data_array, mlvar.data_array, masked_equal=True)
+          assert len(rv_fit_cache) == ncache # identical samples are not fitted again
+          var.genextreme(axis=t.name, lcache=True, ic_estimator=None)
+          assert len(rv_fit_cache) > ncache # different options are not served from the cache
+          wsvar = var.genextreme(axis=t.name, warmstart='coarse', coarsen=2)
+          lconv = diags['converged'] & wsvar.fit_diagnostics['converged']
+          assert np.any(lconv) and np.allclose(wsvar.fit_diagnostics['nnlf'][lconv], diags['nnlf'][lconv], rtol=1e-3)
+          coarse = tuple(slice(None,None,2) for n in var.shape[1:]) # coarse points are not fitted twice
+          assert np.allclose(wsvar.fit_diagnostics['nfev'][coarse], diags['nfev'][coarse], equal_nan=True)
+          ncache = len(rv_fit_cache)
+          cvar = var.genextreme(axis=t.name, warmstart='cache', lcache=True)
+          assert cvar.shape == mlvar.shape
+          assert len(rv_fit_cache) > ncache # warm-started fits are stored separately
+        if dist == 'norm': # bootstrap samples are reproducible with a seed, also when fitted blockwise
+          bsvar = var.norm(axis=t.name, lbootstrap=True, nbs=10, seed=42)
+          assert bsvar.shape == (10,)+distvar.shape
+          assert isEqual(bsvar.data_array[0], distvar.data_array)
+          bsblk = var.norm(axis=t.name, lbootstrap=True, nbs=10, seed=42, bootstrap_blocksize=3)
+          assert isEqual(bsvar.data_array, bsblk.data_array)
+          for key,diags in bsvar.fit_diagnostics.items(): # diagnostics of all blocks
+            assert np.allclose(bsblk.fit_diagnostics[key], diags, equal_nan=True)
+          # k-fold cross-validation: all folds are fitted and tested at once
+          cvvar = var.norm(axis=t.name, lcrossval=True, ncv=4, crossval_mode='kfold', seed=42)
+          assert cvvar.crossval_idx.shape == (4,len(t)//4)
+          assert cvvar.crossval_params.shape == (4,)+distvar.shape
+          assert cvvar.crossval_diagnostics['nfev'].shape == (4,)+var.shape[1:]
+          assert cvvar.fit_diagnostics['nfev'].shape == var.shape[1:]
+          assert isEqual(cvvar.data_array, distvar.data_array) # the distribution uses the full sample
+          assert cvvar.fittest(var, lcrossval=True).shape == var.shape[1:]
         #print distvar.entropy().data_array
       # test histogram
       if lsimple:
@@ -493,6 +602,87 @@ class BaseVarTest(unittest.TestCase):
       # for some reason, numerical precision is really low here...
     else: raise AssertionError
 
+  def testLazyArithmetic(self):
+    ''' test deferred evaluation of binary arithmetic and ufuncs '''
+    # get test objects
+    var = self.var; rav = self.rav
+    eager = ( var + rav ) * 2
+    if self.__class__ is not BaseVarTest: var.unload() # read blocks directly from file
+    lvar = ( asLazyVar(var) + rav ) * 2
+    assert isinstance(lvar,LazyVar) and not lvar.data
+    assert lvar.name == eager.name and lvar.units == eager.units and lvar.dtype == eager.dtype
+    # units are checked, when the expression is built
+    other = Variable(name='other', units='other', axes=var.axes, data=np.ones(var.shape))
+    self.assertRaises(VariableError, asLazyVar(var).__add__, other)
+    # evaluate a slice and everything (in small blocks)
+    assert isEqual(lvar[1,:,:], eager.data_array[1,:,:])
+    assert not lvar.data
+    lvar.blocksize = 1000
+    assert isEqual(lvar.getArray(), eager.getArray()) and lvar.data
+    # ufuncs
+    if var.dtype.kind == 'f':
+      lexp = asLazyVar(var).exp(lwarn=False)
+      assert isinstance(lexp,LazyVar) and lexp.name == 'exp({:s})'.format(var.name)
+      assert isEqual(lexp.getArray(), np.exp(var.getArray()))
+    # write to file (evaluated in blocks)
+    filename = workdir + '/test.nc'
+    if os.path.exists(filename): os.remove(filename)
+    lvar = ( asLazyVar(var) + rav ) * 2; lvar.name = 'lazy'
+    writeNetCDF(Dataset(name='lazy', varlist=[lvar]), filename, blocksize=1000)
+    assert not lvar.data
+    ncfile = nc.Dataset(filename)
+    assert isEqual(ncfile.variables['lazy'][:], eager.getArray())
+    ncfile.close()
+    if os.path.exists(filename): os.remove(filename)
+
+  def testNaNStorage(self):
+    ''' test storage of missing values as NaN in plain arrays (instead of masked arrays) '''
+    import geodata.base as base
+    # masked float data
+    data = ma.masked_less(np.random.randn(*self.size), -1.) # mask about 15%
+    lmask = data.mask
+    mvar = Variable(name='masked', units='', axes=self.axes, data=data.copy(), atts=dict(fillValue=-9999.))
+    nan_storage = base.nan_storage; base.nan_storage = True
+    try:
+      var = Variable(name='nan', units='', axes=self.axes, data=data.copy(), atts=dict(fillValue=-9999.))
+      assert var.nanmasked and not var.masked and not isinstance(var.data_array, ma.MaskedArray)
+      assert np.all(np.isnan(var.data_array) == lmask)
+      assert np.all(var.getMask() == lmask) and np.all(var.getMask() == mvar.getMask())
+      assert isinstance(var.getArray(lmasked=True), ma.MaskedArray)
+      assert np.all(var.getArray(unmask=True)[lmask] == -9999.)
+      # reductions and arithmetic
+      assert isEqual(var.mean(axis='time').getArray(), mvar.mean(axis='time').getArray())
+      if len(self.axes[0])%12 == 0:
+        assert isEqual(var.climMean(lstrict=False).getArray(), mvar.climMean(lstrict=False).getArray(lmasked=True))
+      svar = var + var
+      assert svar.nanmasked and np.all(np.isnan(svar.data_array) == lmask)
+      var += mvar # masked operand
+      assert np.all(np.isnan(var.data_array) == lmask)
+      # masking and unmasking
+      var.mask(mask=np.ones(self.size[1:], dtype=np.bool), merge=True)
+      assert np.all(np.isnan(var.data_array)) and var.nanmasked
+      var.unmask(fillValue=0)
+      assert np.all(var.data_array == 0) and not var.nanmasked
+    finally: base.nan_storage = nan_storage
+    # NaN storage is opt-in: plain float arrays in default mode are not NaN-masked
+    var = Variable(name='masked', units='', axes=self.axes, data=data.copy(), atts=dict(fillValue=-9999.))
+    var.unmask()
+    assert not var.masked and not var.nanmasked and isinstance(var.data_array, np.ndarray)
+    var.mask(mask=lmask)
+    assert var.masked and not var.nanmasked and isinstance(var.data_array, ma.MaskedArray)
+    assert np.all(var.getMask() == lmask)
+    # an explicit request for NaN storage
+    var.load(data.copy(), lnan=True)
+    assert var.nanmasked and np.all(np.isnan(var.data_array) == lmask)
+    # NaN storage is retained by copies and derived Variables
+    taxis = self.axes[0].name
+    for result in (var + var, var * 2., var.mean(axis=taxis), var.copy(), var.deepcopy(), 
+                   var(**{taxis:self.axes[0].coord[1:4]})):
+      assert result.nanmasked and not isinstance(result.data_array, ma.MaskedArray)
+    assert isEqual((var + var).getArray(), (mvar + mvar).getArray())
+    assert (mvar + mvar).masked and not (mvar + mvar).nanmasked # default mode is not affected
+    var.unload(); assert not var.nanmasked
+
   def testLoad(self):
     ''' test data loading and unloading '''
     # get test objects
@@ -615,6 +805,16 @@ class BaseVarTest(unittest.TestCase):
     assert isEqual(qvar_min.data_array, qvar.data_array.min(axis=var.axisIndex(t.name)))
     assert isEqual(qvar_median.data_array, np.median(qvar.data_array,axis=var.axisIndex(t.name)))
     assert isEqual(qvar_max.data_array, qvar.data_array.max(axis=var.axisIndex(t.name)))
+    # percentiles ignore missing values; approximate percentiles are accurate to within one bin width
+    q = (0.05,0.50,0.95); tax = var.axisIndex(t.name)
+    qdata = var.getArray(); qdata = qdata.filled(np.NaN) if isinstance(qdata,ma.MaskedArray) else qdata
+    qdata = np.rollaxis(np.asarray(np.nanpercentile(np.float64(qdata), [100*qq for qq in q], axis=tax)), 0, tax+1)
+    qvar = var.percentile(q, axis=t.name)
+    assert np.allclose(qvar.getArray(unmask=True, fillValue=np.NaN), qdata, equal_nan=True)
+    avar = var.percentile(q, axis=t.name, lapprox=True, nbins=64)
+    assert avar.shape == qvar.shape and avar.axes[tax].name == 'percentile'
+    vrange = np.nanmax(qdata) - np.nanmin(qdata) # conservative bound for the bin width
+    assert np.nanmax(np.abs(avar.getArray(unmask=True, fillValue=np.NaN) - qdata)) <= vrange/64. + 1e-6
     del data; gc.collect()
     # reduction fcts. of Variables ignore NaN values
     # test histogram
@@ -631,6 +831,13 @@ class BaseVarTest(unittest.TestCase):
     if lsimple:
       assert self.data.min() == 1 and self.data.max() == 12 and self.data.shape[0] == 48
       assert hvar.limits() == (4,4)
+    # vectorized histograms have to be identical to np.histogram (also with non-uniform bins)
+    nubinedgs = np.asarray([binedgs[0], binedgs[2], binedgs[3], binedgs[-1]])
+    hdata = var.histogram(binedgs=nubinedgs, ldensity=True, asVar=False, axis=t.name)
+    tax = var.axisIndex(t.name); slc = [0]*var.ndim; slc[tax] = slice(None); slc = tuple(slc)
+    sample = var.getArray()[slc]
+    sample = sample.compressed() if isinstance(sample,ma.MaskedArray) else sample[~np.isnan(sample)]
+    assert np.all(hdata[slc] == np.histogram(sample, bins=nubinedgs, density=True)[0])
 #     # test simple version
 #     hvar = var.histogram(bins=bins, binedgs=binedgs, ldensity=True, asVar=False, lflatten=True)
 #     hist,bin_edges  = np.histogram(self.var.getArray(), bins=binedgs, density=True)
@@ -664,7 +871,25 @@ class BaseVarTest(unittest.TestCase):
       assert yvar.shape == var.shape[:tax]+(var.shape[0]/12,)+var.shape[tax+1:]
       cvar = var.climMean(lstrict=lstrict)
       assert len(cvar.getAxis('time')) == 12
-      assert cvar.shape == var.shape[:tax]+(12,)+var.shape[tax+1:]      
+      assert cvar.shape == var.shape[:tax]+(12,)+var.shape[tax+1:]
+      # reduction in small chunks has to give identical results
+      if var.ndim > 1 and var.shape[1] > 1:
+        import geodata.base as base
+        blocksize = base.reduce_blocksize; base.reduce_blocksize = 1
+        try: cyvar = var.seasonalMean('jj', asVar=True, lstrict=lstrict)
+        finally: base.reduce_blocksize = blocksize
+        assert np.all(cyvar.getArray() == yvar.getArray())
+      # several statistics in a single pass
+      ystats = var.seasonalStats('jj', stats=('mean','std','max'), lstrict=lstrict)
+      assert set(ystats.keys()) == set(('mean','std','max'))
+      assert ystats['mean'].hasAxis('year') and ystats['mean'].shape == yvar.shape
+      assert isEqual(ystats['mean'].getArray(), yvar.getArray())
+      assert isEqual(ystats['std'].getArray(), var.seasonalStd('jj', lstrict=lstrict))
+      assert isEqual(ystats['max'].getArray(), var.seasonalMax('jj', lstrict=lstrict))
+      cds = var.climStats(stats=('mean','min'), lDataset=True, lstrict=lstrict)
+      assert isinstance(cds, Dataset) and len(cds.variables) == 2
+      assert isEqual(cds.variables[var.name+'_mean'].getArray(), cvar.getArray())
+      assert isEqual(cds.variables[var.name+'_min'].getArray(), var.climMin(lstrict=lstrict).getArray())
     if self.__class__ is BaseVarTest:
       # this only works with a specially prepared data field
       yfake = np.ones((var.shape[0]/12,)+var.shape[1:])
@@ -754,6 +979,13 @@ class BaseVarTest(unittest.TestCase):
     assert stdvar.name == var.name+'_test'
     assert stdvar.mean() < trendvar.mean()
     assert stdvar.std() < trendvar.std()
+    if lsimple: # compare batched fit with a fit for each series
+      tcoord = trendvar.time.coord
+      dtvar = trendvar.standardize(linplace=False, axis='time', lstandardize=False, ldetrend=True, degree=2)
+      fct = lambda a: a - np.polyval(np.polyfit(tcoord, a, 2), tcoord)
+      assert isEqual(dtvar.data_array, np.apply_along_axis(fct, 0, trendvar.data_array))
+      anvar = trendvar.standardize(linplace=False, axis='time', lstandardize=True, lmonthly=True)
+      assert np.allclose(anvar.data_array.reshape((4,12)+anvar.shape[1:]).mean(axis=0), 0)
     # now standardize in-place
     name = var.name
     var.standardize(linplace=True, axis=None, lstandardize=True, ldetrend=False, lsmooth=False) # make variables more likely to test positive
@@ -777,6 +1009,12 @@ class BaseVarTest(unittest.TestCase):
     # run variable test (normaltest)
     pvar = var.shapiro(asVar=True, axis='time', lflatten=False)
     assert pvar.shape == var.shape[1:]
+    # compare batched tests with the per-point SciPy versions
+    for test,kwargs in (('normaltest',dict()),('shapiro',dict()),('anderson',dict(dist='norm')),
+                        ('kstest',dict(dist='norm',args=(0,1)))):
+      pvar = getattr(var,test)(asVar=False, axis='time', lvectorize=True, **kwargs)
+      pfvar = getattr(var,test)(asVar=False, axis='time', lvectorize=False, **kwargs)
+      assert isEqual(pvar, pfvar, eps=1e-4) # Shapiro-Wilk coefficients are single precision
     ## test fitted distributions
     # fit normal distribution over entire range 
     nvar = var.norm(axis=t.name, lflatten=True, ldebug=False)
@@ -807,7 +1045,26 @@ class BaseVarTest(unittest.TestCase):
     pvar = wrstest(sin, cos, axis='time')
     assert pvar.data_array.mean() < 0.5 # not all tests are that accurate...
     assert pvar.shape == var.shape[1:] # this will usually be close to zero, since none of these are normally distributed
-    del sin, cos, pvar; gc.collect() # free some memory - these can get large
+    # compare vectorized tests with the per-point SciPy versions
+    for test in (kstest, ttest, mwtest, wrstest):
+      vvar = test(var, sin, axis='time', lvectorize=True)
+      fvar = test(var, sin, axis='time', lvectorize=False)
+      assert isEqual(vvar.data_array, fvar.data_array, masked_equal=True)
+    ## field significance and FDR control
+    pvar = ttest(var, sin, axis='time')
+    qvar = fdr_adjust(pvar, method='bh')
+    assert qvar.shape == pvar.shape and qvar.masked == pvar.masked
+    pval = pvar.getArray(unmask=True, fillValue=np.NaN); qval = qvar.getArray(unmask=True, fillValue=np.NaN)
+    assert np.all(np.isnan(qval) == np.isnan(pval)) # masked values are not counted as tests
+    assert np.all(qval[np.isfinite(qval)] >= pval[np.isfinite(pval)])
+    pthr = fdr_threshold(pvar, alpha=0.05)
+    with np.errstate(invalid='ignore'): assert np.all( ( pval <= pthr ) == ( qval <= 0.05 ) )
+    # permutations are drawn up front, so results do not depend on the number of processes
+    fvar, pfield = field_significance(var, sin, test='ttest', axis='time', nperm=19, seed=42, NP=1)
+    pfvar, ppfield = field_significance(var, sin, test='ttest', axis='time', nperm=19, seed=42, NP=2, chunksize=5)
+    assert fvar.shape == pvar.shape and 0 < pfield <= 1 and pfield == ppfield
+    assert isEqual(fvar.data_array, pfvar.data_array, masked_equal=True)
+    del sin, cos, pvar, vvar, fvar, qvar, pfvar; gc.collect() # free some memory - these can get large
     
     ## correlation coefficients
     rnd = var.copy(); rnd.data_array = np.random.randn(var.data_array.size).reshape(var.shape)
@@ -832,6 +1089,15 @@ class BaseVarTest(unittest.TestCase):
     assert rvar.data_array.mean() < 0.25 # not all tests are that accurate...
     assert pvar.data_array.mean() > 0.25 # not all tests are that accurate...
     assert rvar.shape == var.shape[1:] # this will usually be close to zero, since none of these are normally distributed
+    # compare vectorized correlations (also against a single reference series) with the per-point versions
+    refdata = rnd.data_array.reshape((rnd.shape[0],-1))[:,0] # a single reference series (e.g. an index)
+    for corr in (pearsonr, spearmanr):
+      for sample in (rnd, refdata):
+        rvar,pvar = corr(var, sample, lpval=True, lrho=True, axis='time', lvectorize=True)
+        rfvar,pfvar = corr(var, sample, lpval=True, lrho=True, axis='time', lvectorize=False)
+        assert rvar.shape == var.shape[1:]
+        assert isEqual(rvar.data_array, rfvar.data_array, masked_equal=True)
+        assert isEqual(pvar.data_array, pfvar.data_array, masked_equal=True)
     
   def testUnaryArithmetic(self):
     ''' test in-place and unary arithmetic functions and ufuncs'''
@@ -1050,6 +1316,22 @@ class BaseDatasetTest(unittest.TestCase):
     if nocat is not None: 
       ccnc = ccds[ncname] # test other variable (should be the same) 
       assert ccnc.shape == nocat.shape
+    # streaming to a NetCDF sink with coordinate limits
+    coordlim = (catax.coord[1],catax.coord[-2])
+    mmds = concatDatasets([ds, cp], axis=axname, coordlim=coordlim, offset=0, lcheckAxis=lckax)
+    filename = workdir + 'test_concat.nc'
+    if os.path.exists(filename): os.remove(filename)
+    skds = concatDatasets([ds, cp], axis=axname, coordlim=coordlim, offset=0, lcheckAxis=lckax, 
+                          sink=filename, blocksize=1024) # several blocks per member
+    assert skds[varname].shape == mmds[varname].shape == (2*(len(catax)-2),)+shape[1:]
+    ncfile = nc.Dataset(filename, mode='r')
+    for var in mmds.variables.itervalues():
+      if var.hasAxis(axname): 
+        data = ncfile.variables[var.name][:]
+        if var.dtype.kind == 'S': data = nc.chartostring(data) # strings are stored as char arrays
+        assert isEqual(data, var[:], masked_equal=True)
+    assert isEqual(ncfile.variables[axname][:], mmds.axes[axname].coord)
+    ncfile.close(); os.remove(filename)
     # simple test with ensemble
     # generate test data
     concat_data = concatVars([ds[varname],cp[varname]], lensembleAxis=True, asVar=False, lcheckAxis=lckax) # should be time
@@ -1306,6 +1588,39 @@ class BaseDatasetTest(unittest.TestCase):
     print(ncfile)
     ncfile.close()
     if os.path.exists(filename): os.remove(filename)
+    # stream in small blocks, using a background writer thread
+    for var in dataset.variables.values(): var.load()
+    writeNetCDF(dataset, filename, writeData=True, blocksize=1000, lthread=True)
+    ncfile = nc.Dataset(filename)
+    for var in dataset.variables.values():
+      if var.dtype.kind != 'S':
+        assert isEqual(var.getArray(), ncfile.variables[var.name][:], masked_equal=True)
+    ncfile.close()
+    if os.path.exists(filename): os.remove(filename)
+    # source data are read from file and streamed, while blocks are written in the background
+    if isinstance(dataset,DatasetNetCDF):
+      lazy = Dataset(name='lazy', varlist=[concatVars([var,var], axis=var.axes[0].name, lstream=True, lcheckAxis=False) 
+                                           for var in dataset.variables.values() if var.dtype.kind != 'S'])
+      dataset.unload()
+      writeNetCDF(lazy, filename, writeData=True, blocksize=1000, lthread=True)
+      ncfile = nc.Dataset(filename)
+      for var in lazy.variables.values():
+        assert isEqual(var[:], ncfile.variables[var.name][:], masked_equal=True)
+      ncfile.close()
+      if os.path.exists(filename): os.remove(filename)
+    # errors from the writer thread are raised on close, but must not hide errors in the main thread
+    from utils.nctools import BlockWriter
+    writer = BlockWriter(); writer.start()
+    writer.put(None, slice(None), np.zeros(3)) # fails in the writer thread
+    self.assertRaises(TypeError, writer.close)
+    writer = BlockWriter(); writer.start()
+    writer.put(None, slice(None), np.zeros(3))
+    writer.close(lraise=False)
+    def broken(*args, **kwargs): raise IOError, "Test error."
+    var = dataset.variables.values()[-1]; var.__dict__['getArray'] = broken
+    self.assertRaises(IOError, writeNetCDF, dataset, filename, writeData=True, blocksize=1000, lthread=True)
+    del var.__dict__['getArray']
+    if os.path.exists(filename): os.remove(filename)
   
 
 # import modules to be tested
@@ -1403,9 +1718,40 @@ class NetCDFVarTest(BaseVarTest):
         assert isEqual(self.data.__getitem__(sl), var.data_array)
       else:
         assert isEqual(self.data.__getitem__(sl).filled(var.fillValue), var.data_array)
-    else: 
+    else:
       raise AssertionError, "There should be 3 dimensions!!!"
 
+  def testMemmap(self):
+    ''' test reading through memory maps (NetCDF3 files only) '''
+    # get test objects
+    ncvar = self.ncvar
+    if ncvar.group().data_model[:7] != 'NETCDF3': return # not applicable
+    var = VarNC(ncvar, axes=self.axes, memmap=True)
+    # compare to netCDF4, including scaling, masking and record variable striding
+    assert isEqual(self.data, var[:], masked_equal=True)
+    assert isEqual(self.data[1,:,1:-1], var[1,:,1:-1])
+    assert isEqual(self.data[[0,5,2],10,:], var[[0,5,2],10,:])
+    var.load(); assert isEqual(self.data, var.data_array, masked_equal=True)
+    # raw data are a view into the file
+    ncvar.set_auto_maskandscale(False)
+    raw = VarNC(ncvar, axes=self.axes, memmap=True, dtype=ncvar.dtype)
+    assert isEqual(ncvar[:], raw[:]) and not raw[2:4,:,:].flags.owndata
+    ncvar.set_auto_maskandscale(True)
+    # slicing retains the memory map option
+    slcvar = var(**{var.axes[0].name:slice(0,2)})
+    assert slcvar.memmap and isEqual(self.data[0:2,:,:], slcvar.load().data_array)
+    # valid ranges are applied like in netCDF4 (by falling back to netCDF4)
+    filename = workdir + '/test_valid.nc'
+    ncfile = nc.Dataset(filename, mode='w', format='NETCDF3_CLASSIC')
+    ncfile.createDimension('x', size=10)
+    ncfile.createVariable('x', 'f4', ('x',))[:] = np.arange(10)
+    ncfile.createVariable('test', 'f4', ('x',), fill_value=-9999.)[:] = np.arange(10)
+    ncfile.variables['test'].valid_max = np.float32(7.); ncfile.close()
+    ncfile = nc.Dataset(filename, mode='r'); ncvar = ncfile.variables['test']
+    vvar = VarNC(ncvar, axes=(Axis(name='x', units='', coord=np.arange(10)),), memmap=True)
+    assert isEqual(vvar[:], ncvar[:], masked_equal=True) and ma.count_masked(vvar[:]) == 2
+    ncfile.close(); os.remove(filename)
+
   def testScaling(self):
     ''' test scale and offset operations '''
     # get test objects
@@ -1418,6 +1764,16 @@ class NetCDFVarTest(BaseVarTest):
     var.load()
     assert self.size == var.shape
     assert isEqual(self.data*2+100., var.data_array)
+    # NetCDF scaling and VarNC scaling are applied separately, i.e. rounding is the same as in two steps
+    data = self.data.copy(); data *= 2.; data += 100.
+    assert var.data_array.dtype == data.dtype # no upcasting
+    assert np.array_equal(ma.getdata(data)[~ma.getmaskarray(data)], 
+                          ma.getdata(var.data_array)[~ma.getmaskarray(data)])
+    # scaled data with a different dtype
+    var.unload(); var.scaledtype = np.dtype('float64')
+    var.load()
+    assert var.dtype == np.dtype('float64') and var.data_array.dtype == np.dtype('float64')
+    assert isEqual(self.data*2+100., var.data_array.astype(self.data.dtype))
   
 
 class DatasetNetCDFTest(BaseDatasetTest):  
@@ -1564,6 +1920,96 @@ class DatasetNetCDFTest(BaseDatasetTest):
     dataset.unload()
     assert all([not var.data for var in dataset])
 
+  def testMultiFile(self):
+    ''' test virtual concatenation of several files along the record dimension '''
+    nt = self.ncvar.shape[0]
+    # split test variable into three files along the record dimension
+    bounds = [0, nt//3, nt//2, nt]
+    for ncformat,memmap in (('NETCDF4',False),('NETCDF3_CLASSIC',True)):
+      self._testMultiFile(bounds, ncformat=ncformat, memmap=memmap)
+      
+  def _testMultiFile(self, bounds, ncformat='NETCDF4', memmap=False):
+    ''' helper for testMultiFile '''
+    ncvar = self.ncvar; tdim = ncvar.dimensions[0]; nt = ncvar.shape[0]
+    filelist = []; ncvar.set_auto_maskandscale(False) # copy raw data
+    for i in xrange(3):
+      filename = 'test_mf{:d}.nc'.format(i); filelist.append(filename)
+      ncfile = nc.Dataset(self.folder+filename, mode='w', format=ncformat)
+      for dim in ncvar.dimensions:
+        ncfile.createDimension(dim, size=None if dim == tdim else len(self.ncdata.dimensions[dim]))
+        coord = ncfile.createVariable(dim, self.ncdata.variables[dim].dtype, (dim,))
+        coord[:] = self.ncdata.variables[dim][bounds[i]:bounds[i+1]] if dim == tdim else self.ncdata.variables[dim][:]
+      fillValue = ncvar.getncattr('_FillValue') if '_FillValue' in ncvar.ncattrs() else None
+      var = ncfile.createVariable(self.ncvarname, ncvar.dtype, ncvar.dimensions, fill_value=fillValue)
+      var.setncatts({att:ncvar.getncattr(att) for att in ncvar.ncattrs() if att != '_FillValue'})
+      var.set_auto_maskandscale(False); var[:] = ncvar[bounds[i]:bounds[i+1],:]
+      ncfile.close()
+    ncvar.set_auto_maskandscale(True)
+    # open as one dataset, with at most one open file
+    dataset = DatasetNetCDF(folder=self.folder, filelist=[filelist], varlist=[self.ncvarname], multifile=True, maxopen=1,
+                            memmap=memmap) # N.B.: memory maps are not used for multi-file datasets
+    mfds = dataset.dataset
+    assert len(dataset.axes[tdim]) == nt and isEqual(dataset.axes[tdim][:], self.ncdata.variables[tdim][:])
+    var = dataset.variables[self.ncvarname]
+    assert var.shape == self.data.shape
+    # slices across file boundaries, strides, and irregular indices
+    assert isEqual(var[:], self.data)
+    assert isEqual(var[bounds[1]-1:bounds[2]+1,:,:], self.data[bounds[1]-1:bounds[2]+1,:,:])
+    assert isEqual(var[::5,0,:], self.data[::5,0,:])
+    idx = [nt-1,0,bounds[2],1]
+    assert isEqual(mfds.variables[self.ncvarname][idx], self.data[idx,:])
+    assert isEqual(mfds.variables[self.ncvarname][bounds[2],1,:], self.data[bounds[2],1,:])
+    assert mfds.nopen == 1
+    # load and close
+    var.load(); assert isEqual(var.data_array, self.data)
+    dataset.close(); assert mfds.nopen == 0
+    for filename in filelist: os.remove(self.folder+filename)
+
+  def testPrefetch(self):
+    ''' test processing with prefetching of source variables in a background thread '''
+    from processing.process import CentralProcessingUnit
+    filename = self.folder + 'test_prefetch.nc'
+    if os.path.exists(filename): os.remove(filename)
+    # create a source dataset with several variables
+    dataset = DatasetNetCDF(filelist=[filename],mode='w')
+    ax = Axis(name='t', units='', coord=np.arange(10))
+    dataset.addAxis(ax)
+    varlist = ['test{:d}'.format(i) for i in xrange(4)]
+    for i,varname in enumerate(varlist):
+      dataset.addVariable(Variable(name=varname, units='', axes=(ax,), data=np.arange(10, dtype='float')+i))
+    dataset.sync(); dataset.close()
+    source = DatasetNetCDF(filelist=[filename],mode='r')
+    def double(var):
+      var.load() # no-op, if prefetched
+      return var.copy(data=var.data_array*2.)
+    # output has to be identical with and without prefetching
+    results = []
+    for prefetch in (0,1,3):
+      CPU = CentralProcessingUnit(source, varlist=varlist, feedback=False)
+      CPU.process(double, prefetch=prefetch)
+      results.append(CPU.getTmp())
+      assert not any([source.variables[varname].data for varname in varlist])
+    for i,varname in enumerate(varlist):
+      data = results[0].variables[varname].data_array
+      assert isEqual(data, ( np.arange(10, dtype='float')+i )*2.)
+      for result in results[1:]: assert isEqual(result.variables[varname].data_array, data)
+    # errors during processing have to propagate, and prefetched variables have to be released
+    def fail(var):
+      if var.name == varlist[1]: raise VariableError, "Test error."
+      return double(var)
+    for prefetch in (0,3):
+      CPU = CentralProcessingUnit(source, varlist=varlist, feedback=False)
+      self.assertRaises(VariableError, CPU.process, fail, prefetch=prefetch)
+      assert not any([source.variables[varname].data for varname in varlist])
+    # errors while loading have to propagate from the reader thread
+    def broken(*args, **kwargs): raise IOError, "Test error."
+    source.variables[varlist[2]].__dict__['load'] = broken
+    for prefetch in (0,1,3):
+      CPU = CentralProcessingUnit(source, varlist=varlist, feedback=False)
+      self.assertRaises(IOError, CPU.process, double, prefetch=prefetch)
+      assert not any([source.variables[varname].data for varname in varlist])
+    source.close(); os.remove(filename)
+
 
 # import modules to be tested
 from geodata.gdal import addGDALtoVar, addGDALtoDataset
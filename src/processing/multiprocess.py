@@ -13,6 +13,7 @@ import sys
 import gc # garbage collection
 import types
 import os
+import functools
 import numpy as np
 from datetime import datetime
 from time import sleep
@@ -249,13 +250,44 @@ def asyncPoolEC(func, args, kwargs, NP=1, ldebug=False, ltrialnerror=True):
   # return with exit code
   return exitcode
 
-def apply_along_axis(fct, axis, data, NP=0, chunksize=200, ldebug=False, laax=True, *args, **kwargs):
+# shared arrays of the worker processes (only visible within each process)
+shared_data = None # the data array that is split into chunks
+shared_kwargs = dict() # additional arrays that are passed to fct as keyword arguments
+
+def share_array(array):
+  ''' copy an array into shared memory; returns the buffer, shape and dtype (see init_shared_worker) '''
+  buf = multiprocessing.RawArray('b', array.nbytes)
+  np.frombuffer(buf, dtype=array.dtype).reshape(array.shape)[:] = array
+  return buf, array.shape, array.dtype
+
+def init_shared_worker(data=None, shared=None):
+  ''' pool initializer: attach the shared memory buffers as Numpy arrays (no copy) '''
+  global shared_data, shared_kwargs
+  if data is not None: 
+    buf, shape, dtype = data
+    shared_data = np.frombuffer(buf, dtype=dtype).reshape(shape)
+  if shared is not None:
+    shared_kwargs = {name:np.frombuffer(buf, dtype=dtype).reshape(shape) for name,(buf,shape,dtype) in shared.items()}
+
+def shared_chunk_worker(fct, chunk, laax=True, *args, **kwargs):
+  ''' apply fct to a chunk of data; the chunk is either an array or the index range (i0,i1) of the shared 
+      data array, and shared arrays are passed to fct as keyword arguments '''
+  if isinstance(chunk, tuple): chunk = shared_data[chunk[0]:chunk[1],:]
+  if shared_kwargs: fct = functools.partial(fct, **shared_kwargs)
+  if laax: return np.apply_along_axis(fct, 1, chunk, *args, **kwargs)
+  else: return fct(chunk, *args, **kwargs)
+
+def apply_along_axis(fct, axis, data, NP=0, chunksize=200, ldebug=False, laax=True, lshared=False, shared=None, 
+                     *args, **kwargs):
   ''' a parallelized version of numpy's apply_along_axis; the preferred way of passing arguments is,
       by using functools.partial, but arguments can also be passed to this function; the call-signature
       is the same as for np.apply_along_axis, except for NP=OMP_NUM_THREADS, chunksize=200, 
       ldebug=False, and laax=True; the latter can be set to False, if fct is fully vectorized and only
       the parallelization feature is required, otherwise Numpy's apply_along_axis will be called within
-      child processes. '''  
+      child processes. With lshared=True, the data are copied into shared memory once, and workers
+      only receive the index range of each chunk, instead of a pickled copy of the chunk. Arrays that 
+      are required in full by every chunk can be passed as a dict 'shared'; they are copied into shared 
+      memory once and passed on to fct as keyword arguments (instead of pickling them for every chunk). '''  
   if NP == 0: NP = int(os.environ['OMP_NUM_THREADS'])
   # pre-processing: move sampel axis to the back
   if not axis == data.ndim-1:
@@ -272,6 +304,7 @@ def apply_along_axis(fct, axis, data, NP=0, chunksize=200, ldebug=False, laax=Tr
   if (NP == 1 or arraysize < 1.1*chunksize):
     # just use regular Numpy version... but always apply over last dimension
     if ldebug: print('\n   ***   Running in Serial Mode   ***')
+    if shared: fct = functools.partial(fct, **shared)
     if laax: results = np.apply_along_axis(fct, 1, data, *args, **kwargs)
     else: results = fct(data, *args, **kwargs)
   else:
@@ -291,12 +324,21 @@ def apply_along_axis(fct, axis, data, NP=0, chunksize=200, ldebug=False, laax=Tr
     # initialize worker pool
     if ldebug: print('\n   ***   firing up pool (using async results)   ***')
     if ldebug: print('         OMP_NUM_THREADS = {:d}\n'.format(NP))
-    pool = multiprocessing.Pool(processes=NP)
+    if lshared or shared:
+      # copy data into shared memory, which is attached by every worker process
+      initargs = ( share_array(data) if lshared else None, 
+                   {name:share_array(np.asarray(array)) for name,array in shared.items()} if shared else None )
+      pool = multiprocessing.Pool(processes=NP, initializer=init_shared_worker, initargs=initargs)
+    else: pool = multiprocessing.Pool(processes=NP)
     results = [] # list of resulting chunks (concatenated later    
     for n in xrange(nc):
       # run computation on individual subsets/chunks
       if ldebug: print('   Starting Chunk #{:d}'.format(n+1))
-      if laax: # use Numpy's apply_along_axis
+      if lshared: # only pass the index range of the chunk
+        result = pool.apply_async(shared_chunk_worker, (fct,(n*cs,min((n+1)*cs,arraysize)),laax)+args, kwargs)
+      elif shared: # pass the chunk, but attach shared arrays
+        result = pool.apply_async(shared_chunk_worker, (fct,chunks[n],laax)+args, kwargs)
+      elif laax: # use Numpy's apply_along_axis
         result = pool.apply_async(np.apply_along_axis, (fct,1,chunks[n],)+args, kwargs)
       else: # for ufunc-like functions that can operate on multi-dimensional arrays
         result = pool.apply_async(fct, (chunks[n],)+args, kwargs)
@@ -331,6 +373,8 @@ if __name__ == '__main__':
     return ( arr - np.mean(arr) ) / arr.std() - kw, kw
    
   def func1(arr, kw=0, axis=0): return func(arr, kw=kw)[0]
+  
+  def func2(arr, kw=0, axis=0, scale=None): return func(arr*scale[0], kw=kw)[0] # scale is a shared array
    
   def nolaax(arr, axis=0, kw=0):
     shape = arr.shape[:-1]+(1,)
@@ -338,17 +382,18 @@ if __name__ == '__main__':
     std = np.std(arr,axis=axis).reshape(shape)
     return (arr - mean) / std -kw
   
-  def run_test(fct, kw=0, laax=True):
+  def run_test(fct, kw=0, laax=True, lshared=False, shared=None):
     ff = partial(fct, kw=kw)
     shape = (500,100)
     data = np.arange(np.prod(shape), dtype='float').reshape(shape)
     assert data.shape == shape
     # parallel implementation using my wrapper
-    pres = apply_along_axis(ff, axis, data, NP=2, ldebug=True, laax=laax)
+    pres = apply_along_axis(ff, axis, data, NP=2, ldebug=True, laax=laax, lshared=lshared, shared=shared)
     print pres.shape
     assert pres.shape == data.shape
     assert isZero(pres.mean(axis=axis)+kw) and isZero(pres.std(axis=axis)-1.)
     # straight-forward numpy version
+    if shared: ff = partial(ff, **shared)
     res = np.apply_along_axis(ff, axis, data)
     assert res.shape == data.shape
     assert isZero(res.mean(axis=axis)+kw) and isZero(res.std(axis=axis)-1.)
@@ -358,6 +403,9 @@ if __name__ == '__main__':
   # run tests 
   run_test(nolaax, kw=1, laax=False) # without Numpy's apply_along_axis
   run_test(func1, kw=1, laax=True) # Numpy's apply_along_axis
+  run_test(func1, kw=1, laax=True, lshared=True) # data in shared memory
+  run_test(func2, kw=1, laax=True, shared=dict(scale=np.arange(1,4.))) # shared keyword arrays
+  run_test(func2, kw=1, laax=True, lshared=True, shared=dict(scale=np.arange(1,4.))) # both
   
   #print logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL
     
@@ -14,6 +14,8 @@ import numpy as np
 import numpy.ma as ma
 import functools
 import gc
+import threading
+import Queue
 from osgeo import gdal, osr
 # internal imports
 from geodata.misc import VariableError, AxisError, PermissionError, DatasetError, GDALError, ArgumentError #, DateError
@@ -31,6 +33,59 @@ class ProcessError(Exception):
   ''' Error class for exceptions occurring in methods of the CPU (CentralProcessingUnit). '''
   pass
 
+class PrefetchReader(threading.Thread):
+  ''' 
+    A background thread that loads source variables ahead of processing; loaded variables are handed over 
+    through a bounded queue, so that at most 'maxsize' prefetched variables are held in memory. 
+    All I/O is performed while holding 'lock', which has to be shared with the consumer thread.
+  '''
+  
+  def __init__(self, dataset, varlist, maxsize=1, lock=None):
+    ''' Save source dataset and list of variables to prefetch (in processing order). '''
+    super(PrefetchReader,self).__init__(name='PrefetchReader')
+    self.daemon = True # don't block interpreter exit
+    self.dataset = dataset
+    self.varlist = list(varlist)
+    self.queue = Queue.Queue(maxsize=max(1,maxsize))
+    self.stopped = threading.Event()
+    self.lock = threading.Lock() if lock is None else lock
+    
+  def run(self):
+    ''' Load variables in order and put them in the queue; errors are passed on to the main thread. '''
+    for varname in self.varlist:
+      if self.stopped.is_set(): break
+      var = self.dataset.variables[varname]
+      ldata = var.data # whether data was already loaded
+      try: 
+        with self.lock: var.load()
+        error = None
+      except Exception as error: pass # re-raised in main thread
+      # N.B.: the queue blocks until there is room, which caps memory usage
+      lqueued = False
+      while not self.stopped.is_set():
+        try: self.queue.put((varname, ldata, error), timeout=0.1); lqueued = True; break
+        except Queue.Full: pass
+      if error is not None: break
+      if not lqueued and not ldata: 
+        with self.lock: var.unload() # stopped before hand-over: release data again
+      
+  def get(self, varname):
+    ''' Wait for the next variable and return whether its data was loaded before prefetching. '''
+    name, ldata, error = self.queue.get()
+    if error is not None: raise error
+    if name != varname: raise ProcessError, "Prefetch out of order: expected '{:s}', got '{:s}'.".format(varname,name)
+    return ldata
+  
+  def stop(self):
+    ''' Stop prefetching and unload queued variables that were not loaded before. '''
+    self.stopped.set()
+    self.join() # N.B.: the thread can not block on a full queue after 'stopped' is set
+    while not self.queue.empty(): 
+      varname, ldata, error = self.queue.get()
+      if error is None and not ldata: 
+        with self.lock: self.dataset.variables[varname].unload()
+    
+
 class CentralProcessingUnit(object):
   
   def __init__(self, source, target=None, varlist=None, ignorelist=None, tmp=True, feedback=True):
@@ -120,8 +175,10 @@ class CentralProcessingUnit(object):
     if close: output.close()
     else: return output
 
-  def process(self, function, flush=False):
-    ''' This method applies the desired operation/function to each variable in varlist. '''
+  def process(self, function, flush=False, prefetch=0):
+    ''' This method applies the desired operation/function to each variable in varlist; if prefetch > 0, 
+        source variables are loaded in a background thread, while the previous one is being processed 
+        (up to 'prefetch' variables are queued in memory). '''
     if flush: # this function is to save RAM by flushing results to disk immediately
       if not isinstance(self.output,DatasetNetCDF):
         raise ProcessError, "Flush can only be used with NetCDF Datasets (and not with temporary storage)."
@@ -131,31 +188,58 @@ class CentralProcessingUnit(object):
         self.source = self.tmpput
         self.target = self.output
         self.tmp = False # not using temporary storage anymore
+    # N.B.: the netCDF/HDF5 library is not thread-safe, hence all I/O in the loop below is serialized 
+    #       with the prefetch reader through an explicit lock; only the processing of loaded data overlaps
+    lock = threading.Lock() # uncontended without prefetching
+    # start background reader for source variables
+    if prefetch:
+      # N.B.: the prefetch list has to reproduce the branching below, because the target changes in the loop
+      srclist = []; tgtset = set()
+      for varname in self.varlist:
+        if varname in self.ignorelist: pass
+        elif varname in tgtset or self.target.hasVariable(varname): pass
+        elif self.source.hasVariable(varname): srclist.append(varname)
+        tgtset.add(varname)
+      reader = PrefetchReader(self.source, srclist, maxsize=prefetch, lock=lock)
+      reader.start()
+    else: reader = None
     # loop over input variables
-    for varname in self.varlist:
-      # check agaisnt ignore list
-      if varname not in self.ignorelist: 
-        # check if variable already exists
-        if self.target.hasVariable(varname):
-          # "in-place" operations
-          var = self.target.variables[varname]         
-          newvar = function(var) # perform actual processing
-          if newvar.ndim != var.ndim or newvar.shape != var.shape: raise VariableError
-          if newvar is not var: self.target.replaceVariable(var,newvar)
-        elif self.source.hasVariable(varname):        
-          var = self.source.variables[varname]
-          ldata = var.data # whether data was pre-loaded 
-          # perform operation from source and copy results to target
-          newvar = function(var) # perform actual processing
-          if not ldata: var.unload() # if it was already loaded, don't unload        
-          self.target.addVariable(newvar, copy=True) # copy=True allows recasting as, e.g., a NC variable
-        else:
-          raise DatasetError, "Variable '%s' not found in input dataset."%varname
-        assert varname == newvar.name
-        # flush data to disk immediately      
-        if flush: 
-          self.output.variables[varname].unload() # again, free memory
-        newvar.unload(); del var, newvar # free space; already added to new dataset
+    try:
+      for varname in self.varlist:
+        # check agaisnt ignore list
+        if varname not in self.ignorelist: 
+          # check if variable already exists
+          if self.target.hasVariable(varname):
+            # "in-place" operations
+            var = self.target.variables[varname]         
+            with lock: newvar = function(var) # perform actual processing (may read from the target)
+            if newvar.ndim != var.ndim or newvar.shape != var.shape: raise VariableError
+            if newvar is not var: 
+              with lock: self.target.replaceVariable(var,newvar)
+          elif self.source.hasVariable(varname):        
+            var = self.source.variables[varname]
+            if reader is None: ldata = var.data # whether data was pre-loaded
+            else: ldata = reader.get(varname) # wait for prefetched data 
+            # perform operation from source and copy results to target
+            try: newvar = function(var) # perform actual processing
+            except:
+              if not ldata: 
+                with lock: var.unload() # release (prefetched) data before passing on the error
+              raise
+            with lock:
+              if not ldata: var.unload() # if it was already loaded, don't unload        
+              self.target.addVariable(newvar, copy=True) # copy=True allows recasting as, e.g., a NC variable
+          else:
+            raise DatasetError, "Variable '%s' not found in input dataset."%varname
+          assert varname == newvar.name
+          # flush data to disk immediately      
+          with lock:
+            if flush: 
+              self.output.variables[varname].unload() # again, free memory
+            newvar.unload()
+          del var, newvar # free space; already added to new dataset
+    finally:
+      if reader is not None: reader.stop()
     # after everything is said and done:
     self.source = self.target # set target to source for next time
     
@@ -270,7 +354,7 @@ class CentralProcessingUnit(object):
                                  shpax=shpax, memory=memory) # already set parameters
     # start process
     if self.feedback: print('\n   +++   processing shape/area averaging   +++   ') 
-    self.process(function, **kwargs) # currently 'flush' is the only kwarg
+    self.process(function, **kwargs) # currently 'flush' and 'prefetch' are the only kwargs
     if self.feedback: print('\n')
     if self.tmp: self.tmpput = self.target
     if ltmptoo: assert self.tmpput.name == 'tmptoo' # set above, when temp. dataset is created    
@@ -416,9 +500,10 @@ class CentralProcessingUnit(object):
       if src.zs.axisIndex(xlon.name) == 0: zs.transpose() # assuming lat,lon or y,x order is more common
       ye,xe = zs.shape # assuming order lat,lon or y,x
       xe -= 1; ye -= 1 # last valid index, not length
-      for n,lon,lat in zip(xrange(len(stnax)),lons,lats):
-        ip = xlon.getIndex(lon, mode='left', outOfBounds=True)
-        jp = ylat.getIndex(lat, mode='left', outOfBounds=True)
+      # N.B.: indices of all stations are computed at once (out-of-bounds values are masked, i.e. None)
+      ips = xlon.getIndex(lons, mode='left', outOfBounds=True).tolist()
+      jps = ylat.getIndex(lats, mode='left', outOfBounds=True).tolist()
+      for n,ip,jp in zip(xrange(len(stnax)),ips,jps):
         if ip is not None and jp is not None:
           # find neighboring point with smallest altitude error 
 #           ip = im+1 if im < xe else im  
@@ -435,9 +520,9 @@ class CentralProcessingUnit(object):
           ixlon.append(ii); iylat.append(jj); istn.append(n); zs_err.append(zerr) # final selection          
     else: 
       # just choose horizontally closest point 
-      for n,lon,lat in zip(xrange(len(stnax)),lons,lats):
-        i = xlon.getIndex(lon, mode='closest', outOfBounds=True)
-        j = ylat.getIndex(lat, mode='closest', outOfBounds=True)
+      ixs = xlon.getIndex(lons, mode='closest', outOfBounds=True).tolist()
+      iys = ylat.getIndex(lats, mode='closest', outOfBounds=True).tolist()
+      for n,i,j in zip(xrange(len(stnax)),ixs,iys):
         if i is not None and j is not None: 
           if lzs: # compute elevation error
             zs_err.append(zs[j,i]-stn_zs[n])          
@@ -476,7 +561,7 @@ class CentralProcessingUnit(object):
     function = functools.partial(self.processExtract, ixlon=ixlon, iylat=iylat, ylat=ylat, xlon=xlon, stnax=stnax) # already set parameters
     # start process
     if self.feedback: print('\n   +++   processing point-data extraction   +++   ') 
-    self.process(function, **kwargs) # currently 'flush' is the only kwarg
+    self.process(function, **kwargs) # currently 'flush' and 'prefetch' are the only kwargs
     if self.feedback: print('\n')
     if self.tmp: self.tmpput = self.target
     if ltmptoo: assert self.tmpput.name == 'tmptoo' # set above, when temp. dataset is created    
@@ -594,7 +679,7 @@ class CentralProcessingUnit(object):
                                  lmask=lmask, int_interp=int_interp, float_interp=float_interp)
     # start process
     if self.feedback: print('\n   +++   processing regridding   +++   ') 
-    self.process(function, **kwargs) # currently 'flush' is the only kwarg
+    self.process(function, **kwargs) # currently 'flush' and 'prefetch' are the only kwargs
     # now make sure we have a GDAL dataset!
     self.target = addGDALtoDataset(self.target, griddef=griddef)
     if self.feedback: print('\n')
@@ -676,7 +761,7 @@ class CentralProcessingUnit(object):
     if self.feedback: print('\n   +++   processing climatology   +++   ')     
     if self.source.gdal: griddef = self.source.griddef
     else: griddef = None 
-    self.process(function, **kwargs) # currently 'flush' is the only kwarg    
+    self.process(function, **kwargs) # currently 'flush' and 'prefetch' are the only kwargs    
     # add GDAL to target
     if griddef is not None:
       self.target = addGDALtoDataset(self.target, griddef=griddef)
@@ -782,7 +867,7 @@ class CentralProcessingUnit(object):
                                  shift=shift, axis=axis)
     # start process
     if self.feedback: print('\n   +++   processing shift/roll   +++   ')     
-    self.process(function, **kwargs) # currently 'flush' is the only kwarg    
+    self.process(function, **kwargs) # currently 'flush' and 'prefetch' are the only kwargs    
     if self.feedback: print('\n')
   # the previous method sets up the process, the next method performs the computation
   def processShift(self, var, shift=None, axis=None):
@@ -407,9 +407,35 @@ def PCA(data, degree=None, lprewhiten=False, lpostwhiten=False, lEOF=False, lfee
   else: return pca, eig  
 
 # histogram wrapper that suppresses additional output
-def histogram(a, bins=10, range=None, weights=None, density=None): 
-  ''' histogram wrapper that suppresses bin edge output, but is otherwise the same '''
-  return np.histogram(a, bins=bins, range=range, weights=weights, density=density)[0]
+def histogram(a, bins=10, range=None, weights=None, density=None, axis=None):
+  ''' histogram wrapper that suppresses bin edge output, but is otherwise the same; if an axis is given,
+      histograms of all slices along that axis are computed at once (vectorized) and returned along the
+      last axis (bins have to be bin edges, which need not be uniform, and weights are not supported) '''
+  if axis is None:
+    return np.histogram(a, bins=bins, range=range, weights=weights, density=density)[0]
+  # vectorized version
+  if weights is not None: raise NotImplementedError, "Weights are not supported with axis."
+  binedgs = np.asarray(bins)
+  if binedgs.ndim != 1 or len(binedgs) < 2: raise ArgumentError, "Bin edges are required with axis."
+  if np.any(np.diff(binedgs) < 0): raise ValueError, "Bin edges must increase monotonically."
+  if range is not None: raise NotImplementedError, "A range can not be used with bin edges."
+  nbins = len(binedgs) - 1
+  a = np.asarray(a)
+  if axis < 0: axis += a.ndim
+  a = np.rollaxis(a, axis=axis, start=a.ndim)
+  oshape = a.shape[:-1]; m = int(np.prod(oshape))
+  a = a.reshape((m,a.shape[-1]))
+  # find bins (left-closed intervals, except for the last bin, like np.histogram; NaN's are out of bounds)
+  idx = np.searchsorted(binedgs, a, side='right') - 1
+  idx[a == binedgs[-1]] = nbins - 1 # last bin is closed on the right
+  valid = ( idx >= 0 ) & ( idx < nbins )
+  # add offsets for every slice, so that all histograms can be counted with a single bincount
+  idx += np.arange(m, dtype=idx.dtype).reshape((m,1)) * nbins
+  hist = np.bincount(idx[valid], minlength=m*nbins).reshape((m,nbins)).astype(np.intp, copy=False)
+  if density: # same normalization as np.histogram
+    db = np.array(np.diff(binedgs), float)
+    hist = hist / db / hist.sum(axis=1, keepdims=True)
+  return hist.reshape(oshape+(nbins,))
 
 # percentile wrapper that casts the output into a single array
 def percentile(a, q, axis=None, interpolation='linear', keepdims=False): 
@@ -419,6 +445,123 @@ def percentile(a, q, axis=None, interpolation='linear', keepdims=False):
   parr = np.rollaxis(parr, axis=0, start=parr.ndim) # move percentile axis to the back
   return parr
 
+# vectorized percentile function that ignores NaN's and masked values
+def nanpercentile(a, q, axis=None, lsort=None):
+  ''' percentile function based on np.partition that ignores NaN's and masked values; all slices are processed
+      at once and the valid values are counted for each slice, so that only the ranks that are actually required
+      have to be partitioned (unless there are too many, then the array is sorted); slices without valid values
+      return NaN and percentiles are returned along the last axis (like percentile) '''
+  # N.B.: the linear interpolation is the same as in np.percentile, so that results are identical without NaN's
+  if isinstance(a,np.ma.MaskedArray):
+    a = a.filled(np.NaN) if a.dtype.kind == 'f' else a.astype(np.float64).filled(np.NaN)
+  else: a = np.asarray(a)
+  if axis is None: a = a.ravel(); axis = 0
+  elif axis < 0: axis += a.ndim
+  # move axis to the back and collapse the remaining axes (the partition makes a copy anyway)
+  a = np.rollaxis(a, axis=axis, start=a.ndim)
+  oshape = a.shape[:-1]; n = a.shape[-1]
+  a = a.reshape((-1,n)); m = a.shape[0]
+  lscalar = np.isscalar(q)
+  q = np.asarray(q, dtype=np.float64).ravel()
+  if np.any(q < 0) or np.any(q > 100): raise ValueError, "Percentiles must be in the range [0,100]."
+  # count valid values (N.B.: NaN's are sorted to the end by np.partition and np.sort)
+  if a.dtype.kind in ('f','c'): counts = n - np.isnan(a).sum(axis=-1)
+  else: counts = np.empty((m,), dtype=np.int64); counts.fill(n)
+  lvalid = counts > 0
+  # ranks, indices and weights for linear interpolation (slices x percentiles)
+  ranks = q.reshape((1,-1)) / 100. * np.maximum(counts-1,0).reshape((-1,1))
+  below = np.floor(ranks).astype(np.intp)
+  above = np.minimum(below+1, np.maximum(counts-1,0).reshape((-1,1)))
+  weights_above = ranks - below
+  weights_below = 1. - weights_above
+  # partition only at required ranks, unless they are too many (partitioning is O(n) per rank)
+  kth = np.union1d(below[lvalid].ravel(), above[lvalid].ravel())
+  if lsort is None: lsort = len(kth) > np.log2(max(n,2))
+  if len(kth) == 0: part = a # nothing to do...
+  elif lsort: part = np.sort(a, axis=-1)
+  else: part = np.partition(a, kth, axis=-1)
+  # extract values and interpolate
+  rows = np.arange(m).reshape((-1,1))
+  parr = part[rows,below] * weights_below + part[rows,above] * weights_above
+  if not np.all(lvalid):
+    if parr.dtype.kind not in ('f','c'): parr = parr.astype(np.float64)
+    parr[~lvalid,:] = np.NaN
+  # restore shape (percentile axis at the back)
+  if lscalar: parr = parr.reshape(oshape)
+  else: parr = parr.reshape(oshape+(len(q),))
+  return parr
+
+# streaming approximate percentiles
+class QuantileSketch(object):
+  ''' A streaming approximation of percentiles based on fixed-bin histograms (one per slice): data are added in
+      blocks (samples along the first axis), and percentiles are interpolated within bins, so that the error is
+      bounded by the bin width (vmax-vmin)/nbins; NaN's are ignored. The range of values has to be known in
+      advance (e.g. from a first pass over the data). The memory footprint is one count per bin and slice. '''
+
+  def __init__(self, vmin, vmax, nbins=256):
+    ''' initialize histograms for all slices; vmin and vmax can be scalars or arrays with the shape of a slice '''
+    vmin = np.asarray(vmin, dtype=np.float64); vmax = np.asarray(vmax, dtype=np.float64)
+    self.shape = np.broadcast(vmin, vmax).shape
+    self.vmin = np.array(np.broadcast_to(vmin, self.shape)).ravel()
+    self.vmax = np.array(np.broadcast_to(vmax, self.shape)).ravel()
+    invalid = ~np.isfinite(self.vmin) | ~np.isfinite(self.vmax) # e.g. slices without valid values
+    self.vmin[invalid] = 0.; self.vmax[invalid] = 0.
+    self.nbins = nbins
+    self.width = ( self.vmax - self.vmin ) / nbins
+    self.counts = np.zeros((self.vmin.size,nbins), dtype=np.int64)
+
+  @property
+  def error(self):
+    ''' upper bound for the absolute error of the percentiles (the bin width) '''
+    return self.width.reshape(self.shape)
+
+  def update(self, block):
+    ''' add a block of samples to the histograms (samples along the first axis) '''
+    block = np.asanyarray(block)
+    if isinstance(block,np.ma.MaskedArray): block = block.astype(np.float64).filled(np.NaN)
+    if block.shape[1:] != self.shape: raise AxisError, "Block shape {} does not match sketch shape {}.".format(block.shape,self.shape)
+    block = block.reshape((block.shape[0],-1))
+    valid = ~np.isnan(block) if block.dtype.kind in ('f','c') else np.ones(block.shape, dtype=np.bool)
+    # compute bin indices and add offsets for slices, so that a single bincount is sufficient
+    width = np.where(self.width > 0, self.width, 1.)
+    vmin = np.broadcast_to(self.vmin, block.shape)[valid]
+    width = np.broadcast_to(width, block.shape)[valid]
+    idx = np.floor( ( block[valid] - vmin ) / width ).astype(np.intp)
+    np.clip(idx, 0, self.nbins-1, out=idx)
+    idx += np.broadcast_to(np.arange(self.counts.shape[0])*self.nbins, block.shape)[valid]
+    self.counts += np.bincount(idx, minlength=self.counts.size).reshape(self.counts.shape)
+    return self
+
+  def _rankValues(self, ranks):
+    ''' estimate the values of given ranks (slices x ranks) by interpolation within bins '''
+    cdf = np.cumsum(self.counts, axis=1)
+    ns, nbins = cdf.shape; offset = cdf[:,-1].max() + 1
+    # find bins by searching a single monotonic array (each slice is offset)
+    offsets = np.arange(ns).reshape((-1,1)) * offset
+    bins = np.searchsorted((cdf + offsets).ravel(), (ranks + offsets).ravel(), side='right')
+    bins = bins.reshape(ranks.shape) - np.arange(ns).reshape((-1,1)) * nbins
+    np.clip(bins, 0, nbins-1, out=bins)
+    rows = np.arange(ns).reshape((-1,1))
+    cnt = self.counts[rows,bins]; prev = cdf[rows,bins] - cnt
+    frac = ( ranks - prev + 0.5 ) / np.maximum(cnt,1)
+    np.clip(frac, 0., 1., out=frac)
+    return self.vmin.reshape((-1,1)) + ( bins + frac ) * self.width.reshape((-1,1))
+
+  def percentile(self, q):
+    ''' return approximate percentiles (linear interpolation between ranks, like np.percentile) '''
+    lscalar = np.isscalar(q)
+    q = np.asarray(q, dtype=np.float64).ravel()
+    if np.any(q < 0) or np.any(q > 100): raise ValueError, "Percentiles must be in the range [0,100]."
+    counts = self.counts.sum(axis=1).reshape((-1,1))
+    ranks = q.reshape((1,-1)) / 100. * np.maximum(counts-1,0)
+    below = np.floor(ranks); above = np.minimum(below+1, np.maximum(counts-1,0))
+    weights_above = ranks - below
+    # N.B.: each rank is estimated separately, so that the error bound also holds across empty bins
+    parr = self._rankValues(below) * (1. - weights_above) + self._rankValues(above) * weights_above
+    parr[counts.ravel() == 0,:] = np.NaN
+    if lscalar: return parr.reshape(self.shape)
+    else: return parr.reshape(self.shape+(len(q),))
+
 # function to subtract the mean and divide by the standard deviation, i.e. standardize
 def standardize(var, axis=None, lcopy=True, **kwargs):
   ''' subtract mean, divide by standard deviation, and optionally smooth time series; key word arguments are passed on to smoothing function '''
@@ -429,31 +572,124 @@ def standardize(var, axis=None, lcopy=True, **kwargs):
   var /= var.std(axis=axis, keepdims=True)
   return var
 
+# batched least-squares polynomial fit
+def polyfit(x, y, axis=-1, degree=1, rcond=None, w=None):
+  ''' fit polynomials to all series along an axis of an array at once (same as np.polyfit for each series);
+      invalid values (NaN or masked) are ignored and series with too few valid values return NaN; the 
+      coefficients (highest power first) replace the fit axis in the output array '''
+  x = np.asarray(x, dtype=np.float64); order = degree + 1
+  if x.ndim != 1 or len(x) != y.shape[axis]: raise AxisError, "Coordinates and array are not compatible."
+  valid = ~np.ma.getmaskarray(y) if isinstance(y,np.ma.MaskedArray) else None
+  y = np.moveaxis(np.asarray(np.ma.getdata(y), dtype=np.float64), axis, -1)
+  shape = y.shape[:-1]; y = y.reshape((-1,len(x)))
+  if valid is None: valid = np.isfinite(y)
+  else: valid = np.moveaxis(valid, axis, -1).reshape(y.shape) & np.isfinite(y)
+  # scaled Vandermonde matrix and right hand side (as in np.polyfit)
+  lhs = np.vander(x, order)
+  rhs = np.where(valid, y, 0.)
+  if w is not None:
+    w = np.asarray(w, dtype=np.float64)
+    lhs *= w[:,np.newaxis]; rhs *= w
+  scale = np.sqrt((lhs*lhs).sum(axis=0))
+  lhs /= scale
+  if rcond is None: rcond = len(x)*np.finfo(x.dtype).eps
+  coef = np.empty((len(y),order), dtype=np.float64); coef.fill(np.nan)
+  nvalid = valid.sum(axis=1)
+  # complete series: a single least-squares problem with many right hand sides
+  lall = nvalid == len(x)
+  if np.any(lall): coef[lall,:] = np.linalg.lstsq(lhs, rhs[lall,:].T, rcond)[0].T
+  # incomplete series: solve normal equations with valid values only (stacked)
+  lpart = ~lall & ( nvalid >= order )
+  if np.any(lpart):
+    outer = ( lhs[:,:,np.newaxis] * lhs[:,np.newaxis,:] ).reshape((len(x),order*order))
+    lhsp = np.dot(valid[lpart,:].astype(np.float64), outer).reshape((-1,order,order))
+    rhsp = np.dot(rhs[lpart,:], lhs)
+    coef[lpart,:] = np.linalg.solve(lhsp, rhsp[:,:,np.newaxis])[:,:,0]
+  coef /= scale
+  return np.moveaxis(coef.reshape(shape+(order,)), -1, axis)
+
+# batched polynomial evaluation
+def polyval(p, x, axis=-1):
+  ''' evaluate polynomials with coefficients along an axis (see polyfit) at coordinates x, which replace 
+      the coefficient axis in the output array (same as np.polyval for each set of coefficients) '''
+  x = np.asarray(x); p = np.moveaxis(p, axis, 0)
+  x = x.reshape(x.shape+(1,)*(p.ndim-1)) # broadcast over remaining dimensions
+  val = np.zeros(x.shape[:1]+p.shape[1:], dtype=np.result_type(p,x))
+  for c in p: val = val*x + c # Horner's scheme, as in np.polyval
+  return np.moveaxis(val, 0, axis)
+
+# function to remove the seasonal cycle
+def monthlyAnomalies(var, axis=0, months=None, lstandardize=False):
+  ''' subtract the mean of each calendar month along an axis (in-place) and optionally divide by the standard 
+      deviation; months is the calendar month index (0 = January) of each element along the axis '''
+  if months is None: months = np.arange(var.shape[axis]) % 12
+  elif len(months) != var.shape[axis]: raise AxisError, "Month index and array are not compatible."
+  months = np.asarray(months) % 12
+  lma = isinstance(var,np.ma.MaskedArray)
+  mean = np.ma.mean if lma else np.nanmean
+  std = np.ma.std if lma else np.nanstd
+  slc = [slice(None)]*var.ndim
+  for month in np.unique(months):
+    slc[axis] = np.where(months == month)[0]
+    tmp = var[tuple(slc)]
+    tmp -= mean(tmp, axis=axis, keepdims=True)
+    if lstandardize: tmp /= std(tmp, axis=axis, keepdims=True)
+    var[tuple(slc)] = tmp
+  return var
+
+# batched version of utils.signalsmooth.smooth
+def smoothAlongAxis(var, axis=-1, window_len=11, window='hanning'):
+  ''' smooth all series along an axis at once (same reflection and window convolution as smooth) '''
+  n = var.shape[axis]
+  if n < window_len: raise ValueError, "Input vector needs to be bigger than window size."
+  if window_len < 3: return var
+  if not window in ['flat', 'hanning', 'hamming', 'bartlett', 'blackman']:
+    raise ValueError, "Window is on of 'flat', 'hanning', 'hamming', 'bartlett', 'blackman'"
+  mask = np.ma.getmask(var)
+  x = np.moveaxis(np.ma.getdata(var), axis, -1)
+  # reflect series at both ends
+  s = np.concatenate([2*x[...,:1]-x[...,window_len:1:-1], x, 2*x[...,-1:]-x[...,-1:-window_len:-1]], axis=-1)
+  wnd = np.ones(window_len,'d') if window == 'flat' else getattr(np, window)(window_len)
+  wnd /= wnd.sum()
+  o = (window_len-1)//2 # offset of convolution output
+  y = np.zeros(x.shape, dtype=np.result_type(x,wnd))
+  for k,wk in enumerate(wnd): y += wk*s[...,o+k:o+k+n]
+  y = np.moveaxis(y, -1, axis)
+  if mask is not np.ma.nomask: y = np.ma.array(y, mask=mask)
+  return y
+
 # function to detrend a time-series
 def detrend(var, ax=None, lcopy=True, ldetrend=True, ltrend=False, degree=1, rcond=None, w=None,  
-            lsmooth=False, lresidual=False, window_len=11, window='hanning'): 
-  ''' subtract a linear trend from a time-series array (operation is in-place) '''
+            lsmooth=False, lresidual=False, window_len=11, window='hanning', axis=None, lmonthly=False): 
+  ''' subtract a linear trend from a time-series array (operation is in-place); if axis is given, all series
+      along axis are detrended at once, otherwise the flattened array is used; invalid values (NaN or masked)
+      are ignored in the fit and lmonthly subtracts the calendar-month mean first (ax is in months) '''
   # check input
   if not isinstance(var,np.ndarray): raise NotImplementedError # too many checks
+  if ldetrend and ltrend: raise ArgumentError, "Can either return trend/polyfit or residuals, not both."
+  if lsmooth and lresidual: raise ArgumentError, "Can either return smoothed array or residuals, not both."
   if lcopy: var = var.copy() # make copy - not in-place!
-  # fit over entire array (usually not what we want...)
-  if ax is None and ldetrend: ax = np.arange(var.size) # make dummy axis, if necessary
-  if var.ndim != 1:
-    shape = var.shape 
-    var = var.ravel() # flatten array, if necessary
+  if axis is None:
+    # fit over entire array (usually not what we want...)
+    if var.ndim != 1:
+      shape = var.shape 
+      var = var.ravel() # flatten array, if necessary
+    else: shape = None
+    axis = 0
   else: shape = None
+  if ax is None: ax = np.arange(var.shape[axis]) # make dummy axis, if necessary
+  # remove seasonal cycle
+  if lmonthly: var = monthlyAnomalies(var, axis=axis, months=np.round(ax).astype(np.int64))
   # apply optional detrending
   if ldetrend or ltrend:
-    # fit linear trend
-    trend = np.polyfit(ax, var, deg=degree, rcond=rcond, w=w, full=False, cov=False)
-    # evaluate and subtract linear trend
-    if ldetrend and ltrend: raise ArgumentError, "Can either return trend/polyfit or residuals, not both."
-    elif ldetrend and not ltrend: var -= np.polyval(trend, ax) # residuals
-    elif ltrend and not ldetrend: var = np.polyval(trend, ax) # residuals
+    # fit polynomial trend and evaluate
+    trend = polyval(polyfit(ax, var, axis=axis, degree=degree, rcond=rcond, w=w), ax, axis=axis)
+    if ldetrend: var -= trend # residuals
+    elif isinstance(var,np.ma.MaskedArray): var = np.ma.array(trend, mask=np.ma.getmask(var))
+    else: var = trend
   # apply optional smoothing
-  if lsmooth and lresidual: raise ArgumentError, "Can either return smoothed array or residuals, not both."
-  elif lsmooth: var = smooth(var, window_len=window_len, window=window)  
-  elif lresidual: var -= smooth(var, window_len=window_len, window=window)
+  if lsmooth: var = smoothAlongAxis(var, axis=axis, window_len=window_len, window=window)  
+  elif lresidual: var -= smoothAlongAxis(var, axis=axis, window_len=window_len, window=window)
   # return detrended and/or smoothed time-series
   if shape is not None: var = var.reshape(shape)
   return var
@@ -12,6 +12,7 @@ Functions
 - `nanmean` -- mean of non-NaN values
 - `nanvar` -- variance of non-NaN values
 - `nanstd` -- standard deviation of non-NaN values
+- `nanstats` -- several of the above statistics in a single pass
 
 """
 from __future__ import division, absolute_import, print_function
@@ -22,7 +23,7 @@ import numpy as np
 
 __all__ = [
     'nansum', 'nanmax', 'nanmin', 'nanargmax', 'nanargmin', 'nanmean',
-    'nanvar', 'nanstd'
+    'nanvar', 'nanstd', 'nanstats'
     ]
 
 
@@ -1015,3 +1016,112 @@ def nansem(a, axis=None, dtype=None, out=None, ddof=0, keepdims=False):
       sem = sem.reshape(shape)
 
     return sem
+
+
+# statistics supported by nanstats
+stats_list = ('mean', 'sum', 'var', 'std', 'sem', 'min', 'max')
+
+def nanstats(a, stats=('mean',), axis=None, dtype=None, ddof=0):
+    """
+    Compute several statistics along the specified axis in a single pass,
+    while ignoring NaNs and masked values.
+
+    The NaN mask, the counts, the sums and the squared deviations are
+    computed once and shared between all statistics, so that this is
+    considerably faster than calling the individual functions.
+
+    Parameters
+    ----------
+    a : array_like
+        Array containing numbers; masked arrays are supported.
+    stats : sequence of str
+        Statistics to compute; any of 'mean', 'sum', 'var', 'std', 'sem',
+        'min' and 'max'.
+    axis : int, optional
+        Axis along which the statistics are computed. The default is to
+        compute the statistics of the flattened array.
+    dtype : dtype, optional
+        Type used in the computation. For arrays of integer type the
+        default is float64, for arrays of float types it is the same as
+        the array type.
+    ddof : int, optional
+        Delta Degrees of Freedom for 'var', 'std' and 'sem' (see nanvar).
+
+    Returns
+    -------
+    results : list of ndarrays
+        One array for each statistic, in the order of `stats`. All-NaN
+        slices are NaN (like in nansum); if `a` is a masked array, the
+        results are masked arrays, where all-masked slices are masked.
+
+    See Also
+    --------
+    nanmean, nansum, nanvar, nanstd, nansem, nanmin, nanmax
+
+    """
+    stats = tuple(stats)
+    for stat in stats:
+        if stat not in stats_list:
+            raise ValueError("Unknown statistic: '{:s}'".format(stat))
+    lma = isinstance(a, np.ma.MaskedArray)
+    a = np.asanyarray(a)
+    if dtype is None:
+        dtype = a.dtype if issubclass(a.dtype.type, np.inexact) else np.dtype(np.float_)
+    # a working copy is required, since values are replaced in-place
+    if lma:
+        arr = a.filled(0).astype(dtype)
+        mask = np.isnan(arr)
+        np.logical_or(mask, np.ma.getmaskarray(a), out=mask)
+    else:
+        arr = np.array(a, dtype=dtype)
+        mask = np.isnan(arr)
+    if axis is None:
+        arr = arr.ravel(); mask = mask.ravel(); axis = 0
+    lmask = mask.any()
+
+    results = dict()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+
+        # counts and sums are needed by most statistics
+        if lmask:
+            np.copyto(arr, 0, where=mask)
+            cnt = np.sum(~mask, axis=axis, dtype=np.intp, keepdims=True)
+        else:
+            cnt = np.intp(arr.shape[axis])
+        tot = np.sum(arr, axis=axis, keepdims=True)
+        avg = _divide_by_count(tot.copy(), cnt)
+        results['sum'] = _copyto(tot, np.nan, cnt == 0)
+        results['mean'] = avg
+        # extrema: replace NaNs with neutral values
+        if 'min' in stats:
+            if lmask:
+                np.copyto(arr, np.inf, where=mask)
+            results['min'] = _copyto(np.min(arr, axis=axis, keepdims=True), np.nan, cnt == 0)
+        if 'max' in stats:
+            if lmask:
+                np.copyto(arr, -np.inf, where=mask)
+            results['max'] = _copyto(np.max(arr, axis=axis, keepdims=True), np.nan, cnt == 0)
+        # sum of square errors (SSE) for variance and derived statistics
+        if 'var' in stats or 'std' in stats or 'sem' in stats:
+            arr -= avg
+            if lmask:
+                np.copyto(arr, 0, where=mask)
+            sse = np.sum(np.multiply(arr, arr, out=arr), axis=axis, keepdims=True)
+            dof = cnt - ddof
+            isbad = dof <= 0
+            if 'var' in stats:
+                results['var'] = _copyto(_divide_by_count(sse.copy(), dof), np.nan, isbad)
+            if 'std' in stats:
+                results['std'] = _copyto(np.sqrt(_divide_by_count(sse.copy(), dof)), np.nan, isbad)
+            if 'sem' in stats:
+                results['sem'] = _copyto(_divide_by_count(np.sqrt(sse), dof), np.nan, isbad)
+
+    # remove reduction axis and apply mask
+    retlist = []
+    for stat in stats:
+        res = results[stat].squeeze(axis=axis)
+        if lma:
+            res = np.ma.array(res, mask=(cnt == 0).squeeze(axis=axis) if lmask else False)
+        retlist.append(res)
+    return retlist
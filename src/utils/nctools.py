@@ -11,7 +11,8 @@ import numpy as np
 import numpy.ma as ma
 import collections as col
 from warnings import warn
-import os
+import os, glob, struct
+import threading, Queue
 # internal imports
 # N.B.: there should be no dependencies on this package, so that it can be imported independently
 
@@ -19,6 +20,8 @@ import os
 
 # NC4 compression options
 zlib_default = dict(zlib=True, complevel=1, shuffle=True) # my own default compression settings
+# default block size for streaming writes (in bytes)
+write_blocksize = 2**24 # 16 MB
 
 # data error class
 class NCDataError(Exception):
@@ -73,6 +76,84 @@ def coerceAtts(atts):
   return ncatts
 
 
+## streaming writes
+
+def iterBlocks(shape, itemsize, blocksize=None):
+  ''' Generate index tuples for hyperslabs of at most blocksize bytes (unless a single element is larger), 
+      in C-order: leading dimensions are iterated over and one dimension is split into chunks. '''
+  if blocksize is None: blocksize = write_blocksize
+  shape = tuple(shape); ndim = len(shape)
+  # find outermost dimension, where a single index fits into a block
+  k = 0; rowsize = itemsize*int(np.prod(shape[1:]))
+  while rowsize > blocksize and k < ndim-1:
+    k += 1; rowsize = itemsize*int(np.prod(shape[k+1:]))
+  nrows = max(1, blocksize//max(1,rowsize))
+  # N.B.: slices are used for leading dimensions, so that blocks retain all dimensions
+  for idx in np.ndindex(*shape[:k]):
+    lead = tuple(slice(i,i+1) for i in idx)
+    for i in xrange(0, shape[k], nrows):
+      yield lead + (slice(i,min(i+nrows,shape[k])),)
+
+def writeBlocks(ncvar, data, fillValue=None, dtype=None, blocksize=None, writer=None):
+  ''' Write an array to a NetCDF variable in hyperslab blocks; masked values (and NaN's) are filled and the dtype is 
+      converted blockwise, so that extra memory is bounded by the block size (if fillValue is None, masked 
+      blocks are filled by netCDF4). If a BlockWriter is passed, blocks are written in the background. '''
+  # N.B.: reading blocks from deferred expressions can also call the netCDF library, hence the lock
+  lock = writer.lock if writer is not None else threading.Lock() # uncontended without writer
+  if data.ndim == 0 or data.size == 0: 
+    with lock: ncvar[:] = data[...] # nothing to stream
+    return
+  if dtype is not None: dtype = np.dtype(dtype)
+  itemsize = max(data.dtype.itemsize, dtype.itemsize if dtype is not None else 0)
+  for slc in iterBlocks(data.shape, itemsize, blocksize=blocksize):
+    with lock: block = data[slc] # a view (or evaluated)
+    if fillValue is not None and isinstance(block,ma.MaskedArray): block = block.filled(fillValue)
+    elif fillValue is not None and block.dtype.kind == 'f' and fillValue == fillValue: # not NaN
+      # N.B.: missing values can also be stored as NaN in plain arrays (NaN storage mode of Variables)
+      nans = np.isnan(block)
+      if nans.any(): block = np.where(nans, fillValue, block).astype(block.dtype, copy=False)
+    if dtype is not None and block.dtype != dtype: block = block.astype(dtype)
+    if writer is None: ncvar[slc] = block
+    else: writer.put(ncvar, slc, block)
+
+class BlockWriter(threading.Thread):
+  ''' 
+    A background thread that writes hyperslab blocks to NetCDF variables; blocks are passed through a 
+    bounded queue, so that only a limited number of blocks are waiting in memory. 
+    N.B.: the netCDF library is not thread-safe, hence blocks are written while holding 'lock', and all 
+          other netCDF calls (including reads of source data) have to acquire the same lock.
+  '''
+  
+  def __init__(self, maxsize=2, lock=None):
+    ''' Create queue; the thread has to be started separately. '''
+    threading.Thread.__init__(self, name='BlockWriter')
+    self.daemon = True
+    self.queue = Queue.Queue(maxsize=maxsize)
+    self.lock = threading.Lock() if lock is None else lock
+    self.error = None
+    
+  def run(self):
+    ''' Write blocks until None is received; after an error, the queue is only drained. '''
+    while True:
+      item = self.queue.get()
+      if item is None: break
+      if self.error is None:
+        ncvar, slc, block = item
+        try: 
+          with self.lock: ncvar[slc] = block
+        except Exception as err: self.error = err
+        
+  def put(self, ncvar, slc, block):
+    ''' Queue a block for writing (blocks, if the queue is full). '''
+    if self.error is not None: raise self.error
+    self.queue.put((ncvar, slc, block))
+    
+  def close(self, lraise=True):
+    ''' Wait until all blocks are written and re-raise errors from the writer thread (if lraise=True). '''
+    self.queue.put(None); self.join()
+    if lraise and self.error is not None: raise self.error
+
+
 ## generic netcdf functions
 
 def add_strvar(dst, name, strlist, dim, atts=None):
@@ -125,81 +206,91 @@ def add_coord(dst, name, data=None, length=None, atts=None, dtype=None, zlib=Tru
                   zlib=zlib, fillValue=fillValue, **kwargs)  
   return coord
 
-def add_var(dst, name, dims, data=None, shape=None, atts=None, dtype=None, zlib=True, fillValue=None, **kwargs):
+def add_var(dst, name, dims, data=None, shape=None, atts=None, dtype=None, zlib=True, fillValue=None, 
+            blocksize=None, writer=None, **kwargs):
   ''' Function to add a Variable to a NetCDF Dataset; returns the Variable reference. '''
   # all remaining kwargs are passed on to dst.createVariable()
-  # use data array to infer dimensions and data type
-  if data is not None:
-    if not isinstance(data,np.ndarray): raise TypeError     
-    if len(dims) != data.ndim: raise NCDataError, "Number of dimensions in '%s' does not match data array."%(name,)    
-    if shape: 
-      if shape != data.shape: raise NCDataError, "Shape of '%s' does not match data array."%(name,)
-    else: shape = data.shape
-    # get dtype 
-    if dtype: 
-      if dtype != data.dtype: data = data.astype(dtype)
-        # raise NCDataError, "Data type in '%s' does not match data array."%(name,) 
-    else: dtype = data.dtype
-  if dtype is None: raise NCDataError, "Cannot construct a NetCDF Variable without a data array or an abstract data type."
-  dtype = np.dtype(dtype) # use numpy types
-  if dtype is np.dtype('bool_'): dtype = np.dtype('i1') # cast numpy bools as 8-bit integers
-  lstrvar = dtype.kind == 'S'
-  # check/create dimensions
-  if shape is None: shape = [None,]*len(dims)
-  else: shape = list(shape)
-  if len(shape) != len(dims): raise NCAxisError 
-  for i,dim in zip(xrange(len(dims)),dims):
-    if dim in dst.dimensions:
-      if shape[i] is None: 
-        shape[i] = len(dst.dimensions[dim])
+  # N.B.: data are written in blocks (see writeBlocks); masked values are filled with fillValue
+  # N.B.: with a background writer, all netCDF calls have to hold its lock (the library is not thread-safe)
+  lock = writer.lock if writer is not None else threading.Lock() # uncontended without writer
+  with lock:
+    # use data array to infer dimensions and data type
+    if data is not None:
+      # N.B.: besides arrays, array-like objects that are evaluated blockwise are supported (see geodata.lazy)
+      if not isinstance(data,np.ndarray) and not all(hasattr(data,att) for att in ('shape','dtype','__getitem__')): 
+        raise TypeError     
+      if len(dims) != data.ndim: raise NCDataError, "Number of dimensions in '%s' does not match data array."%(name,)    
+      if shape: 
+        if tuple(shape) != data.shape: raise NCDataError, "Shape of '%s' does not match data array."%(name,)
+      else: shape = data.shape
+      # get dtype 
+      if dtype: 
+        if np.dtype(dtype).kind == 'S' and dtype != data.dtype: data = data.astype(dtype)
+        # N.B.: other dtype conversions are applied blockwise, when the data are written
+      else: dtype = data.dtype
+    if dtype is None: raise NCDataError, "Cannot construct a NetCDF Variable without a data array or an abstract data type."
+    dtype = np.dtype(dtype) # use numpy types
+    if dtype is np.dtype('bool_'): dtype = np.dtype('i1') # cast numpy bools as 8-bit integers
+    lstrvar = dtype.kind == 'S'
+    # check/create dimensions
+    if shape is None: shape = [None,]*len(dims)
+    else: shape = list(shape)
+    if len(shape) != len(dims): raise NCAxisError 
+    for i,dim in zip(xrange(len(dims)),dims):
+      if dim in dst.dimensions:
+        if shape[i] is None: 
+          shape[i] = len(dst.dimensions[dim])
+        else: 
+          if shape[i] != len(dst.dimensions[dim]): 
+            raise NCAxisError, 'Size of dimension %s does not match records! %i != %i'%(dim,shape[i],len(dst.dimensions[dim]))
       else: 
-        if shape[i] != len(dst.dimensions[dim]): 
-          raise NCAxisError, 'Size of dimension %s does not match records! %i != %i'%(dim,shape[i],len(dst.dimensions[dim]))
-    else: 
-      if shape[i] is not None: dst.createDimension(dim, size=shape[i])
-      else: raise NCAxisError, "Cannot construct dimension '%s' without size information."%(dims,)
-  dims = tuple(dims); shape = tuple(shape)
-  # figure out parameters for variable
-  varargs = dict() # arguments to be passed to createVariable
-  if isinstance(zlib,dict): varargs.update(zlib)
-  elif zlib: varargs.update(zlib_default)
-  varargs.update(kwargs)
-  if fillValue is None:
-    if atts and '_FillValue' in atts: fillValue = atts['_FillValue'] # will be removed later
-    elif atts and 'missing_value' in atts: fillValue = atts['missing_value']
-    elif data is not None and isinstance(data,ma.MaskedArray): # defaults values for numpy masked arrays
-      fillValue = ma.default_fill_value(dtype)
-      # if isinstance(dtype,np.bool_): fillValue = True
-      # elif isinstance(dtype,np.integer): fillValue = 999999
-      # elif isinstance(dtype,np.floating): fillValue = 1.e20
-      # elif isinstance(dtype,np.complexfloating): fillValue = 1.e20+0j
-      # elif isinstance(dtype,np.flexible): fillValue = 'N/A'
-      # else: fillValue = None # for 'object'
-    else: pass # if it is not a masked array and no missing value information was passed, don't assign fillValue 
-  else:  
-    if data is not None and isinstance(data,ma.MaskedArray): data.set_fill_value(fillValue)
-  # make sure fillValue is OK (there have been problems...)    
-  fillValue = checkFillValue(fillValue, dtype)
-  if fillValue is not None:
-    atts['missing_value'] = fillValue # I use fillValue and missing_value the same way
-  # add extra dimension for strings
-  if lstrvar and dtype.itemsize > 1:
-    # add extra dimension
-    shape = shape + (dtype.itemsize,)
-    dims = dims + ('str_dim_'+name,) # naming pattern for string dimensions
-    dst.createDimension(dims[-1], size=shape[-1])
-    # change dtype to single char string  
-    dtype = np.dtype('|S1')
-    # convert string arrays to char arrays
-    if data is not None: 
-      data = nc.stringtochar(data)
-      assert data.dtype == dtype, str(data.dtype)+', '+str(dtype)    
-  # create netcdf variable  
-  var = dst.createVariable(name, dtype, dims, fill_value=fillValue, **varargs)
-  # add attributes
-  if atts: var.setncatts(coerceAtts(atts))
-  # assign coordinate data if given
-  if data is not None: var[:] = data   
+        if shape[i] is not None: dst.createDimension(dim, size=shape[i])
+        else: raise NCAxisError, "Cannot construct dimension '%s' without size information."%(dims,)
+    dims = tuple(dims); shape = tuple(shape)
+    # figure out parameters for variable
+    varargs = dict() # arguments to be passed to createVariable
+    if isinstance(zlib,dict): varargs.update(zlib)
+    elif zlib: varargs.update(zlib_default)
+    varargs.update(kwargs)
+    if fillValue is None:
+      if atts and '_FillValue' in atts: fillValue = atts['_FillValue'] # will be removed later
+      elif atts and 'missing_value' in atts: fillValue = atts['missing_value']
+      elif data is not None and isinstance(data,ma.MaskedArray): # defaults values for numpy masked arrays
+        fillValue = ma.default_fill_value(dtype)
+        # if isinstance(dtype,np.bool_): fillValue = True
+        # elif isinstance(dtype,np.integer): fillValue = 999999
+        # elif isinstance(dtype,np.floating): fillValue = 1.e20
+        # elif isinstance(dtype,np.complexfloating): fillValue = 1.e20+0j
+        # elif isinstance(dtype,np.flexible): fillValue = 'N/A'
+        # else: fillValue = None # for 'object'
+      else: pass # if it is not a masked array and no missing value information was passed, don't assign fillValue 
+    # N.B.: masked values are filled with fillValue, when the data are written (see below)
+    # make sure fillValue is OK (there have been problems...)    
+    fillValue = checkFillValue(fillValue, dtype)
+    if fillValue is not None:
+      atts['missing_value'] = fillValue # I use fillValue and missing_value the same way
+    # add extra dimension for strings
+    if lstrvar and dtype.itemsize > 1:
+      # add extra dimension
+      shape = shape + (dtype.itemsize,)
+      dims = dims + ('str_dim_'+name,) # naming pattern for string dimensions
+      dst.createDimension(dims[-1], size=shape[-1])
+      # change dtype to single char string  
+      dtype = np.dtype('|S1')
+      # convert string arrays to char arrays
+      if data is not None: 
+        if not isinstance(data,np.ndarray): data = data[:] # evaluate deferred expressions (not written blockwise)
+        data = nc.stringtochar(data)
+        assert data.dtype == dtype, str(data.dtype)+', '+str(dtype)    
+    # create netcdf variable  
+    var = dst.createVariable(name, dtype, dims, fill_value=fillValue, **varargs)
+    # add attributes
+    if atts: var.setncatts(coerceAtts(atts))
+    # assign string data directly
+    if data is not None and lstrvar: var[:] = data
+  # assign other data in blocks (each block acquires the lock separately)
+  if data is not None and not lstrvar: 
+    writeBlocks(var, data, fillValue=fillValue, dtype=dtype, blocksize=blocksize, writer=writer)   
   # return var reference
   return var
 
@@ -256,11 +347,283 @@ def copy_dims(dst, src, dimlist=None, namemap=None, copy_coords=True, **kwargs):
     copy_vars(dst, src, varlist=dimlist, namemap=namemap, dimmap=namemap, remove_dims=remove_dims, **kwargs)
     
 
+## virtual multi-file datasets
+
+# default maximum number of simultaneously open files in a multi-file dataset
+mf_maxopen = 16
+
+class MultiFileDimension(object):
+  ''' A minimal stand-in for a netCDF4 Dimension of a virtual multi-file dataset. '''
+
+  def __init__(self, name, size, unlimited=False):
+    self.name = name; self.size = size; self.unlimited = unlimited
+  def __len__(self): return self.size
+  def isunlimited(self): return self.unlimited
+
+class MultiFileVariable(object):
+  '''
+    A read-only stand-in for a netCDF4 Variable in a virtual multi-file dataset; index ranges along the
+    record dimension are split into hyperslabs, which are read from the files that contain them.
+  '''
+
+  def __init__(self, mfds, ncvar):
+    ''' Copy meta data from the master variable and determine the position of the record dimension. '''
+    self.__dict__['_mfds'] = mfds
+    self.__dict__['_name'] = ncvar._name
+    self.__dict__['dimensions'] = ncvar.dimensions
+    self.__dict__['dtype'] = ncvar.dtype
+    self.__dict__['_atts'] = col.OrderedDict((att,ncvar.getncattr(att)) for att in ncvar.ncattrs())
+    self.__dict__['mask'] = True # automatic masking (like netCDF4)
+    self.__dict__['scale'] = True # automatic scaling (like netCDF4)
+    if mfds.aggdim in ncvar.dimensions:
+      iagg = ncvar.dimensions.index(mfds.aggdim)
+      shape = ncvar.shape[:iagg] + (mfds.offsets[-1],) + ncvar.shape[iagg+1:]
+    else: iagg = None; shape = ncvar.shape # not aggregated: only read from first file
+    self.__dict__['_iagg'] = iagg
+    self.__dict__['shape'] = shape
+
+  @property
+  def name(self): return self._name
+  @property
+  def ndim(self): return len(self.shape)
+  @property
+  def size(self): return int(np.prod(self.shape))
+
+  def ncattrs(self): return self._atts.keys()
+  def getncattr(self, att): return self._atts[att]
+  def __getattr__(self, att):
+    ''' NetCDF attributes are accessible as Python attributes, like in netCDF4. '''
+    if att in self._atts: return self._atts[att]
+    else: raise AttributeError, att
+  def __setattr__(self, att, value):
+    raise NCDataError, "Multi-file datasets are read-only (variable '{:s}').".format(self._name)
+  def group(self): return self._mfds
+  def set_auto_maskandscale(self, flag): self.__dict__['mask'] = flag; self.__dict__['scale'] = flag
+  def set_auto_mask(self, flag): self.__dict__['mask'] = flag
+  def set_auto_scale(self, flag): self.__dict__['scale'] = flag
+  def __len__(self): return self.shape[0]
+
+  def _expandIndex(self, slc):
+    ''' Expand an index expression to one index per dimension (same conventions as netCDF4). '''
+    if isinstance(slc,np.ndarray) or ( isinstance(slc,list) and all([isinstance(s,(int,np.integer)) for s in slc]) ):
+      slcs = [slc] # a single sequence applies to the first dimension
+    elif isinstance(slc,(list,tuple)): slcs = list(slc)
+    else: slcs = [slc]
+    if Ellipsis in slcs:
+      i = slcs.index(Ellipsis)
+      slcs[i:i+1] = [slice(None)]*(self.ndim-len(slcs)+1)
+    if len(slcs) > self.ndim: raise IndexError, "Too many indices for variable '{:s}'.".format(self._name)
+    slcs += [slice(None)]*(self.ndim-len(slcs))
+    return slcs
+
+  def _read(self, ifile, slcs, lidx=None, oax=None):
+    ''' Read a hyperslab from one file; lidx are local record indices. '''
+    ncvar = self._mfds._getHandle(ifile).variables[self._name]
+    ncvar.set_auto_mask(self.mask); ncvar.set_auto_scale(self.scale)
+    if lidx is None: return ncvar[tuple(slcs)]
+    slcs = list(slcs)
+    if isinstance(lidx,(int,np.integer)): slcs[self._iagg] = lidx
+    elif len(lidx) == 0: slcs[self._iagg] = slice(0,0)
+    elif len(lidx) == 1: slcs[self._iagg] = slice(lidx[0],lidx[0]+1)
+    else:
+      step = lidx[1] - lidx[0]
+      if step > 0 and np.all(np.diff(lidx) == step): # regular stride: a single hyperslab
+        slcs[self._iagg] = slice(lidx[0],lidx[-1]+1,step)
+      else: # irregular: read sorted unique records and rearrange in memory
+        uidx, inverse = np.unique(lidx, return_inverse=True)
+        slcs[self._iagg] = list(uidx)
+        return ncvar[tuple(slcs)].take(inverse, axis=oax)
+    return ncvar[tuple(slcs)]
+
+  def __getitem__(self, slc):
+    ''' Read data; indices along the record dimension are mapped to files using the offset table. '''
+    slcs = self._expandIndex(slc)
+    iagg = self._iagg
+    if iagg is None: return self._read(0, slcs) # not an aggregated variable
+    # convert record index to an array of global indices
+    reclen = self.shape[iagg]; ridx = slcs[iagg]
+    lscalar = isinstance(ridx,(int,np.integer))
+    if isinstance(ridx,slice): ridx = np.arange(*ridx.indices(reclen))
+    else:
+      ridx = np.asarray(ridx).reshape(-1)
+      if ridx.dtype == np.bool_: ridx = np.nonzero(ridx)[0]
+      ridx = np.where(ridx < 0, ridx+reclen, ridx)
+      if np.any(ridx < 0) or np.any(ridx >= reclen):
+        raise IndexError, "Index out of bounds for record dimension '{:s}'.".format(self._mfds.aggdim)
+    # position of the record axis in the output (integer indices remove dimensions)
+    oax = iagg - len([s for s in slcs[:iagg] if isinstance(s,(int,np.integer))])
+    offsets = self._mfds.offsets
+    if len(ridx) == 0: # empty selection (still need a hyperslab of the correct shape)
+      return self._read(0, slcs, lidx=np.zeros(0,dtype=np.int), oax=oax)
+    fidx = np.searchsorted(offsets, ridx, side='right') - 1 # file index of each record
+    if lscalar: return self._read(fidx[0], slcs, lidx=int(ridx[0]-offsets[fidx[0]]), oax=oax)
+    # split into runs of records that come from the same file
+    chunks = []
+    for run in np.split(np.arange(len(ridx)), np.nonzero(np.diff(fidx))[0]+1):
+      ifile = fidx[run[0]]
+      chunks.append(self._read(ifile, slcs, lidx=ridx[run]-offsets[ifile], oax=oax))
+    if len(chunks) == 1: data = chunks[0]
+    elif any([isinstance(chunk,ma.MaskedArray) for chunk in chunks]): data = ma.concatenate(chunks, axis=oax)
+    else: data = np.concatenate(chunks, axis=oax)
+    return data
+
+  def __setitem__(self, slc, data):
+    raise NCDataError, "Multi-file datasets are read-only (variable '{:s}').".format(self._name)
+
+
+class MultiFileDataset(object):
+  '''
+    A read-only virtual NetCDF Dataset that aggregates a list of files along a shared record dimension;
+    variables behave like netCDF4 Variables. Files are opened on demand and at most 'maxopen' file
+    handles are kept open at any time (least recently used files are closed first).
+  '''
+
+  def __init__(self, filelist, aggdim=None, maxopen=None, mode='r'):
+    ''' Open files in sequence to build the offset table along the record dimension. '''
+    if mode != 'r': raise NCDataError, "Multi-file datasets are read-only."
+    if isinstance(filelist,basestring): filelist = sorted(glob.glob(filelist)) # glob pattern, like MFDataset
+    if len(filelist) == 0: raise IOError, "No files found for multi-file dataset."
+    for filename in filelist:
+      if not os.path.exists(filename): raise IOError, "File '{:s}' not found.".format(filename)
+    self.filelist = list(filelist)
+    self.maxopen = maxopen or mf_maxopen
+    if self.maxopen < 1: raise ValueError, self.maxopen
+    self._handles = col.OrderedDict() # open file handles, in order of last access
+    # use first file as master for meta data
+    master = self._getHandle(0)
+    if aggdim is None:
+      aggdims = [dim for dim,ncdim in master.dimensions.iteritems() if ncdim.isunlimited()]
+      if len(aggdims) != 1:
+        raise NCAxisError, "Cannot infer record dimension in file '{:s}'; specify 'aggdim'.".format(self.filelist[0])
+      aggdim = aggdims[0]
+    elif aggdim not in master.dimensions: raise NCAxisError, aggdim
+    self.aggdim = aggdim
+    # N.B.: the offset table maps global record indices to files: file i holds records offsets[i]:offsets[i+1]
+    reclens = []
+    for i in xrange(len(self.filelist)):
+      ds = self._getHandle(i)
+      if aggdim not in ds.dimensions:
+        raise NCAxisError, "Record dimension '{:s}' not found in file '{:s}'.".format(aggdim,self.filelist[i])
+      reclens.append(len(ds.dimensions[aggdim]))
+    self.offsets = np.concatenate(([0],np.cumsum(reclens))).astype(np.int64)
+    # meta data (from master file)
+    master = self._getHandle(0)
+    self._atts = col.OrderedDict((att,master.getncattr(att)) for att in master.ncattrs())
+    self.dimensions = col.OrderedDict()
+    for dim,ncdim in master.dimensions.iteritems():
+      if dim == aggdim: self.dimensions[dim] = MultiFileDimension(dim, int(self.offsets[-1]), unlimited=True)
+      else: self.dimensions[dim] = MultiFileDimension(dim, len(ncdim), unlimited=ncdim.isunlimited())
+    self.variables = col.OrderedDict((name,MultiFileVariable(self, ncvar)) for name,ncvar in master.variables.iteritems())
+
+  def _getHandle(self, ifile):
+    ''' Return an open file handle; open on demand and close the least recently used file, if necessary. '''
+    if ifile in self._handles:
+      ds = self._handles.pop(ifile) # move to end
+    else:
+      while len(self._handles) >= self.maxopen:
+        self._handles.popitem(last=False)[1].close()
+      ds = nc.Dataset(self.filelist[ifile], mode='r')
+    self._handles[ifile] = ds
+    return ds
+
+  @property
+  def nopen(self): return len(self._handles)
+
+  def ncattrs(self): return self._atts.keys()
+  def getncattr(self, att): return self._atts[att]
+  def __getattr__(self, att):
+    ''' NetCDF attributes are accessible as Python attributes, like in netCDF4. '''
+    if att[0] != '_' and att in self._atts: return self._atts[att]
+    else: raise AttributeError, att
+  def filepath(self): return self.filelist[0]
+  def setncatts(self, atts): raise NCDataError, "Multi-file datasets are read-only."
+  def sync(self): pass # read-only
+  def close(self):
+    ''' Close all open file handles (files will be reopened on demand). '''
+    while len(self._handles) > 0: self._handles.popitem()[1].close()
+
+
+## memory-mapped access to NetCDF3 files
+
+# NetCDF3 (classic and 64-bit offset) type codes and (big-endian) numpy types
+nc3_types = {1:'>i1', 2:'|S1', 3:'>i2', 4:'>i4', 5:'>f4', 6:'>f8'}
+_nc3_headers = dict() # cache for parsed file headers (indexed by file path)
+
+def readNC3Header(filepath):
+  ''' Parse the header of a NetCDF3 classic or 64-bit offset file; returns the number of records, the record 
+      size, and a dictionary with shape, dtype, offset, and record flag of each variable (or None, if the 
+      file is not in one of these formats). '''
+  f = open(filepath, 'rb')
+  try:
+    magic = f.read(4)
+    if magic[:3] != 'CDF' or magic[3] not in ('\x01','\x02'): return None
+    l64bit = magic[3] == '\x02' # 64-bit offset format
+    def readint(fmt='>i'): return struct.unpack(fmt, f.read(struct.calcsize(fmt)))[0]
+    def readname(): 
+      n = readint(); name = f.read(n); f.seek(-n%4, 1) # names are padded to 4 bytes
+      return name
+    def skipatts():
+      readint(); natts = readint() # tag and number of attributes
+      for i in xrange(natts):
+        readname(); nctype = readint(); nbytes = readint()*np.dtype(nc3_types[nctype]).itemsize
+        f.seek(nbytes + (-nbytes%4), 1)
+    numrecs = readint('>I')
+    # dimensions (length 0 is the record dimension)
+    readint(); dims = [(readname(),readint()) for i in xrange(readint())]
+    skipatts() # global attributes
+    # variables
+    readint(); nvars = readint()
+    variables = col.OrderedDict(); recvars = []; recsize = 0
+    for i in xrange(nvars):
+      name = readname()
+      dimids = [readint() for j in xrange(readint())]
+      skipatts()
+      dtype = np.dtype(nc3_types[readint()]); vsize = readint('>I')
+      begin = readint('>q' if l64bit else '>i')
+      shape = tuple(dims[dimid][1] for dimid in dimids)
+      lrec = len(dimids) > 0 and dims[dimids[0]][1] == 0
+      if lrec: recsize += vsize; recvars.append(name)
+      variables[name] = (shape, dtype, begin, lrec)
+    # N.B.: if there is only one record variable, records are not padded
+    if len(recvars) == 1: 
+      shape, dtype = variables[recvars[0]][:2] 
+      recsize = int(np.prod(shape[1:]))*dtype.itemsize
+    if numrecs == 0xFFFFFFFF and recsize > 0: # streaming: infer number of records from file size
+      numrecs = ( os.path.getsize(filepath) - min(variables[var][2] for var in recvars) ) // recsize  
+  finally: f.close()
+  return numrecs, recsize, variables
+
+def memmapNC3(ncvar, mode='c'):
+  ''' Return a memory-mapped view of the data of a netCDF4 Variable stored in a NetCDF3 classic or 64-bit 
+      offset file (or None, if the file has a different format); record variables are strided views into 
+      the record section. No data are read until accessed, and no auto-masking or scaling is applied. 
+      N.B.: by default the mapping is copy-on-write (mode='c'), i.e. changes are never written to disk. '''
+  if isinstance(ncvar, MultiFileVariable): return None # data are spread over several files
+  filepath = ncvar.group().filepath()
+  stat = os.stat(filepath)
+  if filepath not in _nc3_headers or _nc3_headers[filepath][0] != (stat.st_size, stat.st_mtime):
+    _nc3_headers[filepath] = ((stat.st_size, stat.st_mtime), readNC3Header(filepath)) # (re-)parse header
+  header = _nc3_headers[filepath][1]
+  if header is None: return None
+  numrecs, recsize, variables = header
+  shape, dtype, begin, lrec = variables[ncvar._name]
+  # C-order strides within one record/variable
+  strides = tuple(np.cumprod((dtype.itemsize,)+shape[:0:-1])[::-1]) if len(shape) > 0 else ()
+  if lrec:
+    shape = (numrecs,)+shape[1:]; strides = (recsize,)+strides[1:]
+    if numrecs == 0: return np.zeros(shape, dtype=dtype)
+  # map entire file (only a virtual address range) and create view
+  mm = np.memmap(filepath, dtype=np.uint8, mode=mode)
+  return np.ndarray(shape, dtype=dtype, buffer=mm, offset=begin, strides=strides)
+
+
 ## Dataset functions
 
 def writeNetCDF(dataset, ncfile, ncformat='NETCDF4', zlib=True, writeData=True, overwrite=True, skipUnloaded=False, 
-                feedback=False, close=True):
-  ''' A function to write the data in a generic Dataset to a NetCDF file. '''
+                feedback=False, close=True, blocksize=None, lthread=False):
+  ''' A function to write the data in a generic Dataset to a NetCDF file; data are streamed to file in blocks 
+      of at most blocksize bytes, without copying the arrays; if lthread=True, blocks are written to file in 
+      a background thread, while the next blocks are prepared (all netCDF calls are serialized with a lock). '''
   if feedback: print("Writing to file: '{:s}'".format(ncfile)) # print feedback
   # open file
   if isinstance(ncfile,basestring): 
@@ -269,16 +632,32 @@ def writeNetCDF(dataset, ncfile, ncformat='NETCDF4', zlib=True, writeData=True,
   elif not isinstance(ncfile,nc.Dataset): raise TypeError
   #if ncfile.mode == 'r': raise NCDataError, "Need write permission on NetCDF dataset."
   ncfile.setncatts(coerceAtts(dataset.atts))
-  # add coordinate variables first
-  for name,ax in dataset.axes.iteritems():
-    # only need to add real coordinate axes; simple dimensions are added on-the-fly by ariables
-    data = ax.getArray(unmask=True) if writeData and ( ax.data or not skipUnloaded ) else None
-    add_coord(ncfile, name, length=len(ax), data=data, atts=coerceAtts(ax.atts), dtype=ax.dtype, zlib=zlib, fillValue=ax.fillValue)
-  # now add variables
-  for name,var in dataset.variables.iteritems():
-    dims = tuple([ax.name for ax in var.axes])
-    data = var.getArray(unmask=True) if writeData and ( var.data or not skipUnloaded ) else None  
-    add_var(ncfile, name, dims=dims, data=data, atts=coerceAtts(var.atts), dtype=var.dtype, zlib=zlib, fillValue=var.fillValue)
+  writer = BlockWriter() if lthread else None
+  if writer is not None: writer.start()
+  lock = writer.lock if writer is not None else threading.Lock() # uncontended without writer
+  try:
+    # add coordinate variables first
+    for name,ax in dataset.axes.iteritems():
+      # only need to add real coordinate axes; simple dimensions are added on-the-fly by ariables
+      with lock: data = ax.getArray(unmask=False, copy=False) if writeData and ( ax.data or not skipUnloaded ) else None
+      add_coord(ncfile, name, length=len(ax), data=data, atts=coerceAtts(ax.atts), dtype=ax.dtype, zlib=zlib, 
+                fillValue=ax.fillValue, blocksize=blocksize, writer=writer)
+    # now add variables
+    for name,var in dataset.variables.iteritems():
+      dims = tuple([ax.name for ax in var.axes])
+      if writeData and not skipUnloaded and not var.data and getattr(var,'expression',None) is not None: 
+        data = var.expression # N.B.: deferred expressions are evaluated blockwise, while they are written
+      else: 
+        with lock: data = var.getArray(unmask=False, copy=False) if writeData and ( var.data or not skipUnloaded ) else None
+      # N.B.: masked values are filled blockwise in add_var (without a full copy)  
+      add_var(ncfile, name, dims=dims, data=data, atts=coerceAtts(var.atts), dtype=var.dtype, zlib=zlib, 
+              fillValue=var.fillValue, blocksize=blocksize, writer=writer)
+  except:
+    # N.B.: don't let errors from the writer thread hide the original exception
+    if writer is not None: writer.close(lraise=False)
+    raise
+  else:
+    if writer is not None: writer.close() # wait for writer to finish
   # close file or return file handle
   ncfile.sync()
   if close: ncfile.close()
@@ -9,6 +9,7 @@ Modified statistical functions from scipy.stats
 import numpy as np
 # imports from scipy's internal stats-helper module
 from scipy.stats.stats import betai, ss, _chk_asarray, rankdata, distributions
+from scipy import special
 
 ## Pearson's linear correlation coefficient
 def pearsonr(x, y, dof=None):
@@ -195,5 +196,126 @@ def spearmanr(a, b=None, axis=0, dof=None):
         return rs, prob
 
 
+## vectorized correlation engines
+# N.B.: these functions operate along the last axis of (broadcastable) arrays and compute the correlation
+#       of all series at once; NaN's are removed pairwise (series with less than 3 valid pairs return NaN)
+
+def rankdata_last(a):
+    """
+    Assign average ranks (like rankdata) to all series along the last axis 
+    at once; NaN's are not ranked and remain NaN.
+    """
+    a = np.asarray(a, dtype=np.float64)
+    shape = a.shape; n = shape[-1]
+    a = a.reshape((-1,n)); rows = np.arange(a.shape[0]).reshape((-1,1))
+    order = np.argsort(a, axis=-1, kind='mergesort') # NaN's are sorted last
+    srt = a[rows,order]
+    idx = np.arange(n)
+    lend = np.ones(srt.shape, dtype=np.bool) # last element of each group of ties
+    with np.errstate(invalid='ignore'): lend[:,:-1] = srt[:,1:] != srt[:,:-1]
+    lstart = np.ones(srt.shape, dtype=np.bool); lstart[:,1:] = lend[:,:-1]
+    start = np.maximum.accumulate(np.where(lstart, idx, 0), axis=-1)
+    end = np.minimum.accumulate(np.where(lend, idx, n)[:,::-1], axis=-1)[:,::-1]
+    ranks = np.empty_like(srt)
+    ranks[rows,order] = ( start + end ) / 2. + 1. # scatter back to original order
+    ranks[np.isnan(a)] = np.NaN
+    return ranks.reshape(shape)
+
+
+def corr_pval(r, df):
+    """
+    Two-sided p-values of correlation coefficients, based on the t-distribution 
+    with df degrees of freedom; df can be an array (e.g. effective degrees of 
+    freedom for each point).
+    """
+    r = np.asarray(r, dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t_squared = r*r * (df / ((1.0 - r) * (1.0 + r)))
+        prob = special.betainc(0.5*df, 0.5, np.minimum(df / (df + t_squared), 1.0))
+    return np.where(np.abs(r) == 1.0, 0.0, prob)
+
+
+def effective_dof(x, y):
+    """
+    Effective degrees of freedom for the correlation of two autocorrelated 
+    series along the last axis, based on the lag-1 autocorrelation of each 
+    series: n*(1-r1x*r1y)/(1+r1x*r1y) - 2 (Bretherton et al., 1999); the 
+    result can be passed as 'dof' to the vectorized correlation functions.
+    """
+    def lag1(a):
+        a = np.asarray(a, dtype=np.float64)
+        am = a - np.nanmean(a, axis=-1)[...,np.newaxis]
+        return np.nansum(am[...,1:]*am[...,:-1], axis=-1) / np.nansum(am*am, axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r1 = lag1(x) * lag1(y)
+        n = np.invert(np.isnan(x) | np.isnan(y)).sum(axis=-1)
+        return n * (1.0 - r1) / (1.0 + r1) - 2.
+
+
+def _valid_pairs(x, y, ignoreNaN=True):
+    """ remove invalid pairs (set to NaN in both) and count valid pairs """
+    x, y = np.broadcast_arrays(x, y)
+    if ignoreNaN:
+        lnan = np.isnan(x) | np.isnan(y)
+        x = np.where(lnan, np.NaN, x); y = np.where(lnan, np.NaN, y)
+        n = np.invert(lnan).sum(axis=-1)
+    else: n = np.zeros(x.shape[:-1], dtype=np.int) + x.shape[-1]
+    return x, y, n
+
+
+def _pearsonr_last(x, y, ignoreNaN=True):
+    """ correlation coefficients and number of valid pairs along the last axis """
+    x = np.asarray(x, dtype=np.float64); y = np.asarray(y, dtype=np.float64)
+    if x.ndim == 1 and y.ndim > 1: x, y = y, x # reference series should be second
+    if y.ndim == 1 and not np.isnan(y).any() and not np.isnan(x).any():
+        # one reference series against many: a single matrix-vector product
+        n = np.zeros(x.shape[:-1], dtype=np.int) + x.shape[-1]
+        xm = x - x.mean(axis=-1)[...,np.newaxis]; ym = y - y.mean()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            r = np.dot(xm, ym) / np.sqrt(ss(xm, axis=-1) * ss(ym))
+    else:
+        x, y, n = _valid_pairs(x, y, ignoreNaN=ignoreNaN)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            xm = x - ( np.nansum(x, axis=-1) / n )[...,np.newaxis] 
+            ym = y - ( np.nansum(y, axis=-1) / n )[...,np.newaxis]
+            r = np.nansum(xm * ym, axis=-1) / np.sqrt(np.nansum(xm*xm, axis=-1) * np.nansum(ym*ym, axis=-1))
+        if not ignoreNaN: r = np.where(np.isnan(x).any(axis=-1) | np.isnan(y).any(axis=-1), np.NaN, r)
+    r = np.clip(r, -1.0, 1.0) # NaN's are preserved
+    if ignoreNaN: r = np.where(n < 3, np.NaN, r)
+    return r, n
+
+
+def pearsonr_vectorized(x, y, dof=None, ignoreNaN=True):
+    """
+    Pearson correlation coefficients and p-values (same as pearsonr) for all 
+    series along the last axis at once; if y (or x) is a single 1D reference 
+    series, all correlations are computed with one matrix operation.
+    If dof=None, the degrees of freedom are n-2, otherwise dof is used as the
+    degrees of freedom (can be an array).
+    """
+    r, n = _pearsonr_last(x, y, ignoreNaN=ignoreNaN)
+    df = n - 2 if dof is None else dof
+    return r, corr_pval(r, df)
+
+
+def spearmanr_vectorized(x, y, dof=None, ignoreNaN=True):
+    """
+    Spearman rank-order correlation coefficients and p-values (same as 
+    spearmanr) for all series along the last axis at once; NaN's are removed
+    pairwise before ranking. 
+    If dof=None, the number of samples is inferred from the valid pairs,
+    otherwise dof is used (as in spearmanr).
+    """
+    x = np.asarray(x, dtype=np.float64); y = np.asarray(y, dtype=np.float64)
+    if ignoreNaN and ( np.isnan(x).any() or np.isnan(y).any() ):
+        x, y, n = _valid_pairs(x, y, ignoreNaN=True) # pairwise removal changes ranks
+    rs, n = _pearsonr_last(rankdata_last(x), rankdata_last(y), ignoreNaN=ignoreNaN)
+    if dof is not None: n = dof
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = rs * np.sqrt((n-2) / ((rs+1.0)*(1.0-rs)))
+        prob = distributions.t.sf(np.abs(t),n-2)*2
+    return rs, prob
+
+
 if __name__ == '__main__':
     pass
\ No newline at end of file